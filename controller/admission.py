@@ -0,0 +1,143 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+admission.py
+gRPC admission control
+Server interceptor authenticating the calls, rate limiting the clients & shedding the load beyond the capacity of the controller
+'''
+
+import asyncio
+import hmac
+import logging
+import time
+
+import grpc
+
+from commands import TokenBucket
+import metrics
+
+# Maximum number of unary calls being handled at once, beyond which calls are rejected at once (RESOURCE_EXHAUSTED) rather than queued
+MAX_INFLIGHT = 64
+# Priority lanes: method: share of MAX_INFLIGHT its calls may use (the other methods using DEFAULT_LANE),
+# lower priority calls being shed first so that commands still go through under a flood of reads
+LANES = {'SetState': 1., 'GetState': .75}
+DEFAULT_LANE = .5
+# Maximum number of streams (WatchState, Control) open at once
+MAX_STREAMS = 32
+# Per-client (peer address) rate limit of the calls: token bucket refilled at RATE_LIMIT [calls/s], up to RATE_BURST calls
+RATE_LIMIT = 100.
+RATE_BURST = 200.
+# Clients tracked by the rate limiter, beyond which the idle ones are forgotten
+MAX_CLIENTS = 1024
+
+# Metrics
+REJECTED = metrics.Counter('zbctrl_grpc_rejected_total', 'Calls rejected by the admission control, per method & reason', ['method', 'reason'])
+
+
+class AdmissionInterceptor(grpc.aio.ServerInterceptor):
+    '''Server interceptor admitting each call once, before its handler runs:
+    - rate limit per client (peer address): RESOURCE_EXHAUSTED, the next messages of the client streams (eg. Control commands)
+      taking a token each too, waiting for it (slowing down the reading of the stream)
+    - authentication by the API key of the request (of the first message for client streams), compared in constant time: UNAUTHENTICATED
+    - in-flight cap, per priority lane for the unary calls, and on the open streams: RESOURCE_EXHAUSTED
+    The handlers being called only once admitted, they need not authenticate the requests'''
+
+    def __init__(self, apikey, maxInflight=MAX_INFLIGHT, maxStreams=MAX_STREAMS, rateLimit=RATE_LIMIT, rateBurst=RATE_BURST):
+        self.apikey = apikey.encode('utf-8')
+        self.maxInflight = maxInflight
+        self.maxStreams = maxStreams
+        self.rateLimit = rateLimit
+        self.rateBurst = rateBurst
+        self.inflight = 0
+        self.streams = 0
+        # Client: TokenBucket
+        self._buckets = {}
+
+    async def intercept_service(self, continuation, handlerCallDetails):
+        handler = await continuation(handlerCallDetails)
+        if handler is None:
+            return None
+        method = handlerCallDetails.method.rsplit('/', 1)[-1]
+        if handler.unary_unary is not None:
+            limit = LANES.get(method, DEFAULT_LANE) * self.maxInflight
+            async def unaryUnary(req, ctx):
+                await self._admit(method, req, ctx)
+                if self.inflight >= limit:
+                    return await self._reject(method, ctx, 'inflight', 'Too many requests in flight')
+                self.inflight += 1
+                try:
+                    return await handler.unary_unary(req, ctx)
+                finally:
+                    self.inflight -= 1
+            return grpc.unary_unary_rpc_method_handler(unaryUnary, request_deserializer=handler.request_deserializer, response_serializer=handler.response_serializer)
+        if handler.unary_stream is not None:
+            async def unaryStream(req, ctx):
+                await self._admitStream(method, req, ctx)
+                try:
+                    async for res in handler.unary_stream(req, ctx):
+                        yield res
+                finally:
+                    self.streams -= 1
+            return grpc.unary_stream_rpc_method_handler(unaryStream, request_deserializer=handler.request_deserializer, response_serializer=handler.response_serializer)
+        if handler.stream_stream is not None:
+            async def streamStream(reqIter, ctx):
+                requests = reqIter.__aiter__()
+                req = await anext(requests, None)
+                if req is None:
+                    return
+                await self._admitStream(method, req, ctx)
+                async def admittedRequests():
+                    yield req
+                    async for nextReq in requests:
+                        await self._throttle(ctx)
+                        yield nextReq
+                try:
+                    async for res in handler.stream_stream(admittedRequests(), ctx):
+                        yield res
+                finally:
+                    self.streams -= 1
+            return grpc.stream_stream_rpc_method_handler(streamStream, request_deserializer=handler.request_deserializer, response_serializer=handler.response_serializer)
+        return handler
+
+    async def _reject(self, method, ctx, reason, details):
+        REJECTED.labels(method, reason).inc()
+        logging.warning('  Rejecting %s call from %s: %s', method, ctx.peer(), details)
+        await ctx.abort(grpc.StatusCode.UNAUTHENTICATED if reason == 'auth' else grpc.StatusCode.RESOURCE_EXHAUSTED, details)
+
+    def _bucket(self, ctx, now):
+        '''TokenBucket of the client of a call'''
+        client = ctx.peer()
+        if client.startswith(('ipv4:', 'ipv6:')):
+            # Client address, without the port
+            client = client.rsplit(':', 1)[0]
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            if len(self._buckets) >= MAX_CLIENTS:
+                self._buckets = {key: bucket for key, bucket in self._buckets.items() if not bucket.idle(now)}
+            bucket = self._buckets[client] = TokenBucket(self.rateLimit, self.rateBurst, now)
+        return bucket
+
+    async def _admit(self, method, req, ctx):
+        '''Rate limit & authenticate a call (aborting it if not admitted)'''
+        now = time.monotonic()
+        if self._bucket(ctx, now).take(now) > 0.:
+            await self._reject(method, ctx, 'rate', 'Rate limit exceeded')
+        if not hmac.compare_digest(req.key.encode('utf-8'), self.apikey):
+            await self._reject(method, ctx, 'auth', 'Invalid API key')
+
+    async def _throttle(self, ctx):
+        '''Wait for a token of the client of a stream, for its next message'''
+        while True:
+            now = time.monotonic()
+            delay = self._bucket(ctx, now).take(now)
+            if delay <= 0.:
+                return
+            await asyncio.sleep(delay)
+
+    async def _admitStream(self, method, req, ctx):
+        '''Admit a stream (aborting it if not admitted), counted as open once admitted'''
+        await self._admit(method, req, ctx)
+        if self.streams >= self.maxStreams:
+            await self._reject(method, ctx, 'streams', 'Too many streams open')
+        self.streams += 1
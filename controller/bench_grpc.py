@@ -0,0 +1,208 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+bench_grpc.py
+End-to-end gRPC benchmark
+Driving GetState & SetState against ZBCtrlSrv over a simulated network, measuring throughput, latency, event loop lag & memory
+'''
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import platform
+import random
+import resource
+import sys
+import time
+
+import grpc
+
+from zbCtrl_pb2 import GetStateRequest, SetStateRequest, DeviceStates, StateFormat
+from zbCtrl_pb2_grpc import ZBCtrlStub
+
+# Benchmarked numbers of devices
+DEVICE_COUNTS = [3, 100, 1000, 10000]
+# Workload mix: operation: weight
+#   get: full GetState, delta: GetState since the last known version, set: SetState of SET_DEVICES random devices
+WORKLOAD_MIX = {'get': 0.7, 'delta': 0.2, 'set': 0.1}
+SET_DEVICES = 3
+# Concurrent clients, and duration of each measure after warm-up [seconds]
+CONCURRENCY = 8
+DURATION = 10.
+WARMUP = 2.
+# Deadlines of the requests, as set by the gateway [seconds]
+GETSTATE_DEADLINE = 1.
+SETSTATE_DEADLINE = 5.
+# Simulated network (see simulator.py), the number of devices being appended
+SIM_SPEC = 'latency=0.02,seed=1'
+# Sampling period of the event loop lag of the server [seconds]
+LAG_PERIOD = 0.01
+API_KEY = 'bench'
+# Per-client rate limit of the admission control [calls/s]: the clients sharing a single address,
+# not limited by default (the production one, admission.RATE_LIMIT, measuring the rejections)
+RATE_LIMIT = 1e9
+
+
+def percentile(values, q):
+    '''q-quantile of sorted values'''
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def summary(latencies, errors, duration):
+    '''Throughput [requests/s] & latency percentiles [seconds] of the requests of an operation'''
+    latencies = sorted(latencies)
+    return {
+        'count': len(latencies),
+        'errors': errors,
+        'throughput': len(latencies) / duration,
+        'p50': percentile(latencies, 0.5),
+        'p99': percentile(latencies, 0.99),
+        'p999': percentile(latencies, 0.999),
+        'max': latencies[-1] if latencies else None,
+    }
+
+
+def serverMain(devices, rateLimit, conn):
+    '''Server process: ZBCtrlSrv over a simulated network of devices, built as by server.py (admission control
+    with a per-client rateLimit [calls/s], server options), on a local port sent through conn,
+    until asked to stop; then sending back its event loop lag & memory stats'''
+    from zigbee import ZBInterface
+    from controller import ZBCtrl
+    from server import newServer
+    import simulator
+    import logsetup
+    logsetup.setup(logging.WARNING)
+    async def main():
+        loop = asyncio.get_running_loop()
+        spec = '%s,devices=%d' % (SIM_SPEC, devices)
+        zbi = ZBInterface(zpDbPath='', adapterPath='', appFactory=simulator.SimulatedApplication.factory(spec))
+        ctrl = ZBCtrl(zbi, simulator.deviceIds(devices))
+        await ctrl.start()
+        await ctrl.ready.wait()
+        server = newServer(ctrl, API_KEY, rateLimit=rateLimit)
+        port = server.add_insecure_port('127.0.0.1:0')
+        await server.start()
+        lags = []
+        async def sampleLag():
+            while True:
+                start = loop.time()
+                await asyncio.sleep(LAG_PERIOD)
+                lags.append(loop.time() - start - LAG_PERIOD)
+        lagTask = asyncio.create_task(sampleLag())
+        conn.send(port)
+        # Commands: 'reset' (end of warm-up), 'stop'
+        while (await loop.run_in_executor(None, conn.recv)) != 'stop':
+            lags.clear()
+        lagTask.cancel()
+        lags.sort()
+        conn.send({
+            'loop_lag': {'p50': percentile(lags, 0.5), 'p99': percentile(lags, 0.99), 'max': lags[-1] if lags else None},
+            'rss_max_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        })
+        await server.stop(1)
+        await ctrl.stop()
+    asyncio.run(main())
+
+
+async def client(stub, deviceIds, mix, fmt, stats, until, rng):
+    '''Client loop: sending requests of the workload mix until the until [loop time]'''
+    loop = asyncio.get_running_loop()
+    ops, weights = list(mix), list(mix.values())
+    version = None
+    while loop.time() < until:
+        op = rng.choices(ops, weights)[0]
+        start = time.perf_counter()
+        try:
+            if op == 'set':
+                devices = rng.sample(deviceIds, min(SET_DEVICES, len(deviceIds)))
+                req = SetStateRequest(key=API_KEY, devices=DeviceStates(ids=devices, states=[rng.randint(0, 1) for _ in devices]))
+                await stub.SetState(req, timeout=SETSTATE_DEADLINE)
+            else:
+                req = GetStateRequest(key=API_KEY, format=fmt)
+                if op == 'delta' and version is not None:
+                    req.since_version = version
+                res = await stub.GetState(req, timeout=GETSTATE_DEADLINE)
+                version = res.version
+        except grpc.RpcError:
+            stats[op][1] += 1
+            continue
+        stats[op][0].append(time.perf_counter() - start)
+
+async def measure(port, devices, mix, fmt, concurrency, duration, conn):
+    '''Run the clients against the server on port, returning the results of the measure'''
+    import simulator
+    deviceIds = simulator.deviceIds(devices)
+    loop = asyncio.get_running_loop()
+    async with grpc.aio.insecure_channel('127.0.0.1:%d' % port) as channel:
+        stub = ZBCtrlStub(channel)
+        # Warm-up, then measure
+        for phase, phaseDuration in [('warmup', WARMUP), ('measure', duration)]:
+            stats = {op: [[], 0] for op in mix}
+            until = loop.time() + phaseDuration
+            start = time.perf_counter()
+            await asyncio.gather(*[client(stub, deviceIds, mix, fmt, stats, until, random.Random(i)) for i in range(concurrency)])
+            elapsed = time.perf_counter() - start
+            if phase == 'warmup':
+                conn.send('reset')
+    conn.send('stop')
+    serverStats = await loop.run_in_executor(None, conn.recv)
+    allLatencies = [latency for latencies, _ in stats.values() for latency in latencies]
+    return {
+        'devices': devices,
+        'ops': {op: summary(latencies, errors, elapsed) for op, (latencies, errors) in stats.items()},
+        'total': summary(allLatencies, sum(errors for _, errors in stats.values()), elapsed),
+        'server': serverStats,
+    }
+
+def run(devices, mix, fmt, concurrency, duration, rateLimit):
+    '''Benchmark a server with devices in its own process'''
+    conn, serverConn = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=serverMain, args=(devices, rateLimit, serverConn))
+    process.start()
+    try:
+        port = conn.recv()
+        return asyncio.run(measure(port, devices, mix, fmt, concurrency, duration, conn))
+    finally:
+        process.join(10)
+        if process.is_alive():
+            process.terminate()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='End-to-end gRPC benchmark of the controller over a simulated network')
+    parser.add_argument('--devices', default=','.join(str(count) for count in DEVICE_COUNTS), help='comma-separated numbers of devices')
+    parser.add_argument('--mix', default=','.join('%s=%s' % item for item in WORKLOAD_MIX.items()), help='workload mix, eg. get=0.7,delta=0.2,set=0.1')
+    parser.add_argument('--format', default='JSON', choices=StateFormat.keys(), help='state format of GetState')
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY, help='concurrent clients')
+    parser.add_argument('--duration', type=float, default=DURATION, help='duration of each measure [seconds]')
+    parser.add_argument('--rate-limit', type=float, default=RATE_LIMIT, help='per-client rate limit of the admission control [calls/s]')
+    parser.add_argument('--json', metavar='PATH', help='write the results as JSON to PATH (- for stdout)')
+    args = parser.parse_args()
+    mix = {op: float(weight) for op, weight in (item.split('=') for item in args.mix.split(','))}
+    if not set(mix) <= set(WORKLOAD_MIX):
+        parser.error('Unknown operation in mix, expecting %s' % list(WORKLOAD_MIX))
+
+    results = {
+        'params': {'mix': mix, 'format': args.format, 'concurrency': args.concurrency, 'duration': args.duration, 'rate_limit': args.rate_limit, 'sim': SIM_SPEC},
+        'env': {'python': platform.python_version(), 'grpc': grpc.__version__, 'machine': platform.machine()},
+        'results': [],
+    }
+    out = sys.stderr if args.json == '-' else sys.stdout
+    print('%8s %6s %10s %10s %10s %10s %7s %10s %10s' % ('devices', 'op', 'req/s', 'p50 [ms]', 'p99 [ms]', 'p99.9 [ms]', 'errors', 'lag p99', 'rss [MB]'), file=out)
+    for devices in [int(count) for count in args.devices.split(',')]:
+        result = run(devices, mix, StateFormat.Value(args.format), args.concurrency, args.duration, args.rate_limit)
+        results['results'].append(result)
+        ms = lambda value: value * 1e3 if value is not None else float('nan')
+        for op, stats in list(result['ops'].items()) + [('total', result['total'])]:
+            print('%8d %6s %10.0f %10.2f %10.2f %10.2f %7d %10.2f %10.1f' % (devices, op, stats['throughput'], ms(stats['p50']), ms(stats['p99']), ms(stats['p999']), stats['errors'],
+                                                                         ms(result['server']['loop_lag']['p99']), result['server']['rss_max_kb'] / 1024), file=out)
+    if args.json == '-':
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
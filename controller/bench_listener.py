@@ -0,0 +1,69 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+bench_listener.py
+Listener benchmark
+Measuring how many frames per second ZBListener.handle_message processes, per type of frame
+'''
+
+import asyncio
+import logging
+import time
+from types import SimpleNamespace
+
+import zigpy.types # EUI64
+import zigpy.zcl.clusters.general # Basic, OnOff, LevelControl
+
+from zigbee import ZBListener
+import logsetup
+
+# Frames captured on the network (see README): (name, profile, cluster, src_ep, message)
+FRAMES = [
+    ('onoff report', 260, 6, 1, b'\x08\x01\n\x00\x00\x10\x01'),
+    ('onoff command', 260, 6, 1, b'\x01\x1b\x00'),
+    ('level command', 260, 8, 1, b'\x01_\x05\x00S'),
+    ('basic read rsp', 260, 0, 1, b'\x18\x14\x01\x04\x00\x00B\x0eIKEA of Sweden\x05\x00\x00B\x16TRADFRI control outlet'),
+    ('ota query', 260, 25, 1, b'\x01\x02\x01\x01|\x11\x01\x11#F\x02 <\x00'),
+    ('zdo', 0, 32773, 0, b'\x11\x00=z\x02\x01\xf2'),
+]
+# Frames processed between two yields to the event loop (running the listener callbacks)
+CHUNK = 1000
+# Duration of each measure [seconds]
+DURATION = 1.
+
+
+def makeDevice():
+    '''Minimal device with the endpoint & clusters of a TRADFRI control outlet'''
+    device = SimpleNamespace(ieee=zigpy.types.EUI64.convert('70:ac:08:ff:fe:7e:0b:01'), name='outlet', endpoints={})
+    endpoint = SimpleNamespace(device=device, endpoint_id=1, in_clusters={})
+    for clusterType in [zigpy.zcl.clusters.general.Basic, zigpy.zcl.clusters.general.OnOff, zigpy.zcl.clusters.general.LevelControl]:
+        endpoint.in_clusters[clusterType.cluster_id] = clusterType(endpoint)
+    device.endpoints[1] = endpoint
+    return device
+
+async def measure(listener, device, frames):
+    '''Frames per second processed by listener, cycling through frames'''
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < DURATION:
+        for i in range(CHUNK):
+            _, profile, cluster, srcEp, message = frames[i % len(frames)]
+            listener.handle_message(device, profile, cluster, srcEp, 1, message)
+        count += CHUNK
+        await asyncio.sleep(0)
+    return count / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    logsetup.setup(logging.WARNING)
+    async def main():
+        async def callback(device, state):
+            pass
+        listener = ZBListener(callback)
+        device = makeDevice()
+        print('%16s %12s' % ('frame', 'frames/s'))
+        for frame in FRAMES:
+            print('%16s %12.0f' % (frame[0], await measure(listener, device, [frame])))
+        print('%16s %12.0f' % ('mix', await measure(listener, device, FRAMES)))
+    asyncio.run(main())
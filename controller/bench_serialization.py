@@ -0,0 +1,54 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+bench_serialization.py
+Serialization benchmark
+Comparing the cost & payload size of the JSON and PROTO state formats of GetStateResponse
+'''
+
+import json
+import timeit
+
+from zbCtrl_pb2 import GetStateResponse, StateFormat
+from server import ZBCtrlSrv
+
+# Number of devices in the benchmarked states
+DEVICE_COUNTS = [10, 1000, 10000]
+# Minimum duration of each measure [seconds]
+MIN_DURATION = 0.5
+
+
+def makeState(count):
+    '''Build a state dict of count devices, with EUI64 string IDs & mixed states'''
+    return {':'.join('%02x' % b for b in i.to_bytes(8, 'big')): (i % 3) - 1 for i in range(count)}
+
+def encode(state, fmt):
+    '''Controller side: state dict to wire bytes'''
+    return GetStateResponse(**ZBCtrlSrv._encodeState(state, fmt)).SerializeToString()
+
+def decode(data, fmt):
+    '''Client side: wire bytes to state dict'''
+    res = GetStateResponse.FromString(data)
+    if fmt == StateFormat.PROTO:
+        return dict(zip(res.devices.ids, res.devices.states))
+    return json.loads(res.state)
+
+def measure(func):
+    '''Mean duration of func [seconds]'''
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(number, int(number * MIN_DURATION / 0.2))
+    return min(timer.repeat(3, number)) / number
+
+
+if __name__ == '__main__':
+    print('%8s %6s %12s %12s %10s' % ('devices', 'format', 'encode [us]', 'decode [us]', 'size [B]'))
+    for count in DEVICE_COUNTS:
+        state = makeState(count)
+        for fmt in [StateFormat.JSON, StateFormat.PROTO]:
+            data = encode(state, fmt)
+            assert decode(data, fmt) == state
+            tEncode = measure(lambda: encode(state, fmt))
+            tDecode = measure(lambda: decode(data, fmt))
+            print('%8d %6s %12.1f %12.1f %10d' % (count, StateFormat.Name(fmt), tEncode * 1e6, tDecode * 1e6, len(data)))
@@ -0,0 +1,217 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+commands.py
+Zigbee devices command queue
+Coalescing & rate-limiting the state change commands, per device
+'''
+
+import asyncio
+import logging
+import time
+
+import metrics
+
+# Per-device rate limit of the commands: sustained rate [commands/second] and burst size [commands]
+COMMAND_RATE = 1.
+COMMAND_BURST = 3
+
+# Metrics
+QUEUE_WAIT_SECONDS = metrics.Histogram('zbctrl_commands_queue_wait_seconds', 'Time commands wait in the queue before being sent')
+THROTTLED = metrics.Counter('zbctrl_commands_throttled_total', 'Commands delayed by their device rate limit')
+COALESCED = metrics.Counter('zbctrl_commands_coalesced_total', 'Pending commands superseded by a newer request')
+
+
+class TokenBucket():
+    '''Token bucket rate limiter'''
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.time = now
+
+    def take(self, now):
+        '''Take a token if available and return 0, otherwise return the time to wait for one [seconds]'''
+        self.tokens = min(self.burst, self.tokens + (now - self.time) * self.rate)
+        self.time = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.
+        return (1 - self.tokens) / self.rate
+
+    def idle(self, now):
+        '''Whether the bucket is full again (ie. can be forgotten)'''
+        return self.tokens + (now - self.time) * self.rate >= self.burst
+
+
+class CommandQueue():
+    '''Per-device queue of state change commands:
+    - only the latest requested state of a device is sent, superseded pending commands being coalesced away
+    - each device has its own rate limit (token bucket), independent devices are not throttled together
+    - commands of all the devices ready at the same time are sent as a single batch
+    - each request gets a future, resolved with the resulting device state once applied
+    - commands no-one waits for anymore (eg. cancelled or past their deadline) are dropped, or cancelled if in flight'''
+
+    def __init__(self, send, rate=COMMAND_RATE, burst=COMMAND_BURST):
+        '''Constructor: send async function(stateChanges dict of device: state, timeout [seconds] or None, resolve)
+        sending the commands and calling resolve(device, resulting state or Exception) as soon as each is applied'''
+        self.send = send
+        self.rate = rate
+        self.burst = burst
+        # Commands waiting to be sent: device: (state, list of futures, deadline [loop time] or None, queuing time [time.perf_counter()])
+        self._pending = {}
+        # Commands being sent: device: (state, list of futures, task sending its batch)
+        self._inflight = {}
+        self._buckets = {}
+        # Pending commands already delayed by their rate limit (counted once)
+        self._throttled = set()
+        self._wakeup = asyncio.Event()
+        # Batches being sent: task: list of devices
+        self._batches = {}
+
+    def target(self, device):
+        '''State a device is being set to (latest pending or in flight command), None if none'''
+        if device in self._pending:
+            return self._pending[device][0]
+        if device in self._inflight:
+            return self._inflight[device][0]
+        return None
+
+    def submit(self, device, state, deadline=None):
+        '''Request a device to be set to state before deadline [loop time] if any,
+        returns a future resolved with the resulting state once applied (to be cancelled if no longer needed)'''
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(lambda future: self._abandon(device) if future.cancelled() else None)
+        if device in self._pending:
+            # Superseding the pending command: its requesters now wait for the newest state
+            _, futures, pendingDeadline, queued = self._pending[device]
+            logging.debug('Coalescing pending command of %s: now %s', device, state)
+            COALESCED.inc()
+            futures.append(future)
+            if pendingDeadline is not None and (deadline is None or deadline > pendingDeadline):
+                pendingDeadline = deadline
+            self._pending[device] = (state, futures, pendingDeadline, queued)
+        elif device in self._inflight and self._inflight[device][0] == state:
+            # Same state already being sent
+            self._inflight[device][1].append(future)
+        else:
+            self._pending[device] = (state, [future], deadline, time.perf_counter())
+        self._wakeup.set()
+        return future
+
+    def _abandon(self, device):
+        '''A request for device was cancelled: drop its command if no-one waits for it anymore,
+        and cancel its batch once no-one waits for any of its commands'''
+        if device in self._pending and all(future.done() for future in self._pending[device][1]):
+            logging.debug('Dropping abandoned command of %s', device)
+            del self._pending[device]
+            self._throttled.discard(device)
+        if device in self._inflight:
+            task = self._inflight[device][2]
+            if all(future.done() for _, futures in self._batchCommands(task) for future in futures):
+                logging.info('Cancelling abandoned commands of %s', self._batches[task])
+                task.cancel()
+
+    def _batchCommands(self, task):
+        '''Commands of a batch still in flight, as (device, futures)'''
+        return [(device, self._inflight[device][1]) for device in self._batches.get(task, [])
+                if device in self._inflight and self._inflight[device][2] is task]
+
+    def _resolve(self, device, result):
+        '''Resolve the futures of the command of device in flight with result (cancelling them if None)'''
+        _, futures, _ = self._inflight.pop(device)
+        for future in futures:
+            if future.done():
+                continue
+            if result is None:
+                future.cancel()
+            elif isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+        # Next command of the device may be sent
+        self._wakeup.set()
+
+    async def _apply(self, stateChanges, deadline):
+        '''Send a batch of commands and resolve their futures'''
+        task = asyncio.current_task()
+        def resolve(device, result):
+            if device in self._inflight and self._inflight[device][2] is task:
+                self._resolve(device, result)
+        cancelled = False
+        try:
+            timeout = None if deadline is None else max(0., deadline - asyncio.get_running_loop().time())
+            await self.send(stateChanges, timeout, resolve)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        except Exception as e:
+            for device in stateChanges:
+                resolve(device, e)
+        finally:
+            # Commands left without result (cancelled, eg. abandoned)
+            for device, _ in self._batchCommands(task):
+                self._resolve(device, None if cancelled else RuntimeError('No result for device %s' % device))
+
+    async def run(self):
+        '''Send the pending commands as soon as their device is ready, until cancelled'''
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                self._wakeup.clear()
+                now = loop.time()
+                stateChanges = {}
+                batchFutures = []
+                batchDeadline = now
+                wait = None
+                for device in list(self._pending):
+                    if device in self._inflight:
+                        # One command at a time per device, the next one being coalesced meanwhile
+                        continue
+                    state, futures, deadline, queued = self._pending[device]
+                    if deadline is not None and now >= deadline:
+                        logging.info('Dropping command of %s: deadline exceeded', device)
+                        del self._pending[device]
+                        self._throttled.discard(device)
+                        for future in futures:
+                            if not future.done():
+                                future.set_exception(asyncio.TimeoutError('Deadline exceeded before sending command'))
+                        continue
+                    bucket = self._buckets.get(device)
+                    if bucket is None:
+                        bucket = self._buckets[device] = TokenBucket(self.rate, self.burst, now)
+                    delay = bucket.take(now)
+                    if delay > 0:
+                        if device not in self._throttled:
+                            self._throttled.add(device)
+                            THROTTLED.inc()
+                        if deadline is not None:
+                            delay = min(delay, deadline - now)
+                        wait = delay if wait is None else min(wait, delay)
+                        continue
+                    del self._pending[device]
+                    self._throttled.discard(device)
+                    QUEUE_WAIT_SECONDS.observe(time.perf_counter() - queued)
+                    stateChanges[device] = state
+                    batchFutures.append(futures)
+                    # The batch runs until the latest deadline of its commands
+                    if batchDeadline is not None:
+                        batchDeadline = None if deadline is None else max(batchDeadline, deadline)
+                if stateChanges:
+                    task = asyncio.create_task(self._apply(stateChanges, batchDeadline))
+                    self._batches[task] = list(stateChanges)
+                    task.add_done_callback(lambda task: self._batches.pop(task, None))
+                    for (device, state), futures in zip(stateChanges.items(), batchFutures):
+                        self._inflight[device] = (state, futures, task)
+                if wait is None:
+                    await self._wakeup.wait()
+                else:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            for task in list(self._batches):
+                task.cancel()
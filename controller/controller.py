@@ -4,145 +4,589 @@
 '''
 controller.py
 Zigbee controller
-Holding & caching system state, throtling interactions, managing interrupts & watchdog
+Holding & caching system state, coalescing & rate-limiting commands, managing interrupts & watchdog
 '''
 
 import asyncio
+from collections import deque
+import json
 import logging
+import os
 import time
+from types import MappingProxyType
 
-from zigbee import State
+from zigbee import State, CAPABILITY_ONOFF
+from poller import PollScheduler
+from commands import CommandQueue
+from shards import ZBShards
+from journal import StateJournal, Source, JOURNAL_MAX_READ
+import metrics
 
-# Minimum time between two SetState calls [seconds]
-SETSTATE_MIN_PERIOD = 1.
 # Periodic update of internal state with hardware [seconds]
+# (base poll period of each device, polls being spread over this period)
 UPDATE_PERIOD = 30.
 # Watchdog: perdiod of inactivity (no connexion with gateway) after which to revert to a safe state [seconds]
 WATCHDOG_PERIOD = 3*60*60 # 3h
 WATCHDOG_SAFE_STATE = State.OFF
 WATCHDOG_UNSAFE_STATES = [State.ON]
+# Timeout of the device state reads (polls) [seconds]
+POLL_TIMEOUT = 10.
+# Group-cast: minimum number of devices set to the same state to send them a single group command,
+# only if they already form a group, or are a stable set worth setting one up (costing a request per member):
+# commanded together GROUPCAST_STABLE_AFTER times (eg. scenes, among the GROUPCAST_CANDIDATES sets last commanded), or reverted by the watchdog,
+# and delay after which the devices that did not report their new state are polled [seconds]
+GROUPCAST_MIN_DEVICES = 3
+GROUPCAST_STABLE_AFTER = 3
+GROUPCAST_CANDIDATES = 32
+GROUPCAST_CONFIRM_DELAY = 5.
+# Reporting: delay without report after which a reporting device is considered not available,
+# as a multiple of its maximum reporting interval
+REPORT_GRACE = 2.5
+# Watchers: maximum number of pending changes per subscriber, after which it is resynced with a full snapshot
+WATCH_MAX_PENDING = 256
+# Change log: number of device changes remembered to answer delta state requests
+CHANGELOG_SIZE = 1024
+# Persisted state: period of the saves (only if the state changed) [seconds]
+STATE_SAVE_PERIOD = 60.
+# Delay before retrying to start the radio [seconds]
+RADIO_RETRY_DELAY = 10.
+
+# Metrics
+PERIODIC_UPDATE_SECONDS = metrics.Histogram('zbctrl_periodic_update_seconds', 'Duration of the periodic update cycles (excl. waiting for the next one)')
+WATCHDOG_TRIPS = metrics.Counter('zbctrl_watchdog_trips_total', 'Watchdog reverts to the safe state')
+SHARD_UP = metrics.Gauge('zbctrl_shard_up', 'Whether the Zigbee interface (coordinator) is up, per shard', ['shard'])
+SHARD_DEVICES = metrics.Gauge('zbctrl_shard_devices', 'Devices of the Zigbee network, per shard', ['shard'])
+SHARD_OFFLINE = metrics.Gauge('zbctrl_shard_offline_devices', 'Devices currently offline, per shard', ['shard'])
+
+
+class StateSnapshot():
+    '''Immutable snapshot of the system state.
+    Writers publish a new snapshot for each change, so that readers can use the current one
+    with neither lock nor copy'''
+    __slots__ = ('version', 'devices', 'stale', 'cache')
+
+    def __init__(self, version, devices, stale=frozenset()):
+        '''Constructor: version of the state, devices dict of device ID: State (owned by the snapshot, never modified afterwards),
+        stale frozenset of the devices whose state is the last known one from before the restart, not confirmed yet'''
+        self.version = version
+        self.devices = MappingProxyType(devices)
+        self.stale = stale
+        # Values derived from the snapshot (eg. its encodings), computed once by readers
+        self.cache = {}
+
+
+class StateWatcher():
+    '''Subscription to state changes, coalescing the pending changes per device
+    so that a slow subscriber never blocks the publisher'''
+
+    def __init__(self, maxPending=WATCH_MAX_PENDING):
+        self.maxPending = maxPending
+        self._pending = {}
+        self._resync = False
+        self._event = asyncio.Event()
+
+    def push(self, device, state):
+        '''Queue a state change (non-blocking), only the latest state of each device is kept'''
+        if not self._resync:
+            self._pending[device] = state
+            if len(self._pending) > self.maxPending:
+                # Too far behind: drop the changes and send a full snapshot instead
+                self._pending = {}
+                self._resync = True
+        self._event.set()
+
+    def resync(self):
+        '''Drop the pending changes, the full state being re-sent instead (eg. devices removed)'''
+        self._pending = {}
+        self._resync = True
+        self._event.set()
+
+    async def get(self):
+        '''Wait for changes, and return them as (changes, resync)
+        changes: dict of the devices changed since last call
+        resync: True if changes were dropped and the full state should be re-sent instead'''
+        await self._event.wait()
+        self._event.clear()
+        changes, resync = self._pending, self._resync
+        self._pending, self._resync = {}, False
+        return changes, resync
+
+
+class StateStore():
+    '''Last known system state, persisted to a file to be served at once after a restart.
+    Written atomically: to a temporary file, then renamed over the previous one'''
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        '''Return the persisted (version, devices dict of device ID: State), None if none or invalid'''
+        try:
+            with open(self.path, 'r') as f:
+                saved = json.load(f)
+            return int(saved['version']), {device: State(state) for device, state in saved['devices'].items()}
+        except FileNotFoundError:
+            logging.info('No persisted state at %s', self.path)
+        except Exception as e:
+            logging.error('Unable to load persisted state from %s: %r', self.path, e)
+        return None
+
+    def save(self, snapshot):
+        '''Persist a StateSnapshot (blocking: to be run in an executor from the event loop)'''
+        tmpPath = self.path + '.tmp'
+        with open(tmpPath, 'w') as f:
+            json.dump({'version': snapshot.version, 'devices': dict(snapshot.devices)}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpPath, self.path)
 
 
 class ZBCtrl():
     '''Main controller for Zigbee, holding & caching system state'''
 
-    def __init__(self, zbi, devices):
-        '''Constructor: zbi ZBInterface object, devices list of known IDs (IEEE/EUI64)'''
-        # Zigbee interface
-        self.zbi = zbi
-        # Internal state and its lock to R/W it
-        self._state = {device: State.NA for device in devices}
+    def __init__(self, zbi, devices=None, statePath=None, journalPath=None):
+        '''Constructor: zbi ZBInterface object, or list of ZBInterface (one per coordinator, each device being routed to its own),
+        devices optional fixed list of IDs (IEEE/EUI64),
+        otherwise the on/off devices of the network registry (kept current as devices join & leave),
+        statePath optional file persisting the last known state across restarts,
+        journalPath optional file journaling the state changes'''
+        # Zigbee interface (possibly sharded)
+        self.zbi = ZBShards(zbi) if isinstance(zbi, (list, tuple)) else zbi
+        self.fixedDevices = None if devices is None else list(devices)
+        # Internal state, as an immutable snapshot replaced on each change
+        # Its version starts from the current time [us] to keep increasing across restarts
+        # The last known state (and devices, if not fixed) is served until confirmed (stale), if persisted
+        self.store = StateStore(statePath) if statePath else None
+        saved = self.store.load() if self.store else None
+        savedVersion, savedState = saved if saved is not None else (0, {})
+        version = max(time.time_ns() // 1000, savedVersion + 1)
+        state = {device: State.NA for device in (savedState if devices is None else devices)}
+        stale = set()
+        for device, deviceState in savedState.items():
+            if device in state and deviceState != State.NA:
+                state[device] = deviceState
+                stale.add(device)
+        if saved is not None:
+            logging.info('Loaded last known state of %d devices', len(stale))
+        self._state = StateSnapshot(version, state, frozenset(stale))
         #self._state = {
         #        '70:ac:08:ff:fe:7e:0b:xx': State.OFF # IKEA of Sweden TRADFRI control outlet
         #}
-        self.lock = asyncio.Lock()
-        # Throttling: last change time and its lock to R/W it
-        self.lastChange = time.time()
-        self.lastChangeLock = asyncio.Lock()
-        # Watchdog: last contact time and its lock to R/W it
-        self.lastContact = time.time()
-        self.lastContactLock = asyncio.Lock()
+        # Log of the last changes as (version, device)
+        self._changeLog = deque(maxlen=CHANGELOG_SIZE)
+        # Journal of all the state changes, and source of the last command submitted for each device
+        self.journal = StateJournal(journalPath) if journalPath else None
+        self._commandSources = {}
+        # Watchdog: last contact time, and timer (expiring a period after it, re-armed then if contacted meanwhile)
+        self.lastContact = time.monotonic()
+        self.watchdogTimer = None
+        # State change subscribers
+        self._watchers = set()
         # Periodic update & running state
+        self.running = False
         self.updateTask = None
+        # Radio started (in the background)
+        self.ready = asyncio.Event()
+        self.startTask = None
+        # Persistence of the state
+        self.saveTask = None
+        # Poller of the devices state
+        self.poller = PollScheduler(self._pollDevice, UPDATE_PERIOD, shardOf=self.zbi.shardOf)
+        self.pollTask = None
+        # Per-device queue of the state change commands
+        self.commands = CommandQueue(self._sendStateChanges)
+        self.commandTask = None
+        # Group-cast: sets of devices commanded together: number of times, in least recently commanded order,
+        # and group commands awaiting confirmation: device: (expected State, future)
+        self._groupCandidates = {}
+        self._groupConfirmations = {}
+        # Background tasks (eg. watchdog revert)
+        self._tasks = set()
 
     async def start(self):
-        '''Start the controller, its timer and its dependencies (incl. ZBInterface)'''
-        await self.zbi.start(self._stateChangeCallback)
+        '''Start the controller, serving the last known state at once:
+        its dependencies (incl. ZBInterface), timers and first refresh of the state are started in the background
+        (ready being set once the radio is up, commands waiting until then)'''
         self.running = True
+        self.startTask = asyncio.create_task(self._startRadio())
+        if self.store:
+            self.saveTask = asyncio.create_task(self._saveState())
+
+    async def _startRadio(self):
+        '''Start the ZBInterface (retrying until it succeeds), then the poller, commands & timer'''
+        while True:
+            try:
+                await self.zbi.start(self._stateChangeCallback)
+                break
+            except Exception as e:
+                logging.error('Unable to start Zigbee interface, retrying in %fs: %r', RADIO_RETRY_DELAY, e)
+                await asyncio.sleep(RADIO_RETRY_DELAY)
+        if self.fixedDevices is None:
+            self.zbi.registry.addListener(self._registryCallback)
+            self._setDevices(self.zbi.registry.withCapability(CAPABILITY_ONOFF))
+        self.poller.setDevices(self._state.devices)
+        self.pollTask = asyncio.create_task(self.poller.run())
+        self.commandTask = asyncio.create_task(self.commands.run())
         self.updateTask = asyncio.create_task(self._periodicUpdate())
-        #await self.updateTask
+        self._armWatchdog()
+        self.ready.set()
+        logging.info('Controller ready')
 
     async def stop(self):
         ''' Stop controller, its timer and its dependencies'''
         self.running = False
-        self.updateTask.cancel()
+        if self.watchdogTimer is not None:
+            self.watchdogTimer.cancel()
+        for task in [self.startTask, self.saveTask, self.updateTask, self.pollTask, self.commandTask, *self._tasks]:
+            if task is not None:
+                task.cancel()
         await self.zbi.stop()
+        if self.store:
+            try:
+                self.store.save(self._state)
+            except Exception as e:
+                logging.error('Unable to persist state: %r', e)
+        if self.journal is not None:
+            self.journal.close()
+
+    async def _saveState(self):
+        '''Periodically persist the state if it changed since the last save'''
+        loop = asyncio.get_running_loop()
+        savedVersion = None
+        while True:
+            await asyncio.sleep(STATE_SAVE_PERIOD)
+            snapshot = self._state
+            if snapshot.version == savedVersion:
+                continue
+            try:
+                await loop.run_in_executor(None, self.store.save, snapshot)
+                savedVersion = snapshot.version
+            except Exception as e:
+                logging.error('Unable to persist state: %r', e)
 
     async def _stateChangeCallback(self, device, state):
         '''Handle state change event'''
-        logging.info('Event: updating state: %s=%r' % (device, state))
-        async with self.lock:
-            devices = self._state.keys()
-        if device in devices:
-            async with self.lock:
-                self._state[device] = state
+        logging.info('Event: updating state: %s=%r', device, state)
+        if device in self._state.devices:
+            # Reports of the changes being commanded (usually received before the command response) come from the command
+            source = self._commandSources.get(device, Source.COMMAND) if self.commands.target(device) == state else Source.REPORT
+            self._updateDeviceState(device, state, source)
+            # Reporting devices do not need polling until their next report is overdue
+            self.poller.seen(device, self.zbi.reportMaxInterval * REPORT_GRACE)
+        else:
+            logging.debug('  Unknown device %s, ignoring its state', device)
+
+    def _registryCallback(self, device, entry):
+        '''Follow the on/off devices of the registry (devices joined, initialized or removed)'''
+        isOnOff = entry is not None and CAPABILITY_ONOFF in entry.capabilities
+        if isOnOff != (device in self._state.devices):
+            self._setDevices(self.zbi.registry.withCapability(CAPABILITY_ONOFF))
+            self.poller.setDevices(self._state.devices)
+
+    def _setDevices(self, devices):
+        '''Set the devices of the state (new ones being not available until polled), publishing a single snapshot.
+        Each added device gets its own version (as a change of the log, which may only keep part of them),
+        removed devices are not conveyed by deltas: clients then get the full state'''
+        current = self._state
+        devices = set(devices)
+        added = sorted(device for device in devices if device not in current.devices)
+        removed = [device for device in current.devices if device not in devices]
+        if not added and not removed:
+            return
+        logging.info('Devices: %d added, %d removed', len(added), len(removed))
+        state = {device: deviceState for device, deviceState in current.devices.items() if device in devices}
+        state.update((device, State.NA) for device in added)
+        self._state = StateSnapshot(current.version + max(1, len(added)), state, current.stale & devices)
+        if removed:
+            self._changeLog.clear()
+            for watcher in self._watchers:
+                watcher.resync()
+        else:
+            for version, device in enumerate(added, current.version + 1):
+                self._changeLog.append((version, device))
+                for watcher in self._watchers:
+                    watcher.push(device, State.NA)
+
+    async def _pollDevice(self, device, timeout=POLL_TIMEOUT):
+        '''Poll the actual state of a device (called by the poller)'''
+        newState = await self.zbi.getDeviceState(device, timeout)
+        self._updateDeviceState(device, newState, Source.POLL)
+        return newState
+
+    def _updateDeviceState(self, device, state, source):
+        '''Publish a new state snapshot and notify watchers if the device state actually changed (or was stale),
+        journaling the change along with its Source.
+        No lock needed: this runs without awaiting, so the snapshot swap is atomic for the event loop'''
+        confirmation = self._groupConfirmations.get(device)
+        if confirmation is not None and confirmation[0] == state and not confirmation[1].done():
+            confirmation[1].set_result(state)
+        current = self._state
+        oldState = current.devices.get(device)
+        if oldState == state and device not in current.stale:
+            return
+        if self.journal is not None and oldState is not None and oldState != state:
+            self.journal.record(device, oldState, state, source)
+        devices = dict(current.devices)
+        devices[device] = state
+        stale = current.stale - {device} if device in current.stale else current.stale
+        self._state = StateSnapshot(current.version + 1, devices, stale)
+        self._changeLog.append((self._state.version, device))
+        for watcher in self._watchers:
+            watcher.push(device, state)
+
+    @property
+    def version(self):
+        '''Current state version'''
+        return self._state.version
+
+    def watch(self):
+        '''Subscribe to state changes, returns a StateWatcher to be released with unwatch()'''
+        watcher = StateWatcher()
+        self._watchers.add(watcher)
+        return watcher
+
+    def unwatch(self, watcher):
+        '''Unsubscribe from state changes'''
+        self._watchers.discard(watcher)
 
     async def _periodicUpdate(self):
-        '''Periodically update the internal state and let the watchdog out'''
+        '''Periodically mark the overdue reporting devices not available & check the Zigbee interface health
+        (the internal state being updated by the poller)'''
         if self.running:
             logging.info('Running periodic update')
-            # Internal state update
-            logging.debug('  Updating internal state')
-            async with self.lock:
-                devices = self._state.keys()
-            async def updateDeviceState(device):
-                try:
-                    newState = await self.zbi.getDeviceState(device)
-                    async with self.lock:
-                        self._state[device] = newState
-                except Exception as e:
-                    logging.error('Unable to get actual state for device %s: %r' % (device, e))
-            await asyncio.gather(*[updateDeviceState(device) for device in devices])
-            # Watchdog
-            logging.debug('  Walking out the watchdog')
-            async with self.lastContactLock:
-                now = time.time()
-                if now - self.lastContact > WATCHDOG_PERIOD:
-                    logging.warning('    Watchdog: WOOF no news for too long, reverting to safe state')
-                    async with self.lock:
-                        unsafeDevices = [device for device in self._state if self._state[device] in WATCHDOG_UNSAFE_STATES]
-                    async def setSafeDeviceState(device):
-                        logging.info('    Reverting device %s to safe state: %s' % (device, WATCHDOG_SAFE_STATE))
-                        try:
-                            newState = await self.zbi.setDeviceState(device, WATCHDOG_SAFE_STATE)
-                            async with self.lock:
-                                self._state[device] = newState
-                        except Exception as e:
-                            logging.error('    Unable to revert device %s to safe state: %r' % (device, e))
-                    await asyncio.gather(*[setSafeDeviceState(device) for device in unsafeDevices])
-                    self.lastContact = time.time()
-            logging.debug('  Periodic update completed. Waiting for %fs' % UPDATE_PERIOD)
+            start = time.perf_counter()
+            # Reporting devices not heard of for too long
+            now = time.monotonic()
+            overdue = self.zbi.reportMaxInterval * REPORT_GRACE
+            for device in list(self.zbi.lastReport):
+                lastSeen = self.poller.lastSeen(device)
+                if lastSeen is not None and now - lastSeen > overdue and self._state.devices.get(device, State.NA) != State.NA:
+                    logging.info('  No news from device %s for %fs, marking it not available', device, now - lastSeen)
+                    self._updateDeviceState(device, State.NA, Source.OVERDUE)
+            # Health of the Zigbee interface
+            for health in self.health():
+                SHARD_UP.labels(health['name']).set(1 if health['status'] == 'up' else 0)
+                SHARD_DEVICES.labels(health['name']).set(health['devices'])
+                SHARD_OFFLINE.labels(health['name']).set(health['offline'])
+                if health['status'] != 'up':
+                    logging.warning('  Zigbee interface %s %s: %s', health['name'], health['status'], health['lastError'])
+            PERIODIC_UPDATE_SECONDS.observe(time.perf_counter() - start)
+            logging.debug('  Periodic update completed. Waiting for %fs', UPDATE_PERIOD)
             await asyncio.sleep(UPDATE_PERIOD)
             # Relaunching timer (rechecking if still running as it may have changed in between)
             if self.running:
                 self.updateTask = asyncio.create_task(self._periodicUpdate())
 
-    async def getState(self):
+    def _armWatchdog(self):
+        '''Arm the watchdog timer for the end of the period of inactivity since the last contact'''
+        delay = self.lastContact + WATCHDOG_PERIOD - time.monotonic()
+        self.watchdogTimer = asyncio.get_running_loop().call_later(max(0., delay), self._watchdogExpired)
+
+    def _watchdogExpired(self):
+        '''Watchdog timer: re-armed if contacted meanwhile (contacts only recording their time),
+        otherwise reverting the devices to the safe state in the background'''
+        if not self.running:
+            return
+        now = time.monotonic()
+        if self._watchers:
+            # An open state subscription counts as contact with the gateway
+            self.lastContact = now
+        if now - self.lastContact < WATCHDOG_PERIOD:
+            self._armWatchdog()
+            return
+        logging.warning('Watchdog: WOOF no news for too long, reverting to safe state')
+        WATCHDOG_TRIPS.inc()
+        self.lastContact = now
+        self._armWatchdog()
+        task = asyncio.create_task(self._revertToSafeState())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _revertToSafeState(self):
+        '''Revert the devices in an unsafe state to the safe state, as a single request
+        (group commands per shard, see _sendStateChanges), running alongside the others'''
+        state = self._state.devices
+        unsafeDevices = [device for device in state if state[device] in WATCHDOG_UNSAFE_STATES]
+        if not unsafeDevices:
+            return
+        logging.info('  Reverting devices %s to safe state: %s', unsafeDevices, WATCHDOG_SAFE_STATE)
+        _, failed = await self.setState({device: WATCHDOG_SAFE_STATE for device in unsafeDevices}, source=Source.WATCHDOG)
+        if failed:
+            logging.error('  Unable to revert devices to safe state: %s', failed)
+
+    def listDevices(self, capability=None):
+        '''Return the DeviceEntry of the devices of the network registry (having capability if not None), sorted by ID'''
+        registry = self.zbi.registry
+        devices = registry.devices if capability is None else registry.withCapability(capability)
+        return [registry.devices[device] for device in sorted(devices)]
+
+    def health(self):
+        '''Health status of the Zigbee interface, as a list of dicts per shard (coordinator):
+        name, channel, status ('stopped', 'starting', 'up' or 'down'), lastError, devices, offline (devices)'''
+        return self.zbi.health()
+
+    async def getDeviceInfo(self, device, timeout=None):
+        '''Return the info of a device of the network as (ok, ko) dicts of attribute name: value or failure status
+        (static info being cached), the requests being cancelled after timeout [seconds]'''
+        if not self.ready.is_set():
+            raise RuntimeError('Zigbee interface not started yet')
+        return await self.zbi.getAllDeviceInfo(device, timeout)
+
+    async def getHistory(self, device=None, since=None, limit=None, after=None):
+        '''Return (changes, more): the journaled state changes (of device if not None) after the sequence number after if not None,
+        at or after since [us since epoch] if not None, oldest first, up to limit,
+        as tuples (sequence number, timestamp, device, old State, new State, Source), more being True if there are more.
+        Read in an executor, not to block the event loop while scanning'''
+        if self.journal is None:
+            raise RuntimeError('State journal not enabled')
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.journal.read, device, since, limit or JOURNAL_MAX_READ, after)
+
+    def getState(self):
+        '''Return the current StateSnapshot (read-only, no copy)'''
         # Reassuring watchdog
-        async with self.lastContactLock:
-            self.lastContact = time.time()
-        # Returning state
-        async with self.lock:
-            return self._state.copy()
+        self.lastContact = time.monotonic()
+        return self._state
 
-    async def setState(self, newState):
+    def getStateSince(self, sinceVersion=None):
+        '''Return (snapshot, changes) with the current StateSnapshot and the state changes since sinceVersion:
+        changes is None if the full state is needed (sinceVersion is None or older than the change log),
+        otherwise it only holds the changed devices (empty if nothing changed)'''
         # Reassuring watchdog
-        async with self.lastContactLock:
-            self.lastContact = time.time()
-        # Throttling
-        async with self.lastChangeLock:
-            now = time.time()
-            if now - self.lastChange < SETSTATE_MIN_PERIOD:
-                logging.warning('Only %fs since last call, throttling!' % (now - self.lastChange))
-                raise ValueError('Throttling: too many setState requests')
-            self.lastChange = now
-        # Applying changes
-        stateChanges = {}
-        async with self.lock:
-            for device in self._state:
-                if device in newState and self._state[device] != newState[device] and newState[device] in [State.ON, State.OFF]:
-                    stateChanges[device] = newState[device]
+        self.lastContact = time.monotonic()
+        snapshot = self._state
+        if sinceVersion is None or sinceVersion > snapshot.version:
+            return snapshot, None
+        if sinceVersion == snapshot.version:
+            return snapshot, {}
+        if not self._changeLog or sinceVersion < self._changeLog[0][0] - 1:
+            # Changes are no longer in the log
+            return snapshot, None
+        changes = {}
+        for version, device in reversed(self._changeLog):
+            if version <= sinceVersion:
+                break
+            changes[device] = snapshot.devices[device]
+        return snapshot, changes
+
+    async def setState(self, newState, timeout=None, source=Source.COMMAND):
+        '''Set the devices state (dict of device: State), returns once the changes are applied or after timeout [seconds],
+        the changes being journaled as from source.
+        Commands are queued per device: a newer request for the same device supersedes the pending one.
+        Returns (results, failed): dict of device: resulting State of the applied changes,
+        list of the devices whose change failed or was not applied in time (its commands being then cancelled)'''
+        # Reassuring watchdog (unless reverting itself)
+        if source != Source.WATCHDOG:
+            self.lastContact = time.monotonic()
+        # Queuing changes (incl. requests superseding a pending command, even back to the current state)
+        deadline = None if timeout is None else asyncio.get_running_loop().time() + timeout
+        changes = {}
+        state = self._state.devices
+        for device in state:
+            if device in newState and newState[device] in [State.ON, State.OFF]:
+                if state[device] != newState[device] or self.commands.target(device) is not None:
+                    changes[device] = self.commands.submit(device, newState[device], deadline)
+                    self._commandSources[device] = source
+        results, failed = {}, []
+        try:
+            if changes:
+                await asyncio.wait(changes.values(), timeout=timeout)
+        finally:
+            # Cancelling what is left (timeout, or request itself cancelled): dropped from the queue if no-one else waits for it
+            for future in changes.values():
+                future.cancel()
+        for device, future in changes.items():
+            if future.cancelled():
+                logging.warning('Change of %s not applied in time', device)
+                failed.append(device)
+            elif future.exception() is not None:
+                logging.error('Unable to change state of %s: %r', device, future.exception())
+                failed.append(device)
+            else:
+                results[device] = future.result()
+        return results, failed
+
+    async def _sendStateChanges(self, stateChanges, timeout, resolve):
+        '''Send the commands to apply stateChanges (dict of device: State), as a single group command
+        for the devices set to the same state if they are enough, unicast commands otherwise,
+        the radio requests being cancelled after timeout [seconds].
+        Called by the command queue, calling resolve(device, resulting State or Exception) as soon as each is applied'''
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        def remaining():
+            return None if deadline is None else max(0., deadline - loop.time())
         async def applyStateChange(device, newDeviceState):
-            logging.info('Changing state: %s=%s' % (device, newDeviceState))
-            actualNewDeviceState = await self.zbi.setDeviceState(device, newDeviceState)
-            async with self.lock:
-                self._state[device] = actualNewDeviceState
-        await asyncio.gather(*[applyStateChange(device, stateChanges[device]) for device in stateChanges])
+            logging.info('Changing state: %s=%s', device, newDeviceState)
+            try:
+                actualNewDeviceState = await self.zbi.setDeviceState(device, newDeviceState, remaining())
+            except Exception as e:
+                resolve(device, e)
+                return
+            self._updateDeviceState(device, actualNewDeviceState, self._commandSources.get(device, Source.COMMAND))
+            if actualNewDeviceState != State.NA:
+                self.poller.seen(device)
+            resolve(device, actualNewDeviceState)
+        async def applyGroupStateChange(devices, newDeviceState):
+            logging.info('Changing state by group: %s=%s', devices, newDeviceState)
+            # Devices confirm by reporting their new state (resolved as they do), those which did not in time being polled
+            confirmations = {device: loop.create_future() for device in devices}
+            for device, future in confirmations.items():
+                self._groupConfirmations[device] = (newDeviceState, future)
+                future.add_done_callback(lambda future, device=device: resolve(device, future.result()) if not future.cancelled() else None)
+            try:
+                try:
+                    await self.zbi.setGroupState(devices, newDeviceState, remaining())
+                except Exception as e:
+                    logging.warning('Unable to change state by group, falling back to unicast: %r', e)
+                    await asyncio.gather(*[applyStateChange(device, newDeviceState) for device in devices])
+                    return
+                # Half of the time left, if any, kept to poll
+                confirmDelay = GROUPCAST_CONFIRM_DELAY if deadline is None else min(GROUPCAST_CONFIRM_DELAY, remaining() / 2)
+                await asyncio.wait(confirmations.values(), timeout=confirmDelay)
+                unconfirmed = [device for device, future in confirmations.items() if not future.done()]
+                if unconfirmed:
+                    logging.info('No report of group state change from %s, polling them', unconfirmed)
+                    results = await asyncio.gather(*[self._pollDevice(device, POLL_TIMEOUT if deadline is None else remaining())
+                                                     for device in unconfirmed], return_exceptions=True)
+                    for device, result in zip(unconfirmed, results):
+                        if isinstance(result, Exception):
+                            logging.error('Unable to get actual state for device %s: %r', device, result)
+                        resolve(device, result)
+            finally:
+                for device, future in confirmations.items():
+                    future.cancel()
+                    if self._groupConfirmations.get(device, (None, None))[1] is future:
+                        del self._groupConfirmations[device]
+        devicesByState = {}
+        for device, newDeviceState in stateChanges.items():
+            devicesByState.setdefault(newDeviceState, []).append(device)
+        changes = []
+        for newDeviceState, devices in devicesByState.items():
+            if self._groupcast(devices):
+                changes.append(applyGroupStateChange(devices, newDeviceState))
+            else:
+                changes.extend(applyStateChange(device, newDeviceState) for device in devices)
+        await asyncio.gather(*changes)
+
+    def _groupcast(self, devices):
+        '''Whether to send a single group command to devices (set to the same state): if they already form a group,
+        or are a stable set worth setting one up (see GROUPCAST_STABLE_AFTER), unicast commands being cheaper otherwise'''
+        if len(devices) < GROUPCAST_MIN_DEVICES:
+            return False
+        if self.zbi.hasGroup(devices) or all(self._commandSources.get(device) == Source.WATCHDOG for device in devices):
+            return True
+        members = frozenset(devices)
+        count = self._groupCandidates.pop(members, 0) + 1
+        self._groupCandidates[members] = count
+        if len(self._groupCandidates) > GROUPCAST_CANDIDATES:
+            del self._groupCandidates[next(iter(self._groupCandidates))]
+        return count >= GROUPCAST_STABLE_AFTER
 
 
 if __name__ == '__main__':
     from zigbee import ZBInterface
-    logging.basicConfig(format='%(asctime)s %(levelname)s %(module)s/%(funcName)s %(message)s', encoding='utf-8', level=logging.INFO)
+    import logsetup
+    logsetup.setup(logging.INFO)
     async def main():
         zbi = ZBInterface()
         devices = [
@@ -150,18 +594,19 @@ if __name__ == '__main__':
         ]
         ctrl = ZBCtrl(zbi, devices)
         await ctrl.start()
+        await ctrl.ready.wait()
         outlet = '70:ac:08:ff:fe:7e:0b:xx'
-        logging.info(ctrl.getState())
+        logging.info(dict(ctrl.getState().devices))
         logging.info(await ctrl.setState({outlet: State.ON}))
-        logging.info(ctrl.getState())
+        logging.info(dict(ctrl.getState().devices))
         await asyncio.sleep(15)
-        logging.info(ctrl.getState())
+        logging.info(dict(ctrl.getState().devices))
         logging.info(await ctrl.setState({outlet: State.OFF}))
         await asyncio.sleep(15)
-        logging.info(ctrl.getState())
+        logging.info(dict(ctrl.getState().devices))
         logging.info(await ctrl.setState({outlet: State.ON}))
-        logging.info(ctrl.getState())
+        logging.info(dict(ctrl.getState().devices))
         await asyncio.sleep(15)
-        logging.info(ctrl.getState())
+        logging.info(dict(ctrl.getState().devices))
         await ctrl.stop()
     asyncio.run(main())
@@ -0,0 +1,144 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+journal.py
+State changes journal
+Every device state transition, in a fixed-size binary ring buffer on disk, memory-mapped
+'''
+
+from enum import IntEnum
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+# Number of state changes kept (the oldest being overwritten), ie. 24MB
+JOURNAL_CAPACITY = 1000000
+# Maximum number of state changes returned by a read
+JOURNAL_MAX_READ = 10000
+# Records read from the file at once while scanning
+JOURNAL_SCAN_CHUNK = 4096
+
+# File layout: header (magic, record size, capacity, number of records ever written), padded to HEADER_SIZE,
+# then the records ring: record #n (its sequence number, ordering the records) at index n % capacity
+JOURNAL_MAGIC = b'ZBJ1'
+HEADER = struct.Struct('<4sIQQ')
+HEADER_SIZE = 64
+# Record: timestamp [us since epoch, wall clock: not ordered], device (EUI64 as an integer), old state, new state, source
+RECORD = struct.Struct('<qQbbB5x')
+
+
+class Source(IntEnum):
+    '''Source of a state change'''
+    REPORT = 1   # reported by the device
+    POLL = 2     # read from the device
+    COMMAND = 3  # set by a command
+    WATCHDOG = 4 # set by the watchdog
+    OVERDUE = 5  # not available: no report from the device for too long
+
+
+def encodeDevice(device):
+    '''EUI64 string (eg. "00:12:4b:00:24:cb:3e:xx") as an integer'''
+    return int(device.replace(':', ''), 16)
+
+def decodeDevice(value):
+    '''Integer as an EUI64 string'''
+    return ':'.join('%02x' % b for b in value.to_bytes(8, 'big'))
+
+
+class StateJournal():
+    '''Journal of the state changes: fixed-size ring buffer of binary records in a memory-mapped file.
+    Recording a change is a memory write (the OS writing the pages back), reads only touch the records scanned.
+    Records are located by their sequence number, their timestamp being only filtered on (the clock may be set back).
+    Thread-safe: reads (eg. in an executor) copy the records chunk by chunk under the lock shared with record & close'''
+
+    def __init__(self, path, capacity=JOURNAL_CAPACITY):
+        self.path = path
+        self.capacity = capacity
+        size = HEADER_SIZE + capacity * RECORD.size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != size or not self._validHeader(fd):
+                logging.warning('Creating state journal %s (%d records)', path, capacity)
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+                os.pwrite(fd, HEADER.pack(JOURNAL_MAGIC, RECORD.size, capacity, 0), 0)
+            self._mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self._written = HEADER.unpack_from(self._mm, 0)[3]
+        self._lock = threading.Lock()
+
+    def _validHeader(self, fd):
+        magic, recordSize, capacity, _ = HEADER.unpack(os.pread(fd, HEADER.size, 0))
+        return magic == JOURNAL_MAGIC and recordSize == RECORD.size and capacity == self.capacity
+
+    def __len__(self):
+        '''Number of records kept'''
+        return min(self._written, self.capacity)
+
+    def record(self, device, oldState, newState, source, timestamp=None):
+        '''Record a state change of device (EUI64 string) from oldState to newState, by source, at timestamp [us since epoch, defaults to now]'''
+        try:
+            deviceValue = encodeDevice(device)
+        except ValueError:
+            logging.debug('  Not journaling device %s: not an EUI64', device)
+            return
+        if timestamp is None:
+            timestamp = time.time_ns() // 1000
+        with self._lock:
+            if self._mm is None:
+                return
+            RECORD.pack_into(self._mm, HEADER_SIZE + (self._written % self.capacity) * RECORD.size, timestamp, deviceValue, oldState, newState, source)
+            self._written += 1
+            HEADER.pack_into(self._mm, 0, JOURNAL_MAGIC, RECORD.size, self.capacity, self._written)
+
+    def read(self, device=None, since=None, limit=JOURNAL_MAX_READ, after=None):
+        '''Return (changes, more): the changes (of device if not None) after the sequence number after if not None,
+        at or after since [us since epoch] if not None, oldest first, up to limit,
+        as tuples (sequence number, timestamp, device, old state, new state, Source);
+        more being True if there are more changes after these (to read after the last sequence number)'''
+        limit = min(limit, JOURNAL_MAX_READ)
+        deviceValue = None if device is None else encodeDevice(device)
+        with self._lock:
+            # Changes recorded meanwhile not read
+            end = self._written
+        seq = 0 if after is None else after + 1
+        changes = []
+        while seq < end:
+            with self._lock:
+                if self._mm is None:
+                    raise RuntimeError('State journal closed')
+                # Oldest record kept (records not read yet may have been overwritten meanwhile)
+                seq = max(seq, self._written - min(self._written, self.capacity))
+                if seq >= end:
+                    break
+                # Contiguous chunk of the ring, copied
+                start = seq % self.capacity
+                n = min(JOURNAL_SCAN_CHUNK, end - seq, self.capacity - start)
+                offset = HEADER_SIZE + start * RECORD.size
+                chunk = self._mm[offset:offset + n * RECORD.size]
+            for i, (timestamp, recordDevice, oldState, newState, source) in enumerate(RECORD.iter_unpack(chunk)):
+                if (deviceValue is not None and recordDevice != deviceValue) or (since is not None and timestamp < since):
+                    continue
+                if len(changes) == limit:
+                    return changes, True
+                changes.append((seq + i, timestamp, decodeDevice(recordDevice), oldState, newState, Source(source)))
+            seq += n
+        return changes, False
+
+    def flush(self):
+        '''Write the records back to the file'''
+        with self._lock:
+            if self._mm is not None:
+                self._mm.flush()
+
+    def close(self):
+        with self._lock:
+            if self._mm is not None:
+                self._mm.flush()
+                self._mm.close()
+                self._mm = None
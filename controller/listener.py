@@ -19,6 +19,9 @@ import zigpy.types # Relays, EUI64, uint8_t, uint16_t
 import zigpy.zdo.types # Neighbor, Route
 import zigpy.zcl.foundation # ZCLHeader
 
+# Logger of the events, at a high rate on large networks: its debug records may be sampled (see logsetup.py)
+logger = logging.getLogger('listener')
+
 
 class ZBListenerBase:
     '''Listener of the ControllerApplication, to capture events.
@@ -28,68 +31,68 @@ class ZBListenerBase:
 
     # zigpy/group.py
     def member_added(self, group: zigpy.group.Group, endpoint: zigpy.endpoint.Endpoint):
-        logging.debug('>member_added:', group, endpoint)
+        logger.debug('>member_added: %s %s', group, endpoint)
     def member_removed(self, group: zigpy.group.Group, endpoint: zigpy.endpoint.Endpoint):
-        logging.debug('>member_removed:', group, endpoint)
+        logger.debug('>member_removed: %s %s', group, endpoint)
     def group_added(self, group: zigpy.group.Group):
-        logging.debug('>group_added:', group)
+        logger.debug('>group_added: %s', group)
     def group_removed(self, group: zigpy.group.Group):
-        logging.debug('>group_removed:', group)
+        logger.debug('>group_removed: %s', group)
     def group_member_added(self, group: zigpy.group.Group, endpoint: zigpy.endpoint.Endpoint):
-        logging.debug('>group_member_added:', group, endpoint)
+        logger.debug('>group_member_added: %s %s', group, endpoint)
     def group_member_removed(self, group: zigpy.group.Group, endpoint: zigpy.endpoint.Endpoint):
-        logging.debug('>group_member_removed:', group, endpoint)
+        logger.debug('>group_member_removed: %s %s', group, endpoint)
     # zigpy/device.py
     def device_last_seen_updated(self, value: datetime.datetime | int | float):
-        logging.debug('>device_last_seen_updated:', value)
+        logger.debug('>device_last_seen_updated: %s', value)
     def device_init_failure(self, device: zigpy.device.Device):
-        logging.debug('>device_init_failure:', device)
+        logger.debug('>device_init_failure: %s', device)
     def device_relays_updated(self, relays: zigpy.types.Relays):
-        logging.debug('>device_relays_updated:', relays)
+        logger.debug('>device_relays_updated: %s', relays)
     # zigpy/application.py
     def raw_device_initialized(self, device: zigpy.device.Device):
-        logging.debug('>raw_device_initialized:', device)
+        logger.debug('>raw_device_initialized: %s', device)
     def device_initialized(self, device: zigpy.device.Device):
-        logging.debug('>device_initialized:', device)
+        logger.debug('>device_initialized: %s', device)
     def device_removed(self, device: zigpy.device.Device):
-        logging.debug('>device_removed:', device)
+        logger.debug('>device_removed: %s', device)
     def device_joined(self, device: zigpy.device.Device):
-        logging.debug('>device_joined:', device)
+        logger.debug('>device_joined: %s', device)
     def device_left(self, device: zigpy.device.Device):
-        logging.debug('>device_left:', device)
+        logger.debug('>device_left: %s', device)
     # zigpy/endpoint.py
     def unknown_cluster_message(self, cmdId: zigpy.types.uint8_t, args: list[Any]):
-        logging.debug('>unknown_cluster_message:', cmdId, args)
+        logger.debug('>unknown_cluster_message: %s %s', cmdId, args)
     # zigpy/topology.py
     def neighbors_updated(self, ieee: zigpy.types.EUI64, neighbors: list[zigpy.zdo.types.Neighbor]):
-        logging.debug('>neighbors_updated:', ieee, neighbors)
+        logger.debug('>neighbors_updated: %s %s', ieee, neighbors)
     def routes_updated(self, ieee: zigpy.types.EUI64, routes: list[zigpy.zdo.types.Route]):
-        logging.debug('>routes_updated:', ieee, routes)
+        logger.debug('>routes_updated: %s %s', ieee, routes)
     # zigpy/backups.py
     def network_backup_removed(self, backup: zigpy.backups.NetworkBackup):
-        logging.debug('>network_backup_removed:', backup)
+        logger.debug('>network_backup_removed: %s', backup)
     def network_backup_created(self, backup: zigpy.backups.NetworkBackup):
-        logging.debug('>network_backup_created:', backup)
+        logger.debug('>network_backup_created: %s', backup)
     # zigpy/zdo/__init__.py
     # zdo_{hdr.command_id.name.lower()}
     def device_announce(self, device: zigpy.device.Device):
-        logging.debug('>device_announce:', device)
+        logger.debug('>device_announce: %s', device)
     def permit_duration(self, duration: int):
-        logging.debug('>permit_duration:', duration)
+        logger.debug('>permit_duration: %s', duration)
     # zigpy/zcl/__init__.py
     def cluster_command(self, tsn: zigpy.types.uint8_t, cmdId: zigpy.types.uint8_t, args: list[Any]):
-        logging.debug('>cluster_command:', tsn, cmdId, args)
+        logger.debug('>cluster_command: %s %s %s', tsn, cmdId, args)
     def general_command(self, hdr: zigpy.zcl.foundation.ZCLHeader, args: list[Any]):
-        logging.debug('>general_command:', hdr, args)
+        logger.debug('>general_command: %s %s', hdr, args)
     def attribute_updated(self, attrId: int | zigpy.types.uint16_t, value: Any, now: datetime.datetime):
-        logging.debug('>attribute_updated:', attrId, value, now)
+        logger.debug('>attribute_updated: %s %s %s', attrId, value, now)
     def unsupported_attribute_added(self, attr: int):
-        logging.debug('>unsupported_attribute_added:', int)
+        logger.debug('>unsupported_attribute_added: %s', attr)
     def unsupported_attribute_removed(self, attr: int):
-        logging.debug('>unsupported_attribute_removed:', int)
+        logger.debug('>unsupported_attribute_removed: %s', attr)
 
     # Generic handler:
     def handle_message(self, device: zigpy.device.Device, profile: int, cluster: int, src_ep: int, dst_ep: int, message: bytes):
-        logging.debug(f'>handle_message {device.ieee} profile:{profile} cluster:{cluster} src_ep:{src_ep} dst_ep:{dst_ep} message:{message}')
+        logger.debug('>handle_message %s profile:%s cluster:%s src_ep:%s dst_ep:%s message:%s', device.ieee, profile, cluster, src_ep, dst_ep, message)
 
 
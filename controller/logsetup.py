@@ -0,0 +1,79 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+logsetup.py
+Logging setup
+Non-blocking logging: records queued by the event loop thread, formatted & written by a background thread
+'''
+
+import atexit
+import logging
+import logging.handlers
+import queue
+
+# Format of the log lines
+LOG_FORMAT = '%(asctime)s %(levelname)s %(module)s/%(funcName)s %(message)s'
+# Loggers of high-rate debug events, sampled if enabled
+SAMPLED_LOGGERS = ['listener']
+
+# Background thread writing the records
+_listener = None
+
+
+class SampleFilter(logging.Filter):
+    '''Filter letting through 1 in rate debug records of each call site (the first one included),
+    records above debug level being always let through'''
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+        # Call site (path, line): number of records
+        self._counts = {}
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        site = (record.pathname, record.lineno)
+        count = self._counts.get(site, 0)
+        self._counts[site] = count + 1
+        return count % self.rate == 0
+
+
+def setup(level=logging.INFO, path=None, sampleRate=1):
+    '''Log at level to the file at path (stderr if None), replacing the handlers of the root logger.
+    The calling thread only queues the records (their message merged with its args), the lines being formatted
+    & written by a background thread, so a slow write does not stall the event loop.
+    Debug records of SAMPLED_LOGGERS are sampled, 1 in sampleRate being kept.
+    The background thread is stopped at exit (see shutdown)'''
+    global _listener
+    shutdown()
+    handler = logging.FileHandler(path, encoding='utf-8') if path else logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    for oldHandler in root.handlers[:]:
+        root.removeHandler(oldHandler)
+        oldHandler.close()
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(level)
+    for name in SAMPLED_LOGGERS:
+        logger = logging.getLogger(name)
+        for oldFilter in logger.filters[:]:
+            if isinstance(oldFilter, SampleFilter):
+                logger.removeFilter(oldFilter)
+        if sampleRate > 1:
+            logger.addFilter(SampleFilter(sampleRate))
+    _listener = logging.handlers.QueueListener(records, handler)
+    _listener.start()
+
+
+@atexit.register
+def shutdown():
+    '''Stop the background thread, once the queued records written'''
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
@@ -0,0 +1,183 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+loopmon.py
+Event loop monitor
+Lag of the asyncio event loop, detection of the steps blocking it & sampling profiles, to find what stalls the radio handling
+'''
+
+import asyncio
+from collections import Counter, deque
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+import metrics
+
+# Sampling period of the event loop lag [seconds]
+LAG_PERIOD = 0.1
+# Lag logged as a warning [seconds]
+LAG_WARNING = 0.5
+# Slow steps kept, most recent last
+SLOW_STEPS_KEPT = 20
+# Sampling profile: duration & sampling period [seconds], number of stacks logged
+PROFILE_DURATION = 10.
+PROFILE_PERIOD = 0.005
+PROFILE_TOP = 5
+
+# Metrics
+LOOP_LAG_SECONDS = metrics.Histogram('zbctrl_loop_lag_seconds', 'Lag of the event loop (delay of a periodic timer)',
+                                     buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5.))
+SLOW_STEPS = metrics.Counter('zbctrl_loop_slow_steps_total', 'Event loop steps (callbacks, coroutine steps) longer than the slow step threshold')
+
+
+def _frameName(frame):
+    code = frame.f_code
+    return '%s:%s' % (os.path.basename(code.co_filename), getattr(code, 'co_qualname', code.co_name))
+
+
+class LoopMonitor():
+    '''Monitor of the event loop it is started on:
+    - its lag (delay of a periodic timer) as a histogram metric, large lags being logged
+    - optionally, the steps (callbacks, coroutine steps) blocking it for longer than slowStep [seconds]:
+      every step being timed, a watcher thread captures the stack & task of the loop thread while a step lasts
+    - on demand, a sampling profile of the loop thread, written to profileDir (in collapsed stacks format, for flame graphs)'''
+
+    def __init__(self, slowStep=None, profileDir=None):
+        self.slowStep = slowStep
+        self.profileDir = profileDir or tempfile.gettempdir()
+        # Slow steps: (time, duration [seconds], task, stack as a list of lines, None if not captured)
+        self.slowSteps = deque(maxlen=SLOW_STEPS_KEPT)
+        self._loop = None
+        self._threadId = None
+        self._lagTask = None
+        self._watcher = None
+        self._stopping = threading.Event()
+        self._profiler = None
+        # Step running: (handle, start [monotonic time]), and its (task, stack) if captured by the watcher
+        self._step = None
+        self._captured = None
+        self._handleRun = None
+
+    def start(self):
+        '''Start monitoring the running event loop'''
+        self._loop = asyncio.get_running_loop()
+        self._threadId = threading.get_ident()
+        self._lagTask = asyncio.create_task(self._sampleLag())
+        if self.slowStep:
+            self._timeSteps()
+            self._stopping.clear()
+            self._watcher = threading.Thread(target=self._watch, name='loopmon-watcher', daemon=True)
+            self._watcher.start()
+            logging.info('Detecting event loop steps longer than %.3fs', self.slowStep)
+
+    def stop(self):
+        if self._lagTask is not None:
+            self._lagTask.cancel()
+            self._lagTask = None
+        if self._watcher is not None:
+            self._stopping.set()
+            self._watcher.join()
+            self._watcher = None
+        if self._handleRun is not None:
+            asyncio.events.Handle._run = self._handleRun
+            self._handleRun = None
+
+    async def _sampleLag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(LAG_PERIOD)
+            lag = max(0., loop.time() - start - LAG_PERIOD)
+            LOOP_LAG_SECONDS.observe(lag)
+            if lag > LAG_WARNING:
+                logging.warning('Event loop lagging by %.3fs', lag)
+
+    def _timeSteps(self):
+        '''Time every step of the loop, by wrapping Handle._run (the callbacks & coroutine steps being run by it)'''
+        monitor = self
+        handleRun = self._handleRun = asyncio.events.Handle._run
+        def _run(handle):
+            if handle._loop is not monitor._loop:
+                return handleRun(handle)
+            step = monitor._step = (handle, time.monotonic())
+            try:
+                return handleRun(handle)
+            finally:
+                monitor._step = None
+                duration = time.monotonic() - step[1]
+                if duration > monitor.slowStep:
+                    monitor._slowStep(step, duration)
+        asyncio.events.Handle._run = _run
+
+    def _watch(self):
+        '''Watcher thread: capture the task & stack of the loop thread during a slow step'''
+        while not self._stopping.wait(self.slowStep / 4):
+            step = self._step
+            if step is None or (self._captured is not None and self._captured[0] is step) or time.monotonic() - step[1] <= self.slowStep:
+                continue
+            frame = sys._current_frames().get(self._threadId)
+            task = asyncio.current_task(self._loop)
+            stack = None
+            if frame is not None:
+                # From the step run by the loop
+                stack = traceback.extract_stack(frame)
+                for i, frameSummary in enumerate(stack):
+                    if frameSummary.filename == asyncio.events.__file__ and frameSummary.name == '_run':
+                        stack = stack[i + 1:]
+                        break
+                stack = traceback.format_list(stack)
+            self._captured = (step, task, stack)
+
+    def _slowStep(self, step, duration):
+        task, stack = None, None
+        captured = self._captured
+        if captured is not None and captured[0] is step:
+            _, task, stack = captured
+        self._captured = None
+        SLOW_STEPS.inc()
+        taskName = '%s (%s)' % (task.get_name(), task.get_coro().__qualname__) if task is not None else repr(step[0])
+        self.slowSteps.append((time.time(), duration, taskName, stack))
+        logging.warning('Slow event loop step: %.3fs in %s%s', duration, taskName, ('\n' + ''.join(stack).rstrip()) if stack else ' (stack not captured)')
+
+    def profile(self, duration=PROFILE_DURATION):
+        '''Start a sampling profile of the loop thread for duration [seconds] (unless one is running), in a background thread.
+        Returns the path of the file it is written to'''
+        if self._profiler is not None and self._profiler.is_alive():
+            logging.warning('Profile already running')
+            return None
+        path = os.path.join(self.profileDir, 'zbctrl-profile-%s.txt' % time.strftime('%Y%m%d-%H%M%S'))
+        self._profiler = threading.Thread(target=self._profile, args=(duration, path), name='loopmon-profiler', daemon=True)
+        self._profiler.start()
+        return path
+
+    def _profile(self, duration, path):
+        logging.info('Profiling the event loop for %fs', duration)
+        stacks = Counter()
+        samples = 0
+        until = time.monotonic() + duration
+        while time.monotonic() < until:
+            frame = sys._current_frames().get(self._threadId)
+            if frame is None:
+                break
+            names = []
+            while frame is not None:
+                names.append(_frameName(frame))
+                frame = frame.f_back
+            stacks[';'.join(reversed(names))] += 1
+            samples += 1
+            time.sleep(PROFILE_PERIOD)
+        try:
+            with open(path, 'w') as f:
+                for stack, count in stacks.most_common():
+                    f.write('%s %d\n' % (stack, count))
+        except OSError as e:
+            logging.error('Unable to write profile to %s: %r', path, e)
+            return
+        top = ''.join('\n  %5.1f%% %s' % (100. * count / samples, stack.rsplit(';', 1)[-1]) for stack, count in stacks.most_common(PROFILE_TOP))
+        logging.info('Profile of %d samples written to %s, top stacks:%s', samples, path, top)
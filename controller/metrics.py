@@ -0,0 +1,195 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+metrics.py
+Metrics
+Counters & histograms of the controller hot paths, exported over HTTP in Prometheus text format
+'''
+
+from abc import ABC, abstractmethod
+import asyncio
+from bisect import bisect_left
+import logging
+import math
+
+# Default histogram buckets (upper bounds) [seconds]
+DEFAULT_BUCKETS = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10.)
+# HTTP exporter: maximum size of a request head [bytes] and time to receive it [seconds]
+HTTP_MAX_REQUEST = 4096
+HTTP_TIMEOUT = 5.
+
+# All the metrics, in definition order
+REGISTRY = []
+
+
+class CounterValue():
+    '''Value of a counter (for one set of label values)'''
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class GaugeValue():
+    '''Value of a gauge (for one set of label values)'''
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+
+class HistogramValue():
+    '''Value of a histogram (for one set of label values): count per bucket (not cumulated), sum & count'''
+    __slots__ = ('bounds', 'buckets', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value):
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metric(ABC):
+    '''Metric with optional labels, its values being created on first use of each set of label values'''
+    type = None
+
+    def __init__(self, name, helpmsg, labelNames=()):
+        self.name = name
+        self.helpmsg = helpmsg
+        self.labelNames = tuple(labelNames)
+        self._values = {}
+        if not self.labelNames:
+            self._default = self.labels()
+        REGISTRY.append(self)
+
+    @abstractmethod
+    def _newValue(self):
+        '''New value of the metric, for a set of label values'''
+
+    @abstractmethod
+    def _renderValue(self, labelValues, value):
+        '''Lines of the value of the metric for labelValues, in Prometheus text format'''
+
+    def labels(self, *labelValues):
+        '''Value of the metric for labelValues (to be kept by callers for the hottest paths)'''
+        value = self._values.get(labelValues)
+        if value is None:
+            if len(labelValues) != len(self.labelNames):
+                raise ValueError('Expected labels %s for metric %s' % (self.labelNames, self.name))
+            value = self._values[labelValues] = self._newValue()
+        return value
+
+    def _labelsText(self, labelValues, extra=''):
+        pairs = ['%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                 for name, value in zip(self.labelNames, labelValues)]
+        if extra:
+            pairs.append(extra)
+        return '{%s}' % ','.join(pairs) if pairs else ''
+
+    def render(self):
+        '''Lines of the metric in Prometheus text format'''
+        lines = ['# HELP %s %s' % (self.name, self.helpmsg), '# TYPE %s %s' % (self.name, self.type)]
+        for labelValues, value in list(self._values.items()):
+            lines.extend(self._renderValue(labelValues, value))
+        return lines
+
+
+class Counter(Metric):
+    '''Monotonically increasing count of events'''
+    type = 'counter'
+
+    def _newValue(self):
+        return CounterValue()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def _renderValue(self, labelValues, value):
+        return ['%s%s %s' % (self.name, self._labelsText(labelValues), _format(value.value))]
+
+
+class Gauge(Metric):
+    '''Current value of something (eg. number of devices), set when it changes or periodically'''
+    type = 'gauge'
+
+    def _newValue(self):
+        return GaugeValue()
+
+    def set(self, value):
+        self._default.set(value)
+
+    def _renderValue(self, labelValues, value):
+        return ['%s%s %s' % (self.name, self._labelsText(labelValues), _format(value.value))]
+
+
+class Histogram(Metric):
+    '''Distribution of observed values (eg. durations [seconds])'''
+    type = 'histogram'
+
+    def __init__(self, name, helpmsg, labelNames=(), buckets=DEFAULT_BUCKETS):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, helpmsg, labelNames)
+
+    def _newValue(self):
+        return HistogramValue(self.bounds)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def _renderValue(self, labelValues, value):
+        lines = []
+        cumulated = 0
+        for bound, count in zip(self.bounds + (math.inf,), value.buckets):
+            cumulated += count
+            lines.append('%s_bucket%s %d' % (self.name, self._labelsText(labelValues, 'le="%s"' % _format(bound)), cumulated))
+        lines.append('%s_sum%s %s' % (self.name, self._labelsText(labelValues), _format(value.sum)))
+        lines.append('%s_count%s %d' % (self.name, self._labelsText(labelValues), value.count))
+        return lines
+
+
+def _format(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render():
+    '''All the metrics in Prometheus text format'''
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+async def _handleHttp(reader, writer):
+    '''Minimal HTTP/1.0 handler: GET /metrics'''
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), HTTP_TIMEOUT)
+        method, path, _ = head.split(b'\r\n', 1)[0].decode('latin-1').split(' ', 2)
+        if method != 'GET' or path.split('?', 1)[0] != '/metrics':
+            status, body, contentType = '404 Not Found', b'Not found\n', 'text/plain; charset=utf-8'
+        else:
+            status, body, contentType = '200 OK', render().encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8'
+        writer.write(('HTTP/1.0 %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: close\r\n\r\n' % (status, contentType, len(body))).encode('latin-1') + body)
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ValueError, ConnectionError) as e:
+        logging.debug('Invalid metrics request: %r', e)
+    finally:
+        writer.close()
+
+async def serve(host, port):
+    '''Start the HTTP exporter of the metrics on host:port, returns the asyncio Server'''
+    server = await asyncio.start_server(_handleHttp, host, port, limit=HTTP_MAX_REQUEST)
+    logging.info('Serving metrics on %s:%d/metrics', host, port)
+    return server
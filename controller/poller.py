@@ -0,0 +1,176 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+poller.py
+Zigbee devices poller
+Scheduling the periodic state reads of the devices without flooding the coordinator
+'''
+
+import asyncio
+from collections import deque
+import heapq
+import logging
+import random
+
+from zigbee import State
+
+# Maximum number of device state reads in flight (per shard, ie. coordinator)
+POLL_MAX_INFLIGHT = 4
+# Random jitter of each device poll time, as a fraction of its period
+POLL_JITTER = 0.1
+# Maximum poll period of devices often not available, as a multiple of the base period
+POLL_MAX_BACKOFF = 8
+
+
+class PollScheduler():
+    '''Periodic poller of the devices state:
+    - polls are spread evenly over the period, with jitter
+    - the number of reads in flight is bounded, per shard (coordinator): shards are polled in parallel
+    - devices whose state is still fresh (eg. reported by the device itself) are skipped
+    - devices often not available are polled less often'''
+
+    def __init__(self, poll, period, maxInflight=POLL_MAX_INFLIGHT, shardOf=None):
+        '''Constructor: poll async function(device) returning the device State, period base poll period [seconds],
+        shardOf optional function(device) returning the shard of a device (a single one by default)'''
+        self.poll = poll
+        self.period = period
+        self.maxInflight = maxInflight
+        self.shardOf = shardOf or (lambda device: None)
+        # Reads in flight per shard, and devices due waiting for a read slot of their shard
+        self._inflight = {}
+        self._waiting = {}
+        # Poll period multiplier of each device (1 when available)
+        self._backoff = {}
+        # Last time each device state was known, and until when it is considered fresh [loop time]
+        self._lastSeen = {}
+        self._freshUntil = {}
+        # Next poll of each device [loop time], and their heap of (due, device)
+        # (heap entries not matching _next are outdated and skipped)
+        self._next = {}
+        self._due = []
+        self._wakeup = asyncio.Event()
+        self._tasks = set()
+
+    def _schedule(self, device, due):
+        '''Schedule next poll of device at due [loop time]'''
+        self._next[device] = due
+        heapq.heappush(self._due, (due, device))
+        self._wakeup.set()
+
+    def _jitter(self, period):
+        return random.uniform(-POLL_JITTER, POLL_JITTER) * period
+
+    def setDevices(self, devices):
+        '''Set the devices to poll, spreading the new ones evenly over the period'''
+        devices = list(devices)
+        for device in list(self._backoff):
+            if device not in devices:
+                self.remove(device)
+        newDevices = [device for device in devices if device not in self._backoff]
+        now = asyncio.get_running_loop().time()
+        for i, device in enumerate(newDevices):
+            self._backoff[device] = 1
+            offset = self.period * i / len(newDevices)
+            self._schedule(device, now + max(0., offset + self._jitter(self.period)))
+
+    def remove(self, device):
+        '''Stop polling device'''
+        self._backoff.pop(device, None)
+        self._lastSeen.pop(device, None)
+        self._freshUntil.pop(device, None)
+        self._next.pop(device, None)
+
+    def seen(self, device, fresh=None):
+        '''Record that the state of device is known (eg. reported), postponing its next poll
+        until it is no longer fresh (fresh [seconds], defaults to the poll period)'''
+        if device in self._backoff:
+            now = asyncio.get_running_loop().time()
+            self._lastSeen[device] = now
+            self._freshUntil[device] = max(self._freshUntil.get(device, now), now + (fresh or self.period))
+            self._backoff[device] = 1
+
+    def lastSeen(self, device):
+        '''Last time the state of device was known [loop time, ie. time.monotonic()], None if never'''
+        return self._lastSeen.get(device)
+
+    def _dispatch(self, device):
+        '''Poll a device due, unless its state is still fresh, or queue it if its shard has too many reads in flight'''
+        loop = asyncio.get_running_loop()
+        # Skipping devices whose state is still fresh
+        freshUntil = self._freshUntil.get(device)
+        if freshUntil is not None and loop.time() < freshUntil:
+            period = self.period * self._backoff[device]
+            self._schedule(device, freshUntil + abs(self._jitter(period)))
+            return
+        shard = self.shardOf(device)
+        if self._inflight.get(shard, 0) >= self.maxInflight:
+            self._waiting.setdefault(shard, deque()).append(device)
+            return
+        self._inflight[shard] = self._inflight.get(shard, 0) + 1
+        task = asyncio.create_task(self._pollDevice(device, shard))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _release(self, shard):
+        '''Read of shard done: polling the next device waiting for it'''
+        self._inflight[shard] -= 1
+        waiting = self._waiting.get(shard)
+        while waiting and self._inflight[shard] < self.maxInflight:
+            device = waiting.popleft()
+            # Unless removed or rescheduled in between
+            if device in self._backoff and device not in self._next:
+                self._dispatch(device)
+
+    async def _pollDevice(self, device, shard):
+        '''Poll device, adapt its period to its availability and schedule next poll'''
+        try:
+            try:
+                state = await self.poll(device)
+            except Exception as e:
+                logging.error('Unable to get actual state for device %s: %r', device, e)
+                state = State.NA
+        finally:
+            self._release(shard)
+        if device not in self._backoff:
+            return
+        now = asyncio.get_running_loop().time()
+        if state == State.NA:
+            self._backoff[device] = min(self._backoff[device] * 2, POLL_MAX_BACKOFF)
+            logging.debug('  Device %s not available, polling every %fs', device, self.period * self._backoff[device])
+        else:
+            self._backoff[device] = 1
+            self._lastSeen[device] = now
+        period = self.period * self._backoff[device]
+        if state != State.NA:
+            # Fresh until the earliest (jittered) next poll
+            self._freshUntil[device] = max(self._freshUntil.get(device, now), now + period * (1 - POLL_JITTER))
+        self._schedule(device, now + period + self._jitter(period))
+
+    async def run(self):
+        '''Poll the devices when due, until cancelled'''
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                if not self._due:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                due, device = self._due[0]
+                if self._next.get(device) != due:
+                    heapq.heappop(self._due)
+                    continue
+                delay = due - loop.time()
+                if delay > 0:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                heapq.heappop(self._due)
+                del self._next[device]
+                self._dispatch(device)
+        finally:
+            for task in self._tasks:
+                task.cancel()
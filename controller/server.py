@@ -9,63 +9,355 @@ Offering API to interact with the Zigbee controller
 
 import asyncio
 from concurrent import futures
+import enum
+import hmac
 import json
 import logging
+import time
 
 import grpc
 
-from zbCtrl_pb2 import GetStateResponse, SetStateResponse
+from zbCtrl_pb2 import GetStateResponse, SetStateResponse, WatchStateResponse, ListDevicesResponse, DeviceEntry, GetDeviceInfoResponse, GetHealthResponse, ShardHealth, GetHistoryResponse, StateChange, ControlResponse, CommandResult, DeviceStates, StateFormat
 from zbCtrl_pb2_grpc import ZBCtrlServicer, add_ZBCtrlServicer_to_server
 import zbCtrl_pb2_grpc
+from zigbee import State
+from admission import AdmissionInterceptor
+import metrics
+
+# Time kept from the request deadline to send the response [seconds]
+DEADLINE_MARGIN = 0.1
+# Control stream: default time for the changes of a command to be applied [seconds],
+# and maximum number of commands being applied at once per stream (reading the next ones waiting until then)
+CONTROL_TIMEOUT = 5.
+CONTROL_MAX_INFLIGHT = 64
+# Server options: keepalive of the connections (long-lived streams of the gateway, through NATs),
+# concurrent streams per connection
+SERVER_OPTIONS = [
+    ('grpc.keepalive_time_ms', 60000),
+    ('grpc.keepalive_timeout_ms', 20000),
+    ('grpc.keepalive_permit_without_calls', 1),
+    ('grpc.http2.min_ping_interval_without_data_ms', 30000),
+    ('grpc.max_concurrent_streams', 100),
+]
+
+# Metrics
+HANDLER_SECONDS = metrics.Histogram('zbctrl_grpc_handler_seconds', 'Duration of the gRPC handlers', ['method'])
+GETSTATE_SECONDS = HANDLER_SECONDS.labels('GetState')
+SETSTATE_SECONDS = HANDLER_SECONDS.labels('SetState')
+CONTROL_COMMAND_SECONDS = HANDLER_SECONDS.labels('Control')
 
 
 class ZBCtrlSrv(ZBCtrlServicer):
     '''gRPC server handling get/set requests to the contoller'''
 
-    def __init__(self, ctrl, apikey):
+    def __init__(self, ctrl, apikey, authInInterceptor=False):
+        '''Constructor: ctrl ZBCtrl, apikey API key authenticating the requests,
+        authInInterceptor True if they are authenticated before reaching the handlers (see newServer)'''
         super().__init__()
         self.ctrl = ctrl
         self.apikey = apikey
+        self.authInInterceptor = authInInterceptor
 
     def _authReq(self, req):
-        '''Autenticates a request with an API key'''
-        return req.key == self.apikey
-    
+        '''Autenticates a request with an API key (compared in constant time)'''
+        return self.authInInterceptor or hmac.compare_digest(req.key.encode('utf-8'), self.apikey.encode('utf-8'))
+
+    @staticmethod
+    def _encodeState(state, fmt):
+        '''Encode a state dict as response fields, in the requested StateFormat'''
+        if fmt == StateFormat.PROTO:
+            return {'devices': DeviceStates(ids=list(state.keys()), states=list(state.values()))}
+        return {'state': json.dumps(state)}
+
+    @classmethod
+    def _encodeSnapshot(cls, snapshot, fmt):
+        '''Encode a controller StateSnapshot as response fields, only once per snapshot & format'''
+        fields = snapshot.cache.get(fmt)
+        if fields is None:
+            fields = snapshot.cache[fmt] = dict(cls._encodeState(dict(snapshot.devices), fmt), **cls._encodeStale(snapshot))
+        return fields
+
+    @staticmethod
+    def _encodeStale(snapshot):
+        '''Encode the stale devices of a controller StateSnapshot as response fields'''
+        return {'stale': sorted(snapshot.stale)} if snapshot.stale else {}
+
     async def GetState(self, req, ctx):
+        start = time.perf_counter()
+        try:
+            return await self._getState(req, ctx)
+        finally:
+            GETSTATE_SECONDS.observe(time.perf_counter() - start)
+
+    async def _getState(self, req, ctx):
         logging.debug('Request recieved...')
         if not self._authReq(req):
             logging.warning('  Invalid API key')
             return await ctx.abort(grpc.StatusCode.UNAUTHENTICATED, 'Invalid API key')
-        state = await self.ctrl.getState()
-        res = GetStateResponse(state=json.dumps(state))
+        sinceVersion = req.since_version if req.HasField('since_version') else None
+        snapshot, changes = self.ctrl.getStateSince(sinceVersion)
+        if changes is None:
+            res = GetStateResponse(version=snapshot.version, **self._encodeSnapshot(snapshot, req.format))
+        elif not changes:
+            logging.debug('Response sent: not modified.')
+            return GetStateResponse(version=snapshot.version, not_modified=True)
+        else:
+            res = GetStateResponse(version=snapshot.version, delta=True, **self._encodeState(changes, req.format), **self._encodeStale(snapshot))
         logging.debug('Response sent.')
         return res
 
     async def SetState(self, req, ctx):
+        start = time.perf_counter()
+        try:
+            return await self._setState(req, ctx)
+        finally:
+            SETSTATE_SECONDS.observe(time.perf_counter() - start)
+
+    async def _setState(self, req, ctx):
         logging.debug('Request recieved...')
         if not self._authReq(req):
             logging.warning('  Invalid API key')
             return await ctx.abort(grpc.StatusCode.UNAUTHENTICATED, 'Invalid API key')
+        if req.HasField('devices'):
+            newState = dict(zip(req.devices.ids, req.devices.states))
+        else:
+            try:
+                newState = json.loads(req.state)
+            except Exception as e:
+                logging.error('  Error parsing JSON: %r', e)
+                return await ctx.abort(grpc.StatusCode.INVALID_ARGUMENT, 'Unable to parse state as JSON')
+        # Radio requests are bounded by the request deadline, and cancelled with the request
+        timeout = ctx.time_remaining()
+        if timeout is not None:
+            timeout = max(0., timeout - DEADLINE_MARGIN)
         try:
-            newState = json.loads(req.state)
-        except Exception as e:
-            logging.error('  Error parsing JSON: %r' % e)
-            return await ctx.abort(grpc.StatusCode.INVALID_ARGUMENT, 'Unable to parse state as JSON')
-        try:
-            await self.ctrl.setState(newState)
-            res = SetStateResponse(success=True)
+            results, failed = await self.ctrl.setState(newState, timeout)
+            res = SetStateResponse(success=not failed, results=DeviceStates(ids=list(results.keys()), states=list(results.values())), failed=failed)
             logging.debug('Response sent.')
             return res
         except Exception as e:
-            logging.error('  Error setting new state: %r' % e)
+            logging.error('  Error setting new state: %r', e)
             return await ctx.abort(grpc.StatusCode.INTERNAL, 'Error while setting new state')
 
+    async def WatchState(self, req, ctx):
+        '''Stream the full state, then the state changes as they happen'''
+        logging.debug('Watch request recieved...')
+        if not self._authReq(req):
+            logging.warning('  Invalid API key')
+            await ctx.abort(grpc.StatusCode.UNAUTHENTICATED, 'Invalid API key')
+            return
+        # Subscribing before reading the snapshot, so that no change can be missed in between
+        watcher = self.ctrl.watch()
+        try:
+            snapshot = self.ctrl.getState()
+            yield WatchStateResponse(snapshot=True, **self._encodeSnapshot(snapshot, req.format))
+            while True:
+                changes, resync = await watcher.get()
+                if resync:
+                    logging.info('  Watcher fell behind, resyncing with full state')
+                    snapshot = self.ctrl.getState()
+                    yield WatchStateResponse(snapshot=True, **self._encodeSnapshot(snapshot, req.format))
+                else:
+                    yield WatchStateResponse(snapshot=False, **self._encodeState(changes, req.format))
+        finally:
+            self.ctrl.unwatch(watcher)
+            logging.debug('Watch ended.')
+
+    async def ListDevices(self, req, ctx):
+        '''List the devices of the network, optionally only those having a capability'''
+        logging.debug('List request recieved...')
+        if not self._authReq(req):
+            logging.warning('  Invalid API key')
+            return await ctx.abort(grpc.StatusCode.UNAUTHENTICATED, 'Invalid API key')
+        devices = self.ctrl.listDevices(req.capability or None)
+        res = ListDevicesResponse(devices=[
+            DeviceEntry(id=device.id, nwk=device.nwk, manufacturer=device.manufacturer, model=device.model, capabilities=sorted(device.capabilities))
+            for device in devices])
+        logging.debug('Response sent.')
+        return res
+
+    @staticmethod
+    def _formatValue(value):
+        '''Format an attribute value (or status) as a string: enums by name'''
+        return value.name if isinstance(value, enum.Enum) else str(value)
+
+    async def GetDeviceInfo(self, req, ctx):
+        '''Read the info of a device (Basic & OnOff cluster attributes)'''
+        logging.debug('Info request recieved...')
+        if not self._authReq(req):
+            logging.warning('  Invalid API key')
+            return await ctx.abort(grpc.StatusCode.UNAUTHENTICATED, 'Invalid API key')
+        timeout = ctx.time_remaining()
+        if timeout is not None:
+            timeout = max(0., timeout - DEADLINE_MARGIN)
+        try:
+            ok, ko = await self.ctrl.getDeviceInfo(req.id, timeout)
+        except ValueError as e:
+            return await ctx.abort(grpc.StatusCode.NOT_FOUND, str(e))
+        except RuntimeError as e:
+            return await ctx.abort(grpc.StatusCode.UNAVAILABLE, str(e))
+        except asyncio.TimeoutError:
+            return await ctx.abort(grpc.StatusCode.DEADLINE_EXCEEDED, 'Device info not read in time')
+        except Exception as e:
+            logging.error('  Error reading device info: %r', e)
+            return await ctx.abort(grpc.StatusCode.INTERNAL, 'Error while reading device info')
+        res = GetDeviceInfoResponse(
+            attributes={attr: self._formatValue(value) for attr, value in ok.items()},
+            failed={attr: self._formatValue(status) for attr, status in ko.items()})
+        logging.debug('Response sent.')
+        return res
+
+    async def GetHealth(self, req, ctx):
+        '''Health status of the Zigbee networks (shards)'''
+        logging.debug('Health request recieved...')
+        if not self._authReq(req):
+            logging.warning('  Invalid API key')
+            return await ctx.abort(grpc.StatusCode.UNAUTHENTICATED, 'Invalid API key')
+        return GetHealthResponse(shards=[
+            ShardHealth(name=health['name'], channel=health['channel'], status=health['status'], last_error=health['lastError'] or '',
+                        devices=health['devices'], offline=health['offline'])
+            for health in self.ctrl.health()])
+
+    async def GetHistory(self, req, ctx):
+        '''Journaled state changes, optionally of a device, since a time, after a sequence number'''
+        logging.debug('History request recieved...')
+        if not self._authReq(req):
+            logging.warning('  Invalid API key')
+            return await ctx.abort(grpc.StatusCode.UNAUTHENTICATED, 'Invalid API key')
+        try:
+            changes, more = await self.ctrl.getHistory(req.device or None, req.since or None, req.limit or None,
+                                                       req.after_seq if req.HasField('after_seq') else None)
+        except ValueError:
+            return await ctx.abort(grpc.StatusCode.INVALID_ARGUMENT, 'Invalid device ID')
+        except RuntimeError as e:
+            return await ctx.abort(grpc.StatusCode.FAILED_PRECONDITION, str(e))
+        res = GetHistoryResponse(more=more, changes=[
+            StateChange(seq=seq, timestamp=timestamp, device=device, old_state=oldState, new_state=newState, source=source.name)
+            for seq, timestamp, device, oldState, newState, source in changes])
+        logging.debug('Response sent.')
+        return res
+
+    async def Control(self, reqIter, ctx):
+        '''Bidirectional stream: commands in, each with a client correlation id, applied concurrently (pipelined, up to CONTROL_MAX_INFLIGHT),
+        their per-device results out as soon as applied, interleaved with the state changes if watched.
+        Results & events share a single slot to the client: a slow client slows down the reading of the commands,
+        the state changes being coalesced meanwhile (see StateWatcher)'''
+        logging.debug('Control stream recieved...')
+        requests = reqIter.__aiter__()
+        try:
+            req = await requests.__anext__()
+        except StopAsyncIteration:
+            return
+        if not self._authReq(req):
+            logging.warning('  Invalid API key')
+            await ctx.abort(grpc.StatusCode.UNAUTHENTICATED, 'Invalid API key')
+            return
+        out = asyncio.Queue(1)
+        inflight = asyncio.Semaphore(CONTROL_MAX_INFLIGHT)
+        commands = set()
+        watcher = None
+        watchTask = None
+
+        async def watch():
+            # Subscribed before reading the snapshot, so that no change can be missed in between
+            snapshot = self.ctrl.getState()
+            await out.put(ControlResponse(event=WatchStateResponse(snapshot=True, **self._encodeSnapshot(snapshot, StateFormat.PROTO))))
+            while True:
+                changes, resync = await watcher.get()
+                if resync:
+                    snapshot = self.ctrl.getState()
+                    event = WatchStateResponse(snapshot=True, **self._encodeSnapshot(snapshot, StateFormat.PROTO))
+                else:
+                    event = WatchStateResponse(snapshot=False, **self._encodeState(changes, StateFormat.PROTO))
+                await out.put(ControlResponse(event=event))
+
+        async def command(req):
+            try:
+                result = await self._controlCommand(req, ctx)
+                await out.put(ControlResponse(result=result))
+            finally:
+                inflight.release()
+
+        async def read(req):
+            nonlocal watcher, watchTask
+            try:
+                while req is not None:
+                    if req.watch and watcher is None:
+                        watcher = self.ctrl.watch()
+                        watchTask = asyncio.create_task(watch())
+                    if req.HasField('devices'):
+                        await inflight.acquire()
+                        task = asyncio.create_task(command(req))
+                        commands.add(task)
+                        task.add_done_callback(commands.discard)
+                    req = await anext(requests, None)
+                # Client done sending: ending once the results sent (unless watching, until cancelled)
+                if commands:
+                    await asyncio.wait(list(commands))
+            except Exception as e:
+                logging.error('  Error reading control stream: %r', e)
+                await out.put(None)
+                return
+            if watchTask is None:
+                await out.put(None)
+
+        readTask = asyncio.create_task(read(req))
+        try:
+            while True:
+                res = await out.get()
+                if res is None:
+                    break
+                yield res
+        finally:
+            for task in [readTask, watchTask, *commands]:
+                if task is not None:
+                    task.cancel()
+            if watcher is not None:
+                self.ctrl.unwatch(watcher)
+            logging.debug('Control stream ended.')
+
+    async def _controlCommand(self, req, ctx):
+        '''Apply a command of the Control stream, returns its CommandResult'''
+        start = time.perf_counter()
+        newState = dict(zip(req.devices.ids, req.devices.states))
+        timeout = req.timeout if req.HasField('timeout') else CONTROL_TIMEOUT
+        remaining = ctx.time_remaining()
+        if remaining is not None:
+            timeout = max(0., min(timeout, remaining - DEADLINE_MARGIN))
+        try:
+            results, failed = await self.ctrl.setState(newState, timeout)
+        except Exception as e:
+            logging.error('  Error setting new state: %r', e)
+            return CommandResult(id=req.id, error='Error while setting new state')
+        finally:
+            CONTROL_COMMAND_SECONDS.observe(time.perf_counter() - start)
+        # Devices not changed: already in the requested state, or rejected
+        state = self.ctrl.getState().devices
+        rejected = []
+        for device, deviceState in newState.items():
+            if device not in state or deviceState not in [State.ON, State.OFF]:
+                rejected.append(device)
+            elif device not in results and device not in failed:
+                results[device] = state[device]
+        return CommandResult(id=req.id, results=DeviceStates(ids=list(results.keys()), states=list(results.values())), failed=failed, rejected=rejected)
+
+
+def newServer(ctrl, apikey, **limits):
+    '''gRPC server (its ports to be added) of the ZBCtrlSrv of ctrl, the calls being authenticated by apikey,
+    rate limited & shed beyond capacity by the admission interceptor (limits: its optional arguments), before reaching the handlers'''
+    server = grpc.aio.server(interceptors=[AdmissionInterceptor(apikey, **limits)], options=SERVER_OPTIONS)
+    add_ZBCtrlServicer_to_server(ZBCtrlSrv(ctrl, apikey, authInInterceptor=True), server)
+    return server
+
 
 if __name__ == '__main__':
     import os
-    def getCfg(env, helpmsg=''):
+    import signal
+    def getCfg(env, helpmsg='', default=None):
         cfg = os.getenv(env)
         if not cfg:
+            if default is not None:
+                return default
             raise RuntimeError('Error: missing %s env config%s' % (env, helpmsg))
         return cfg
 
@@ -73,18 +365,42 @@ if __name__ == '__main__':
     SSL_CERT = getCfg('ZBCTRLCERT', ', eg. ./fullchain.pem')
     SSL_KEY = getCfg('ZBCTRLCERTKEY', ', eg. ./key.pem')
     API_KEY = getCfg('ZBCTRLAPIKEY')
-    ZB_DB = getCfg('ZBCTRLDB', ', eg. ./zigpy.db')
-    ZB_ADAPTER = getCfg('ZBCTRLADAPTER', ', eg. /dev/ttyUSB0')
-
-    DEVICES = [
-        '70:ac:08:ff:fe:7e:0b:xx', # 0x7A3D IKEA of Sweden TRADFRI control outlet
-        '34:25:b4:ff:fe:bd:7c:yy', # 0x2488 IKEA of Sweden TRADFRI control outlet
-        'f4:b3:b1:ff:fe:9b:26:zz', # 0x1F17 IKEA of Sweden TRADFRIbulbG125E27WSopal470lm
-    ]
+    # Optional simulated network instead of the radio (for load testing), eg. 'devices=1000,latency=0.02' (see simulator.py)
+    ZB_SIM = getCfg('ZBCTRLSIM', default='')
+    # Several coordinators (shards) as comma-separated lists, eg. ZBCTRLADAPTER=/dev/ttyUSB0,/dev/ttyUSB1 & ZBCTRLDB=./zigpy0.db,./zigpy1.db
+    ZB_DB = getCfg('ZBCTRLDB', ', eg. ./zigpy.db', default='' if ZB_SIM else None).split(',')
+    ZB_ADAPTER = getCfg('ZBCTRLADAPTER', ', eg. /dev/ttyUSB0', default='' if ZB_SIM else None).split(',')
+    ZB_CHANNEL = [int(channel) for channel in getCfg('ZBCTRLCHANNEL', default='20').split(',')]
+    if len(ZB_DB) != len(ZB_ADAPTER) or len(ZB_CHANNEL) not in [1, len(ZB_ADAPTER)]:
+        raise RuntimeError('Error: ZBCTRLADAPTER, ZBCTRLDB (and ZBCTRLCHANNEL if several) env configs should list as many coordinators')
+    ZB_CHANNEL = ZB_CHANNEL * len(ZB_ADAPTER) if len(ZB_CHANNEL) == 1 else ZB_CHANNEL
+    ZB_REPORT_MIN = int(getCfg('ZBCTRLREPORTMIN', default='1'))
+    ZB_REPORT_MAX = int(getCfg('ZBCTRLREPORTMAX', default='300'))
+    # Optional file persisting the last known state, served at once after a restart (disabled if empty)
+    STATE_FILE = getCfg('ZBCTRLSTATEFILE', ', eg. ./state.json', default='')
+    # Optional file journaling the state changes (fixed size ring buffer, disabled if empty)
+    JOURNAL_FILE = getCfg('ZBCTRLJOURNAL', ', eg. ./journal.bin', default='')
+    # Optional metrics exporter (disabled if empty)
+    METRICS_ADDR = getCfg('ZBCTRLMETRICSADDR', ', eg. localhost:9464', default='')
+    # Logging: optional file (stderr if empty), level, and sampling of the high-rate debug events (1 in ZBCTRLLOGSAMPLE kept)
+    LOG_FILE = getCfg('ZBCTRLLOGFILE', ', eg. ./zbCtrl.log', default='')
+    LOG_LEVEL = getCfg('ZBCTRLLOGLEVEL', ', eg. DEBUG', default='INFO').upper()
+    LOG_SAMPLE = int(getCfg('ZBCTRLLOGSAMPLE', default='1'))
+    # Optional detection of the event loop steps longer than ZBCTRLSLOWSTEP [ms] (disabled if 0),
+    # and directory of the sampling profiles of the event loop, triggered by SIGUSR1
+    SLOW_STEP = float(getCfg('ZBCTRLSLOWSTEP', ', eg. 100', default='0')) / 1000.
+    PROFILE_DIR = getCfg('ZBCTRLPROFILEDIR', ', eg. /tmp', default='')
 
+    import logsetup
+    import loopmon
     from zigbee import ZBInterface
     from controller import ZBCtrl
-    logging.basicConfig(format='%(asctime)s %(levelname)s %(module)s/%(funcName)s %(message)s', encoding='utf-8', level=logging.INFO)
+    zbAppFactories = [None] * len(ZB_ADAPTER)
+    if ZB_SIM:
+        # One simulated network per adapter
+        import simulator
+        zbAppFactories = [simulator.SimulatedApplication.factory('%s,shard=%d' % (ZB_SIM, i)) for i in range(len(ZB_ADAPTER))]
+    logsetup.setup(LOG_LEVEL, LOG_FILE or None, LOG_SAMPLE)
     with open(SSL_CERT, 'rb') as f:
         sslCert = f.read()
     with open(SSL_KEY, 'rb') as f:
@@ -94,24 +410,38 @@ if __name__ == '__main__':
 
     async def main():
         logging.info('Starting up!')
-        server = grpc.aio.server()
+        # Monitoring the event loop: lag, slow steps, & profile on demand (kill -USR1)
+        loopMonitor = loopmon.LoopMonitor(slowStep=SLOW_STEP or None, profileDir=PROFILE_DIR or None)
+        loopMonitor.start()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, loopMonitor.profile)
         creds = grpc.ssl_server_credentials(((sslKey, sslCert),))
 
-        zbi = ZBInterface(zpDbPath=ZB_DB, adapterPath=ZB_ADAPTER)
-        ctrl = ZBCtrl(zbi, DEVICES)
-        srv = ZBCtrlSrv(ctrl, API_KEY)
-        await ctrl.start()
-        add_ZBCtrlServicer_to_server(srv, server)
+        zbi = [ZBInterface(zpDbPath=db, adapterPath=adapter, zbChannel=channel, reportMinInterval=ZB_REPORT_MIN, reportMaxInterval=ZB_REPORT_MAX, appFactory=appFactory,
+                           name=adapter or 'sim%d' % i)
+               for i, (db, adapter, channel, appFactory) in enumerate(zip(ZB_DB, ZB_ADAPTER, ZB_CHANNEL, zbAppFactories))]
+        zbi = zbi[0] if len(zbi) == 1 else zbi
+        # Controlling the on/off devices of the network, as they join & leave
+        ctrl = ZBCtrl(zbi, statePath=STATE_FILE or None, journalPath=JOURNAL_FILE or None)
+        # Calls authenticated, rate limited & shed beyond capacity by the interceptor, before reaching the handlers
+        server = newServer(ctrl, API_KEY)
 
+        # Serving the last known state at once, the radio being started in the background
         server.add_secure_port(SRV_PORT, creds)
-        logging.info('Starting server on %s' % SRV_PORT)
+        logging.info('Starting server on %s', SRV_PORT)
         await server.start()
+        await ctrl.start()
+        if METRICS_ADDR:
+            metricsHost, metricsPort = METRICS_ADDR.rsplit(':', 1)
+            metricsServer = await metrics.serve(metricsHost, int(metricsPort))
 
         async def shutdown():
             logging.info('Shutting down rpc server')
             await server.stop(2)
+            if METRICS_ADDR:
+                metricsServer.close()
             logging.info('Shutting down controller')
             await ctrl.stop()
+            loopMonitor.stop()
         global _cleanup
         _cleanup = shutdown()
 
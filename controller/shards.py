@@ -0,0 +1,123 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+shards.py
+Zigbee multi-coordinator interface
+Several Zigbee networks (one coordinator, adapter & channel each) behind the interface of a single ZBInterface
+'''
+
+import asyncio
+from collections import ChainMap
+import logging
+
+import zigpy.types # named.EUI64
+
+from zigbee import DeviceRegistry
+
+# Delay before retrying to start a shard whose start failed [seconds]
+SHARD_RETRY_DELAY = 10.
+
+
+class ZBShards():
+    '''Several ZBInterface (shards), each device being routed to the coordinator it is paired with.
+    Offers the interface of a ZBInterface: requests to devices of different shards run in parallel,
+    and a shard failing to start does not prevent the others from running (it being retried in the background)'''
+
+    def __init__(self, shards):
+        '''Constructor: shards list of ZBInterface, with distinct adapters & zigpy databases'''
+        self.shards = list(shards)
+        # Devices of all the networks, by capability: registry shared by the shards, each entry owned by the shard
+        # that last updated it (events of a device paired again with another coordinator being ignored from the previous one)
+        self.registry = DeviceRegistry()
+        for shard in self.shards:
+            shard.registry = self.registry
+        # Reports of all the networks: deviceId: last report time
+        self.lastReport = ChainMap(*[shard.lastReport for shard in self.shards])
+        # Routes of the devices: deviceId: shard (checked on use, devices may be paired again with another coordinator)
+        self._routes = {}
+        self._retryTasks = set()
+
+    @property
+    def reportMaxInterval(self):
+        return max(shard.reportMaxInterval for shard in self.shards)
+
+    async def start(self, updateCallback):
+        '''Start the shards in parallel, those failing being retried in the background.
+        Raises if none started'''
+        results = await asyncio.gather(*[shard.start(updateCallback) for shard in self.shards], return_exceptions=True)
+        failed = [shard for shard, result in zip(self.shards, results) if isinstance(result, Exception)]
+        for shard, result in zip(self.shards, results):
+            if isinstance(result, Exception):
+                logging.error('Unable to start shard %s, retrying in %fs: %r', shard.name, SHARD_RETRY_DELAY, result)
+        if len(failed) == len(self.shards):
+            raise RuntimeError('Unable to start any shard')
+        for shard in failed:
+            task = asyncio.create_task(self._retryStart(shard, updateCallback))
+            self._retryTasks.add(task)
+            task.add_done_callback(self._retryTasks.discard)
+
+    async def _retryStart(self, shard, updateCallback):
+        while True:
+            await asyncio.sleep(SHARD_RETRY_DELAY)
+            try:
+                await shard.start(updateCallback)
+                logging.info('Shard %s started', shard.name)
+                return
+            except Exception as e:
+                logging.error('Unable to start shard %s, retrying in %fs: %r', shard.name, SHARD_RETRY_DELAY, e)
+
+    async def stop(self):
+        '''Stop the shards'''
+        for task in self._retryTasks:
+            task.cancel()
+        await asyncio.gather(*[shard.stop() for shard in self.shards], return_exceptions=True)
+
+    def shardOf(self, deviceId):
+        '''Shard (ZBInterface) of the network a device is paired with, None if unknown'''
+        shard = self._routes.get(deviceId)
+        try:
+            ieee = zigpy.types.named.EUI64.convert(deviceId)
+        except Exception:
+            return None
+        if shard is not None and ieee in shard.za.devices:
+            return shard
+        for shard in self.shards:
+            if shard.za is not None and ieee in shard.za.devices:
+                self._routes[deviceId] = shard
+                return shard
+        self._routes.pop(deviceId, None)
+        return None
+
+    def _route(self, deviceId):
+        shard = self.shardOf(deviceId)
+        if shard is None:
+            raise ValueError('Unknown device ID')
+        return shard
+
+    async def getDeviceState(self, deviceId, timeout=None):
+        return await self._route(deviceId).getDeviceState(deviceId, timeout)
+
+    async def setDeviceState(self, deviceId, newState, timeout=None):
+        return await self._route(deviceId).setDeviceState(deviceId, newState, timeout)
+
+    async def getAllDeviceInfo(self, deviceId, timeout=None):
+        return await self._route(deviceId).getAllDeviceInfo(deviceId, timeout)
+
+    def hasGroup(self, deviceIds):
+        '''Whether the devices of each shard form a managed group of it'''
+        devicesByShard = {}
+        for deviceId in deviceIds:
+            devicesByShard.setdefault(self.shardOf(deviceId), []).append(deviceId)
+        return None not in devicesByShard and all(shard.hasGroup(devices) for shard, devices in devicesByShard.items())
+
+    async def setGroupState(self, deviceIds, newState, timeout=None):
+        '''Send a group command per shard (in parallel) to set the state of several devices'''
+        devicesByShard = {}
+        for deviceId in deviceIds:
+            devicesByShard.setdefault(self._route(deviceId), []).append(deviceId)
+        await asyncio.gather(*[shard.setGroupState(devices, newState, timeout) for shard, devices in devicesByShard.items()])
+
+    def health(self):
+        '''Health status of the shards, as a list of dicts (see ZBInterface.health)'''
+        return [health for shard in self.shards for health in shard.health()]
@@ -0,0 +1,322 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+simulator.py
+Simulated Zigbee network
+zigpy ControllerApplication over an in-process simulated radio & network of virtual on/off devices, for load testing without hardware
+'''
+
+import asyncio
+import logging
+import random
+
+import zigpy.application # ControllerApplication
+import zigpy.endpoint # Status
+import zigpy.exceptions # DeliveryError
+import zigpy.profiles # ZHA profile
+import zigpy.types # EUI64, NWK, AddrMode, AddrModeAddress, ZigbeePacket, MACStatus
+import zigpy.zcl.clusters.general # Basic, Groups, OnOff
+import zigpy.zcl.foundation # ZCLHeader, GeneralCommand, Status, TypeValue
+import zigpy.zdo.types # NodeDescriptor, ZDOCmd
+
+# Simulation parameters (defaults), overridable by the spec string, eg. 'devices=1000,latency=0.02,noack=0.01'
+SIM_DEFAULTS = {
+    'devices': 100,  # number of virtual on/off devices
+    'latency': 0.02, # mean round-trip latency of a request [seconds]
+    'loss': 0.,      # probability of a frame (request, response or report) being lost
+    'noack': 0.,     # probability of a unicast request not being acknowledged (MAC_NO_ACK)
+    'offline': 0.,   # fraction of the devices switched off (never acknowledging)
+    'toggle': 0.,    # mean period between spontaneous state changes of each device (eg. button pressed) [seconds], 0 = never
+    'seed': None,    # random seed, for reproducible runs
+    'shard': 0,      # index of the simulated network, when simulating several coordinators (distinct device IDs)
+}
+# Virtual devices: IEEE address prefix (followed by the shard & device index), first network address,
+# and description (as a TRADFRI control outlet)
+SIM_IEEE_PREFIX = 'ee:ee:ee:ee'
+SIM_NWK_BASE = 0x1000
+SIM_NODE_DESCRIPTOR = dict(byte1=1, byte2=64, mac_capability_flags=142, manufacturer_code=4476, maximum_buffer_size=82,
+                           maximum_incoming_transfer_size=82, server_mask=11264, maximum_outgoing_transfer_size=82, descriptor_capability_field=0)
+SIM_MANUFACTURER = 'zbCtrl'
+SIM_MODEL = 'Simulated outlet'
+
+ONOFF_ENDPOINT = 1
+ONOFF_CLUSTER = zigpy.zcl.clusters.general.OnOff.cluster_id
+GROUPS_CLUSTER = zigpy.zcl.clusters.general.Groups.cluster_id
+BASIC_CLUSTER = zigpy.zcl.clusters.general.Basic.cluster_id
+BOOL_TYPE = zigpy.zcl.foundation.DATA_TYPES.pytype_to_datatype_id(zigpy.types.Bool)
+STRING_TYPE = zigpy.zcl.foundation.DATA_TYPES.pytype_to_datatype_id(zigpy.types.CharacterString)
+
+
+def parseSpec(spec):
+    '''Parse a simulation spec string 'key=value,...' into parameters (see SIM_DEFAULTS)'''
+    params = dict(SIM_DEFAULTS)
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        key, _, value = item.partition('=')
+        key = key.strip()
+        if key not in SIM_DEFAULTS:
+            raise ValueError('Unknown simulation parameter %r, expecting %s' % (key, list(SIM_DEFAULTS)))
+        params[key] = int(value) if key in ['devices', 'seed', 'shard'] else float(value)
+    return params
+
+def deviceIds(count, shard=0):
+    '''IDs (EUI64 strings) of the count virtual devices (of the simulated network shard)'''
+    return ['%s:%02x:%02x:%02x:%02x' % ((SIM_IEEE_PREFIX,) + tuple(((shard << 24) + i).to_bytes(4, 'big'))) for i in range(count)]
+
+
+class VirtualDevice():
+    '''State of a simulated on/off device'''
+    __slots__ = ('device', 'state', 'offline', 'groups', 'reportInterval', 'reportTimer', 'toggleTimer')
+
+    def __init__(self, device, offline):
+        self.device = device
+        self.state = False
+        self.offline = offline
+        self.groups = set()
+        # Configured max reporting interval [seconds] (None until configured) and its timer
+        self.reportInterval = None
+        self.reportTimer = None
+        self.toggleTimer = None
+
+
+class SimulatedApplication(zigpy.application.ControllerApplication):
+    '''zigpy ControllerApplication whose radio is simulated: the zigpy devices, groups, requests & listeners are the real ones,
+    frames sent to the virtual devices being answered in-process (with latency, loss & MAC_NO_ACK),
+    and the devices sending attribute reports by themselves once reporting is configured'''
+
+    def __init__(self, config, devices=SIM_DEFAULTS['devices'], latency=SIM_DEFAULTS['latency'], loss=SIM_DEFAULTS['loss'],
+                 noack=SIM_DEFAULTS['noack'], offline=SIM_DEFAULTS['offline'], toggle=SIM_DEFAULTS['toggle'], seed=SIM_DEFAULTS['seed'], shard=SIM_DEFAULTS['shard']):
+        super().__init__(config)
+        self.simDevices = devices
+        self.shard = shard
+        self.latency = latency
+        self.loss = loss
+        self.noack = noack
+        self.offline = offline
+        self.toggle = toggle
+        self._random = random.Random(seed)
+        # Virtual devices by network address
+        self._virtual = {}
+        self._tsn = 0
+
+    @classmethod
+    def factory(cls, spec=''):
+        '''Application factory for ZBInterface (async function(zpConfig) returning the started application), from a spec string'''
+        params = parseSpec(spec)
+        async def newApplication(zpConfig):
+            app = cls(zpConfig, **params)
+            await app.startSimulation()
+            return app
+        return newApplication
+
+    async def startSimulation(self):
+        '''Create the virtual devices, as initialized zigpy devices'''
+        self.state.node_info.nwk = zigpy.types.NWK(0x0000)
+        self.state.node_info.ieee = zigpy.types.EUI64.convert('ee:ee:ee:ee:ff:ff:ff:ff')
+        for i, deviceId in enumerate(deviceIds(self.simDevices, self.shard)):
+            device = self.add_device(zigpy.types.EUI64.convert(deviceId), SIM_NWK_BASE + i)
+            device.node_desc = zigpy.zdo.types.NodeDescriptor(**SIM_NODE_DESCRIPTOR)
+            endpoint = device.add_endpoint(ONOFF_ENDPOINT)
+            endpoint.status = zigpy.endpoint.Status.ZDO_INIT
+            endpoint.profile_id = zigpy.profiles.zha.PROFILE_ID
+            endpoint.device_type = zigpy.profiles.zha.DeviceType.ON_OFF_PLUG_IN_UNIT
+            for clusterId in [BASIC_CLUSTER, GROUPS_CLUSTER, ONOFF_CLUSTER]:
+                endpoint.add_input_cluster(clusterId)
+            device.manufacturer = SIM_MANUFACTURER
+            device.model = SIM_MODEL
+            virtual = self._virtual[device.nwk] = VirtualDevice(device, self._random.random() < self.offline)
+            if self.toggle and not virtual.offline:
+                self._scheduleToggle(virtual)
+        logging.info('Simulating %d devices (latency %fs, loss %f, no ACK %f, offline %f)', self.simDevices, self.latency, self.loss, self.noack, self.offline)
+
+    async def shutdown(self):
+        for virtual in self._virtual.values():
+            for timer in [virtual.reportTimer, virtual.toggleTimer]:
+                if timer is not None:
+                    timer.cancel()
+        await super().shutdown()
+
+    # Simulated radio
+
+    def _delay(self):
+        '''One-way transmission delay [seconds]'''
+        return self._random.uniform(0.5, 1.5) * self.latency / 2
+
+    def _lost(self):
+        return self.loss and self._random.random() < self.loss
+
+    async def send_packet(self, packet):
+        '''Transmit a packet from the coordinator: to a group (no ACK), or to a device (raising DeliveryError if not acknowledged)'''
+        loop = asyncio.get_running_loop()
+        data = packet.data.serialize()
+        if packet.dst.addr_mode == zigpy.types.AddrMode.Group:
+            for virtual in self._virtual.values():
+                if packet.dst.address in virtual.groups and not virtual.offline and not self._lost():
+                    loop.call_later(self._delay(), self._receive, virtual, packet, data)
+            return
+        virtual = self._virtual.get(packet.dst.address)
+        await asyncio.sleep(self._delay())
+        if virtual is None or virtual.offline or (self.noack and self._random.random() < self.noack):
+            raise zigpy.exceptions.DeliveryError('Simulated delivery failure', status=zigpy.types.MACStatus.MAC_NO_ACK)
+        if not self._lost():
+            self._receive(virtual, packet, data)
+
+    def _send(self, virtual, profile, cluster, srcEp, frame):
+        '''Send a frame from a virtual device to the coordinator, through the zigpy application'''
+        if self._lost():
+            return
+        self.packet_received(zigpy.types.ZigbeePacket(
+            src=zigpy.types.AddrModeAddress(addr_mode=zigpy.types.AddrMode.NWK, address=virtual.device.nwk),
+            src_ep=srcEp,
+            dst=zigpy.types.AddrModeAddress(addr_mode=zigpy.types.AddrMode.NWK, address=self.state.node_info.nwk),
+            dst_ep=srcEp and self.get_endpoint_id(cluster),
+            profile_id=profile,
+            cluster_id=int(cluster),
+            data=zigpy.types.SerializableBytes(frame),
+            lqi=255,
+            rssi=-40,
+        ))
+
+    def _reply(self, virtual, profile, cluster, srcEp, frame):
+        '''Send a response frame after the transmission delay'''
+        asyncio.get_running_loop().call_later(self._delay(), self._send, virtual, profile, cluster, srcEp, frame)
+
+    def _nextTsn(self):
+        self._tsn = (self._tsn + 1) % 256
+        return self._tsn
+
+    # Virtual devices
+
+    def _receive(self, virtual, packet, data):
+        '''Handle a frame received by a virtual device'''
+        if packet.profile_id == 0:
+            # ZDO: only binding
+            if packet.cluster_id == zigpy.zdo.types.ZDOCmd.Bind_req:
+                self._reply(virtual, 0, zigpy.zdo.types.ZDOCmd.Bind_rsp, 0, bytes([data[0], zigpy.zdo.types.Status.SUCCESS]))
+            return
+        # Group frames have no destination endpoint: handled by the endpoint member of the group
+        endpoint = virtual.device.endpoints.get(ONOFF_ENDPOINT if packet.dst.addr_mode == zigpy.types.AddrMode.Group else packet.dst_ep)
+        if endpoint is None or packet.cluster_id not in endpoint.in_clusters:
+            return
+        cluster = endpoint.in_clusters[packet.cluster_id]
+        try:
+            hdr, args = cluster.deserialize(data)
+        except Exception as e:
+            logging.warning('Simulated device %s unable to parse frame %r: %r', virtual.device.ieee, data, e)
+            return
+        foundation = zigpy.zcl.foundation
+        if hdr.frame_control.is_general:
+            if hdr.command_id == foundation.GeneralCommand.Read_Attributes:
+                records = [self._readAttribute(virtual, cluster, attrid) for attrid in args.attribute_ids]
+                self._replyZcl(virtual, cluster, foundation.ZCLHeader.general(hdr.tsn, foundation.GeneralCommand.Read_Attributes_rsp, direction=foundation.Direction.Client_to_Server),
+                               foundation.GENERAL_COMMANDS[foundation.GeneralCommand.Read_Attributes_rsp].schema(status_records=records))
+            elif hdr.command_id == foundation.GeneralCommand.Configure_Reporting:
+                for config in args.config_records:
+                    if cluster.cluster_id == ONOFF_CLUSTER and config.attrid == 0:
+                        virtual.reportInterval = config.max_interval
+                        self._scheduleReport(virtual)
+                self._replyZcl(virtual, cluster, foundation.ZCLHeader.general(hdr.tsn, foundation.GeneralCommand.Configure_Reporting_rsp, direction=foundation.Direction.Client_to_Server),
+                               foundation.GENERAL_COMMANDS[foundation.GeneralCommand.Configure_Reporting_rsp].schema(status_records=[foundation.ConfigureReportingResponseRecord(status=foundation.Status.SUCCESS)]))
+            else:
+                self._replyDefault(virtual, cluster, hdr, foundation.Status.UNSUP_GENERAL_COMMAND)
+            return
+        if cluster.cluster_id == ONOFF_CLUSTER and hdr.command_id in [0x00, 0x01, 0x02]:
+            self._setState(virtual, not virtual.state if hdr.command_id == 0x02 else bool(hdr.command_id))
+            self._replyDefault(virtual, cluster, hdr, foundation.Status.SUCCESS)
+        elif cluster.cluster_id == GROUPS_CLUSTER and hdr.command_id in [0x00, 0x03]:
+            if hdr.command_id == 0x00:
+                virtual.groups.add(args.group_id)
+            else:
+                virtual.groups.discard(args.group_id)
+            self._replyZcl(virtual, cluster, foundation.ZCLHeader.cluster(hdr.tsn, hdr.command_id, direction=foundation.Direction.Client_to_Server),
+                           cluster.client_commands[hdr.command_id].schema(status=foundation.Status.SUCCESS, group_id=args.group_id))
+        else:
+            self._replyDefault(virtual, cluster, hdr, foundation.Status.UNSUP_CLUSTER_COMMAND)
+
+    def _replyZcl(self, virtual, cluster, hdr, payload):
+        self._reply(virtual, zigpy.profiles.zha.PROFILE_ID, cluster.cluster_id, cluster.endpoint.endpoint_id, hdr.serialize() + payload.serialize())
+
+    def _replyDefault(self, virtual, cluster, hdr, status):
+        '''Default response, unless disabled by the request (eg. group commands)'''
+        if hdr.frame_control.disable_default_response and status == zigpy.zcl.foundation.Status.SUCCESS:
+            return
+        foundation = zigpy.zcl.foundation
+        self._replyZcl(virtual, cluster, foundation.ZCLHeader.general(hdr.tsn, foundation.GeneralCommand.Default_Response, direction=foundation.Direction.Client_to_Server),
+                       foundation.GENERAL_COMMANDS[foundation.GeneralCommand.Default_Response].schema(command_id=hdr.command_id, status=status))
+
+    def _readAttribute(self, virtual, cluster, attrid):
+        foundation = zigpy.zcl.foundation
+        if cluster.cluster_id == ONOFF_CLUSTER and attrid == 0:
+            value = foundation.TypeValue(type=BOOL_TYPE, value=zigpy.types.Bool(virtual.state))
+        elif cluster.cluster_id == BASIC_CLUSTER and attrid in [4, 5]:
+            value = foundation.TypeValue(type=STRING_TYPE, value=zigpy.types.CharacterString(SIM_MANUFACTURER if attrid == 4 else SIM_MODEL))
+        else:
+            return foundation.ReadAttributeRecord(attrid=attrid, status=foundation.Status.UNSUPPORTED_ATTRIBUTE)
+        return foundation.ReadAttributeRecord(attrid=attrid, status=foundation.Status.SUCCESS, value=value)
+
+    def _setState(self, virtual, state):
+        '''Change the state of a virtual device, reporting it if configured'''
+        changed = virtual.state != state
+        virtual.state = state
+        if changed and virtual.reportInterval is not None:
+            self._sendReport(virtual)
+
+    def _sendReport(self, virtual):
+        '''Send a Report_Attributes of the on/off state, and reschedule the periodic one'''
+        foundation = zigpy.zcl.foundation
+        hdr = foundation.ZCLHeader.general(self._nextTsn(), foundation.GeneralCommand.Report_Attributes, direction=foundation.Direction.Client_to_Server)
+        hdr.frame_control = hdr.frame_control.replace(disable_default_response=False)
+        report = foundation.Attribute(attrid=0, value=foundation.TypeValue(type=BOOL_TYPE, value=zigpy.types.Bool(virtual.state)))
+        self._send(virtual, zigpy.profiles.zha.PROFILE_ID, ONOFF_CLUSTER, ONOFF_ENDPOINT,
+                   hdr.serialize() + foundation.GENERAL_COMMANDS[foundation.GeneralCommand.Report_Attributes].schema(attribute_reports=[report]).serialize())
+        self._scheduleReport(virtual)
+
+    def _scheduleReport(self, virtual):
+        if virtual.reportTimer is not None:
+            virtual.reportTimer.cancel()
+        virtual.reportTimer = None
+        if virtual.reportInterval and not virtual.offline:
+            virtual.reportTimer = asyncio.get_running_loop().call_later(virtual.reportInterval * self._random.uniform(0.9, 1.), self._sendReport, virtual)
+
+    def _scheduleToggle(self, virtual):
+        def toggle():
+            self._setState(virtual, not virtual.state)
+            self._scheduleToggle(virtual)
+        virtual.toggleTimer = asyncio.get_running_loop().call_later(self._random.expovariate(1 / self.toggle), toggle)
+
+    # Radio management: nothing to do
+
+    async def connect(self):
+        pass
+
+    async def disconnect(self):
+        pass
+
+    async def start_network(self):
+        pass
+
+    async def force_remove(self, dev):
+        pass
+
+    async def add_endpoint(self, descriptor):
+        pass
+
+    async def permit_ncp(self, time_s=60):
+        pass
+
+    async def permit_with_key(self, node, code, time_s=60):
+        pass
+
+    async def permit(self, time_s=60, node=None):
+        logging.info('Simulated network: no device to pair')
+
+    async def write_network_info(self, *, network_info, node_info):
+        pass
+
+    async def load_network_info(self, *, load_devices=False):
+        pass
+
+    async def reset_network_info(self):
+        pass
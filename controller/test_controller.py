@@ -0,0 +1,78 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+test_controller.py
+Tests of the controller state versioning (python -m unittest test_controller)
+'''
+
+from types import SimpleNamespace
+import unittest
+
+import controller
+from controller import ZBCtrl
+from zigbee import State, CAPABILITY_ONOFF
+
+
+class FakeRegistry():
+    '''Registry of on/off devices'''
+
+    def __init__(self):
+        self.devices = set()
+
+    def withCapability(self, capability):
+        return frozenset(self.devices) if capability == CAPABILITY_ONOFF else frozenset()
+
+
+class FakeZbi():
+    '''Zigbee interface only offering the registry'''
+
+    def __init__(self):
+        self.registry = FakeRegistry()
+
+    def shardOf(self, deviceId):
+        return self
+
+
+def deviceId(i):
+    return '00:00:00:00:%02x:%02x:%02x:%02x' % tuple(i.to_bytes(4, 'big'))
+
+
+class ChangeLogTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.zbi = FakeZbi()
+        self.ctrl = ZBCtrl(self.zbi)
+        self.onoff = SimpleNamespace(capabilities=frozenset([CAPABILITY_ONOFF]))
+
+    def addDevices(self, devices):
+        '''Bulk registry update: the devices joining at once, the controller being notified of the last one'''
+        self.zbi.registry.devices.update(devices)
+        self.ctrl._registryCallback(devices[-1], self.onoff)
+
+    async def testDeltaOfAddedDevices(self):
+        v0 = self.ctrl.version
+        devices = [deviceId(i) for i in range(10)]
+        self.addDevices(devices)
+        snapshot, changes = self.ctrl.getStateSince(v0)
+        self.assertEqual(changes, {device: State.NA for device in devices})
+        self.assertEqual(self.ctrl.getStateSince(snapshot.version), (snapshot, {}))
+
+    async def testBulkUpdateOverflowingChangeLog(self):
+        v0 = self.ctrl.version
+        devices = [deviceId(i) for i in range(2 * controller.CHANGELOG_SIZE - 48)]
+        self.addDevices(devices)
+        snapshot, changes = self.ctrl.getStateSince(v0)
+        # Changes no longer all in the log: full state
+        self.assertIsNone(changes)
+        self.assertEqual(set(snapshot.devices), set(devices))
+        # Changes still in the log: the last CHANGELOG_SIZE added devices
+        kept = sorted(devices)[-controller.CHANGELOG_SIZE:]
+        _, changes = self.ctrl.getStateSince(snapshot.version - controller.CHANGELOG_SIZE)
+        self.assertEqual(set(changes), set(kept))
+        _, changes = self.ctrl.getStateSince(snapshot.version - controller.CHANGELOG_SIZE - 1)
+        self.assertIsNone(changes)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -13,7 +13,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0czbCtrl.proto\x12\x06zbCtrl\"\x1e\n\x0fGetStateRequest\x12\x0b\n\x03key\x18\x01 \x01(\t\"!\n\x10GetStateResponse\x12\r\n\x05state\x18\x01 \x01(\t\"-\n\x0fSetStateRequest\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05state\x18\x02 \x01(\t\"#\n\x10SetStateResponse\x12\x0f\n\x07success\x18\x01 \x01(\x08\x32\x8a\x01\n\x06ZBCtrl\x12?\n\x08GetState\x12\x17.zbCtrl.GetStateRequest\x1a\x18.zbCtrl.GetStateResponse\"\x00\x12?\n\x08SetState\x12\x17.zbCtrl.SetStateRequest\x1a\x18.zbCtrl.SetStateResponse\"\x00\x42\x1dZ\x1bgit.ekin.gr/zbGateway/protob\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0czbCtrl.proto\x12\x06zbCtrl\"+\n\x0c\x44\x65viceStates\x12\x0b\n\x03ids\x18\x01 \x03(\t\x12\x0e\n\x06states\x18\x02 \x03(\x11\"q\n\x0fGetStateRequest\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\x1a\n\rsince_version\x18\x02 \x01(\x04H\x00\x88\x01\x01\x12#\n\x06\x66ormat\x18\x03 \x01(\x0e\x32\x13.zbCtrl.StateFormatB\x10\n\x0e_since_version\"\x8d\x01\n\x10GetStateResponse\x12\r\n\x05state\x18\x01 \x01(\t\x12\x0f\n\x07version\x18\x02 \x01(\x04\x12\x14\n\x0cnot_modified\x18\x03 \x01(\x08\x12\r\n\x05\x64\x65lta\x18\x04 \x01(\x08\x12%\n\x07\x64\x65vices\x18\x05 \x01(\x0b\x32\x14.zbCtrl.DeviceStates\x12\r\n\x05stale\x18\x06 \x03(\t\"T\n\x0fSetStateRequest\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05state\x18\x02 \x01(\t\x12%\n\x07\x64\x65vices\x18\x03 \x01(\x0b\x32\x14.zbCtrl.DeviceStates\"Z\n\x10SetStateResponse\x12\x0f\n\x07success\x18\x01 \x01(\x08\x12%\n\x07results\x18\x02 \x01(\x0b\x32\x14.zbCtrl.DeviceStates\x12\x0e\n\x06\x66\x61iled\x18\x03 \x03(\t\"E\n\x11WatchStateRequest\x12\x0b\n\x03key\x18\x01 \x01(\t\x12#\n\x06\x66ormat\x18\x02 \x01(\x0e\x32\x13.zbCtrl.StateFormat\"k\n\x12WatchStateResponse\x12\r\n\x05state\x18\x01 \x01(\t\x12\x10\n\x08snapshot\x18\x02 \x01(\x08\x12%\n\x07\x64\x65vices\x18\x03 \x01(\x0b\x32\x14.zbCtrl.DeviceStates\x12\r\n\x05stale\x18\x04 \x03(\t\"5\n\x12ListDevicesRequest\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\x12\n\ncapability\x18\x02 \x01(\t\"a\n\x0b\x44\x65viceEntry\x12\n\n\x02id\x18\x01 \x01(\t\x12\x0b\n\x03nwk\x18\x02 \x01(\r\x12\x14\n\x0cmanufacturer\x18\x03 \x01(\t\x12\r\n\x05model\x18\x04 \x01(\t\x12\x14\n\x0c\x63\x61pabilities\x18\x05 \x03(\t\";\n\x13ListDevicesResponse\x12$\n\x07\x64\x65vices\x18\x01 \x03(\x0b\x32\x13.zbCtrl.DeviceEntry\"/\n\x14GetDeviceInfoRequest\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\n\n\x02id\x18\x02 \x01(\t\"\xf7\x01\n\x15GetDeviceInfoResponse\x12\x41\n\nattributes\x18\x01 \x03(\x0b\x32-.zbCtrl.GetDeviceInfoResponse.AttributesEntry\x12\x39\n\x06\x66\x61iled\x18\x02 \x03(\x0b\x32).zbCtrl.GetDeviceInfoResponse.FailedEntry\x1a\x31\n\x0f\x41ttributesEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\t:\x02\x38\x01\x1a-\n\x0b\x46\x61iledEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\t:\x02\x38\x01\"\x1f\n\x10GetHealthRequest\x12\x0b\n\x03key\x18\x01 \x01(\t\"r\n\x0bShardHealth\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\x0f\n\x07\x63hannel\x18\x02 \x01(\r\x12\x0e\n\x06status\x18\x03 \x01(\t\x12\x12\n\nlast_error\x18\x04 \x01(\t\x12\x0f\n\x07\x64\x65vices\x18\x05 \x01(\r\x12\x0f\n\x07offline\x18\x06 \x01(\r\"8\n\x11GetHealthResponse\x12#\n\x06shards\x18\x01 \x03(\x0b\x32\x13.zbCtrl.ShardHealth\"t\n\x11GetHistoryRequest\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\x0e\n\x06\x64\x65vice\x18\x02 \x01(\t\x12\r\n\x05since\x18\x03 \x01(\x04\x12\r\n\x05limit\x18\x04 \x01(\r\x12\x16\n\tafter_seq\x18\x05 \x01(\x04H\x00\x88\x01\x01\x42\x0c\n\n_after_seq\"s\n\x0bStateChange\x12\x11\n\ttimestamp\x18\x01 \x01(\x04\x12\x0e\n\x06\x64\x65vice\x18\x02 \x01(\t\x12\x11\n\told_state\x18\x03 \x01(\x11\x12\x11\n\tnew_state\x18\x04 \x01(\x11\x12\x0e\n\x06source\x18\x05 \x01(\t\x12\x0b\n\x03seq\x18\x06 \x01(\x04\"H\n\x12GetHistoryResponse\x12$\n\x07\x63hanges\x18\x01 \x03(\x0b\x32\x13.zbCtrl.StateChange\x12\x0c\n\x04more\x18\x02 \x01(\x08\"\x81\x01\n\x0e\x43ontrolRequest\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\n\n\x02id\x18\x02 \x01(\t\x12%\n\x07\x64\x65vices\x18\x03 \x01(\x0b\x32\x14.zbCtrl.DeviceStates\x12\x14\n\x07timeout\x18\x04 \x01(\x02H\x00\x88\x01\x01\x12\r\n\x05watch\x18\x05 \x01(\x08\x42\n\n\x08_timeout\"s\n\rCommandResult\x12\n\n\x02id\x18\x01 \x01(\t\x12%\n\x07results\x18\x02 \x01(\x0b\x32\x14.zbCtrl.DeviceStates\x12\x0e\n\x06\x66\x61iled\x18\x03 \x03(\t\x12\x10\n\x08rejected\x18\x04 \x03(\t\x12\r\n\x05\x65rror\x18\x05 \x01(\t\"r\n\x0f\x43ontrolResponse\x12\'\n\x06result\x18\x01 \x01(\x0b\x32\x15.zbCtrl.CommandResultH\x00\x12+\n\x05\x65vent\x18\x02 \x01(\x0b\x32\x1a.zbCtrl.WatchStateResponseH\x00\x42\t\n\x07message*\"\n\x0bStateFormat\x12\x08\n\x04JSON\x10\x00\x12\t\n\x05PROTO\x10\x01\x32\xba\x04\n\x06ZBCtrl\x12?\n\x08GetState\x12\x17.zbCtrl.GetStateRequest\x1a\x18.zbCtrl.GetStateResponse\"\x00\x12?\n\x08SetState\x12\x17.zbCtrl.SetStateRequest\x1a\x18.zbCtrl.SetStateResponse\"\x00\x12G\n\nWatchState\x12\x19.zbCtrl.WatchStateRequest\x1a\x1a.zbCtrl.WatchStateResponse\"\x00\x30\x01\x12H\n\x0bListDevices\x12\x1a.zbCtrl.ListDevicesRequest\x1a\x1b.zbCtrl.ListDevicesResponse\"\x00\x12N\n\rGetDeviceInfo\x12\x1c.zbCtrl.GetDeviceInfoRequest\x1a\x1d.zbCtrl.GetDeviceInfoResponse\"\x00\x12\x42\n\tGetHealth\x12\x18.zbCtrl.GetHealthRequest\x1a\x19.zbCtrl.GetHealthResponse\"\x00\x12\x45\n\nGetHistory\x12\x19.zbCtrl.GetHistoryRequest\x1a\x1a.zbCtrl.GetHistoryResponse\"\x00\x12@\n\x07\x43ontrol\x12\x16.zbCtrl.ControlRequest\x1a\x17.zbCtrl.ControlResponse\"\x00(\x01\x30\x01\x42\x1dZ\x1bgit.ekin.gr/zbGateway/protob\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -22,14 +22,58 @@ if _descriptor._USE_C_DESCRIPTORS == False:
 
   DESCRIPTOR._options = None
   DESCRIPTOR._serialized_options = b'Z\033git.ekin.gr/zbGateway/proto'
-  _globals['_GETSTATEREQUEST']._serialized_start=24
-  _globals['_GETSTATEREQUEST']._serialized_end=54
-  _globals['_GETSTATERESPONSE']._serialized_start=56
-  _globals['_GETSTATERESPONSE']._serialized_end=89
-  _globals['_SETSTATEREQUEST']._serialized_start=91
-  _globals['_SETSTATEREQUEST']._serialized_end=136
-  _globals['_SETSTATERESPONSE']._serialized_start=138
-  _globals['_SETSTATERESPONSE']._serialized_end=173
-  _globals['_ZBCTRL']._serialized_start=176
-  _globals['_ZBCTRL']._serialized_end=314
+  _GETDEVICEINFORESPONSE_ATTRIBUTESENTRY._options = None
+  _GETDEVICEINFORESPONSE_ATTRIBUTESENTRY._serialized_options = b'8\001'
+  _GETDEVICEINFORESPONSE_FAILEDENTRY._options = None
+  _GETDEVICEINFORESPONSE_FAILEDENTRY._serialized_options = b'8\001'
+  _globals['_STATEFORMAT']._serialized_start=2081
+  _globals['_STATEFORMAT']._serialized_end=2115
+  _globals['_DEVICESTATES']._serialized_start=24
+  _globals['_DEVICESTATES']._serialized_end=67
+  _globals['_GETSTATEREQUEST']._serialized_start=69
+  _globals['_GETSTATEREQUEST']._serialized_end=182
+  _globals['_GETSTATERESPONSE']._serialized_start=185
+  _globals['_GETSTATERESPONSE']._serialized_end=326
+  _globals['_SETSTATEREQUEST']._serialized_start=328
+  _globals['_SETSTATEREQUEST']._serialized_end=412
+  _globals['_SETSTATERESPONSE']._serialized_start=414
+  _globals['_SETSTATERESPONSE']._serialized_end=504
+  _globals['_WATCHSTATEREQUEST']._serialized_start=506
+  _globals['_WATCHSTATEREQUEST']._serialized_end=575
+  _globals['_WATCHSTATERESPONSE']._serialized_start=577
+  _globals['_WATCHSTATERESPONSE']._serialized_end=684
+  _globals['_LISTDEVICESREQUEST']._serialized_start=686
+  _globals['_LISTDEVICESREQUEST']._serialized_end=739
+  _globals['_DEVICEENTRY']._serialized_start=741
+  _globals['_DEVICEENTRY']._serialized_end=838
+  _globals['_LISTDEVICESRESPONSE']._serialized_start=840
+  _globals['_LISTDEVICESRESPONSE']._serialized_end=899
+  _globals['_GETDEVICEINFOREQUEST']._serialized_start=901
+  _globals['_GETDEVICEINFOREQUEST']._serialized_end=948
+  _globals['_GETDEVICEINFORESPONSE']._serialized_start=951
+  _globals['_GETDEVICEINFORESPONSE']._serialized_end=1198
+  _globals['_GETDEVICEINFORESPONSE_ATTRIBUTESENTRY']._serialized_start=1102
+  _globals['_GETDEVICEINFORESPONSE_ATTRIBUTESENTRY']._serialized_end=1151
+  _globals['_GETDEVICEINFORESPONSE_FAILEDENTRY']._serialized_start=1153
+  _globals['_GETDEVICEINFORESPONSE_FAILEDENTRY']._serialized_end=1198
+  _globals['_GETHEALTHREQUEST']._serialized_start=1200
+  _globals['_GETHEALTHREQUEST']._serialized_end=1231
+  _globals['_SHARDHEALTH']._serialized_start=1233
+  _globals['_SHARDHEALTH']._serialized_end=1347
+  _globals['_GETHEALTHRESPONSE']._serialized_start=1349
+  _globals['_GETHEALTHRESPONSE']._serialized_end=1405
+  _globals['_GETHISTORYREQUEST']._serialized_start=1407
+  _globals['_GETHISTORYREQUEST']._serialized_end=1523
+  _globals['_STATECHANGE']._serialized_start=1525
+  _globals['_STATECHANGE']._serialized_end=1640
+  _globals['_GETHISTORYRESPONSE']._serialized_start=1642
+  _globals['_GETHISTORYRESPONSE']._serialized_end=1714
+  _globals['_CONTROLREQUEST']._serialized_start=1717
+  _globals['_CONTROLREQUEST']._serialized_end=1846
+  _globals['_COMMANDRESULT']._serialized_start=1848
+  _globals['_COMMANDRESULT']._serialized_end=1963
+  _globals['_CONTROLRESPONSE']._serialized_start=1965
+  _globals['_CONTROLRESPONSE']._serialized_end=2079
+  _globals['_ZBCTRL']._serialized_start=2118
+  _globals['_ZBCTRL']._serialized_end=2688
 # @@protoc_insertion_point(module_scope)
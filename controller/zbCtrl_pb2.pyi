@@ -1,31 +1,248 @@
+from google.protobuf.internal import containers as _containers
+from google.protobuf.internal import enum_type_wrapper as _enum_type_wrapper
 from google.protobuf import descriptor as _descriptor
 from google.protobuf import message as _message
-from typing import ClassVar as _ClassVar, Optional as _Optional
+from typing import ClassVar as _ClassVar, Iterable as _Iterable, Mapping as _Mapping, Optional as _Optional, Union as _Union
 
 DESCRIPTOR: _descriptor.FileDescriptor
 
+class StateFormat(int, metaclass=_enum_type_wrapper.EnumTypeWrapper):
+    __slots__ = []
+    JSON: _ClassVar[StateFormat]
+    PROTO: _ClassVar[StateFormat]
+JSON: StateFormat
+PROTO: StateFormat
+
+class DeviceStates(_message.Message):
+    __slots__ = ["ids", "states"]
+    IDS_FIELD_NUMBER: _ClassVar[int]
+    STATES_FIELD_NUMBER: _ClassVar[int]
+    ids: _containers.RepeatedScalarFieldContainer[str]
+    states: _containers.RepeatedScalarFieldContainer[int]
+    def __init__(self, ids: _Optional[_Iterable[str]] = ..., states: _Optional[_Iterable[int]] = ...) -> None: ...
+
 class GetStateRequest(_message.Message):
-    __slots__ = ["key"]
+    __slots__ = ["key", "since_version", "format"]
     KEY_FIELD_NUMBER: _ClassVar[int]
+    SINCE_VERSION_FIELD_NUMBER: _ClassVar[int]
+    FORMAT_FIELD_NUMBER: _ClassVar[int]
     key: str
-    def __init__(self, key: _Optional[str] = ...) -> None: ...
+    since_version: int
+    format: StateFormat
+    def __init__(self, key: _Optional[str] = ..., since_version: _Optional[int] = ..., format: _Optional[_Union[StateFormat, str]] = ...) -> None: ...
 
 class GetStateResponse(_message.Message):
-    __slots__ = ["state"]
+    __slots__ = ["state", "version", "not_modified", "delta", "devices", "stale"]
     STATE_FIELD_NUMBER: _ClassVar[int]
+    VERSION_FIELD_NUMBER: _ClassVar[int]
+    NOT_MODIFIED_FIELD_NUMBER: _ClassVar[int]
+    DELTA_FIELD_NUMBER: _ClassVar[int]
+    DEVICES_FIELD_NUMBER: _ClassVar[int]
+    STALE_FIELD_NUMBER: _ClassVar[int]
     state: str
-    def __init__(self, state: _Optional[str] = ...) -> None: ...
+    version: int
+    not_modified: bool
+    delta: bool
+    devices: DeviceStates
+    stale: _containers.RepeatedScalarFieldContainer[str]
+    def __init__(self, state: _Optional[str] = ..., version: _Optional[int] = ..., not_modified: bool = ..., delta: bool = ..., devices: _Optional[_Union[DeviceStates, _Mapping]] = ..., stale: _Optional[_Iterable[str]] = ...) -> None: ...
 
 class SetStateRequest(_message.Message):
-    __slots__ = ["key", "state"]
+    __slots__ = ["key", "state", "devices"]
     KEY_FIELD_NUMBER: _ClassVar[int]
     STATE_FIELD_NUMBER: _ClassVar[int]
+    DEVICES_FIELD_NUMBER: _ClassVar[int]
     key: str
     state: str
-    def __init__(self, key: _Optional[str] = ..., state: _Optional[str] = ...) -> None: ...
+    devices: DeviceStates
+    def __init__(self, key: _Optional[str] = ..., state: _Optional[str] = ..., devices: _Optional[_Union[DeviceStates, _Mapping]] = ...) -> None: ...
 
 class SetStateResponse(_message.Message):
-    __slots__ = ["success"]
+    __slots__ = ["success", "results", "failed"]
     SUCCESS_FIELD_NUMBER: _ClassVar[int]
+    RESULTS_FIELD_NUMBER: _ClassVar[int]
+    FAILED_FIELD_NUMBER: _ClassVar[int]
     success: bool
-    def __init__(self, success: bool = ...) -> None: ...
+    results: DeviceStates
+    failed: _containers.RepeatedScalarFieldContainer[str]
+    def __init__(self, success: bool = ..., results: _Optional[_Union[DeviceStates, _Mapping]] = ..., failed: _Optional[_Iterable[str]] = ...) -> None: ...
+
+class WatchStateRequest(_message.Message):
+    __slots__ = ["key", "format"]
+    KEY_FIELD_NUMBER: _ClassVar[int]
+    FORMAT_FIELD_NUMBER: _ClassVar[int]
+    key: str
+    format: StateFormat
+    def __init__(self, key: _Optional[str] = ..., format: _Optional[_Union[StateFormat, str]] = ...) -> None: ...
+
+class WatchStateResponse(_message.Message):
+    __slots__ = ["state", "snapshot", "devices", "stale"]
+    STATE_FIELD_NUMBER: _ClassVar[int]
+    SNAPSHOT_FIELD_NUMBER: _ClassVar[int]
+    DEVICES_FIELD_NUMBER: _ClassVar[int]
+    STALE_FIELD_NUMBER: _ClassVar[int]
+    state: str
+    snapshot: bool
+    devices: DeviceStates
+    stale: _containers.RepeatedScalarFieldContainer[str]
+    def __init__(self, state: _Optional[str] = ..., snapshot: bool = ..., devices: _Optional[_Union[DeviceStates, _Mapping]] = ..., stale: _Optional[_Iterable[str]] = ...) -> None: ...
+
+class ListDevicesRequest(_message.Message):
+    __slots__ = ["key", "capability"]
+    KEY_FIELD_NUMBER: _ClassVar[int]
+    CAPABILITY_FIELD_NUMBER: _ClassVar[int]
+    key: str
+    capability: str
+    def __init__(self, key: _Optional[str] = ..., capability: _Optional[str] = ...) -> None: ...
+
+class DeviceEntry(_message.Message):
+    __slots__ = ["id", "nwk", "manufacturer", "model", "capabilities"]
+    ID_FIELD_NUMBER: _ClassVar[int]
+    NWK_FIELD_NUMBER: _ClassVar[int]
+    MANUFACTURER_FIELD_NUMBER: _ClassVar[int]
+    MODEL_FIELD_NUMBER: _ClassVar[int]
+    CAPABILITIES_FIELD_NUMBER: _ClassVar[int]
+    id: str
+    nwk: int
+    manufacturer: str
+    model: str
+    capabilities: _containers.RepeatedScalarFieldContainer[str]
+    def __init__(self, id: _Optional[str] = ..., nwk: _Optional[int] = ..., manufacturer: _Optional[str] = ..., model: _Optional[str] = ..., capabilities: _Optional[_Iterable[str]] = ...) -> None: ...
+
+class ListDevicesResponse(_message.Message):
+    __slots__ = ["devices"]
+    DEVICES_FIELD_NUMBER: _ClassVar[int]
+    devices: _containers.RepeatedCompositeFieldContainer[DeviceEntry]
+    def __init__(self, devices: _Optional[_Iterable[_Union[DeviceEntry, _Mapping]]] = ...) -> None: ...
+
+class GetDeviceInfoRequest(_message.Message):
+    __slots__ = ["key", "id"]
+    KEY_FIELD_NUMBER: _ClassVar[int]
+    ID_FIELD_NUMBER: _ClassVar[int]
+    key: str
+    id: str
+    def __init__(self, key: _Optional[str] = ..., id: _Optional[str] = ...) -> None: ...
+
+class GetDeviceInfoResponse(_message.Message):
+    __slots__ = ["attributes", "failed"]
+    class AttributesEntry(_message.Message):
+        __slots__ = ["key", "value"]
+        KEY_FIELD_NUMBER: _ClassVar[int]
+        VALUE_FIELD_NUMBER: _ClassVar[int]
+        key: str
+        value: str
+        def __init__(self, key: _Optional[str] = ..., value: _Optional[str] = ...) -> None: ...
+    class FailedEntry(_message.Message):
+        __slots__ = ["key", "value"]
+        KEY_FIELD_NUMBER: _ClassVar[int]
+        VALUE_FIELD_NUMBER: _ClassVar[int]
+        key: str
+        value: str
+        def __init__(self, key: _Optional[str] = ..., value: _Optional[str] = ...) -> None: ...
+    ATTRIBUTES_FIELD_NUMBER: _ClassVar[int]
+    FAILED_FIELD_NUMBER: _ClassVar[int]
+    attributes: _containers.ScalarMap[str, str]
+    failed: _containers.ScalarMap[str, str]
+    def __init__(self, attributes: _Optional[_Mapping[str, str]] = ..., failed: _Optional[_Mapping[str, str]] = ...) -> None: ...
+
+class GetHealthRequest(_message.Message):
+    __slots__ = ["key"]
+    KEY_FIELD_NUMBER: _ClassVar[int]
+    key: str
+    def __init__(self, key: _Optional[str] = ...) -> None: ...
+
+class ShardHealth(_message.Message):
+    __slots__ = ["name", "channel", "status", "last_error", "devices", "offline"]
+    NAME_FIELD_NUMBER: _ClassVar[int]
+    CHANNEL_FIELD_NUMBER: _ClassVar[int]
+    STATUS_FIELD_NUMBER: _ClassVar[int]
+    LAST_ERROR_FIELD_NUMBER: _ClassVar[int]
+    DEVICES_FIELD_NUMBER: _ClassVar[int]
+    OFFLINE_FIELD_NUMBER: _ClassVar[int]
+    name: str
+    channel: int
+    status: str
+    last_error: str
+    devices: int
+    offline: int
+    def __init__(self, name: _Optional[str] = ..., channel: _Optional[int] = ..., status: _Optional[str] = ..., last_error: _Optional[str] = ..., devices: _Optional[int] = ..., offline: _Optional[int] = ...) -> None: ...
+
+class GetHealthResponse(_message.Message):
+    __slots__ = ["shards"]
+    SHARDS_FIELD_NUMBER: _ClassVar[int]
+    shards: _containers.RepeatedCompositeFieldContainer[ShardHealth]
+    def __init__(self, shards: _Optional[_Iterable[_Union[ShardHealth, _Mapping]]] = ...) -> None: ...
+
+class GetHistoryRequest(_message.Message):
+    __slots__ = ["key", "device", "since", "limit", "after_seq"]
+    KEY_FIELD_NUMBER: _ClassVar[int]
+    DEVICE_FIELD_NUMBER: _ClassVar[int]
+    SINCE_FIELD_NUMBER: _ClassVar[int]
+    LIMIT_FIELD_NUMBER: _ClassVar[int]
+    AFTER_SEQ_FIELD_NUMBER: _ClassVar[int]
+    key: str
+    device: str
+    since: int
+    limit: int
+    after_seq: int
+    def __init__(self, key: _Optional[str] = ..., device: _Optional[str] = ..., since: _Optional[int] = ..., limit: _Optional[int] = ..., after_seq: _Optional[int] = ...) -> None: ...
+
+class StateChange(_message.Message):
+    __slots__ = ["timestamp", "device", "old_state", "new_state", "source", "seq"]
+    TIMESTAMP_FIELD_NUMBER: _ClassVar[int]
+    DEVICE_FIELD_NUMBER: _ClassVar[int]
+    OLD_STATE_FIELD_NUMBER: _ClassVar[int]
+    NEW_STATE_FIELD_NUMBER: _ClassVar[int]
+    SOURCE_FIELD_NUMBER: _ClassVar[int]
+    SEQ_FIELD_NUMBER: _ClassVar[int]
+    timestamp: int
+    device: str
+    old_state: int
+    new_state: int
+    source: str
+    seq: int
+    def __init__(self, timestamp: _Optional[int] = ..., device: _Optional[str] = ..., old_state: _Optional[int] = ..., new_state: _Optional[int] = ..., source: _Optional[str] = ..., seq: _Optional[int] = ...) -> None: ...
+
+class GetHistoryResponse(_message.Message):
+    __slots__ = ["changes", "more"]
+    CHANGES_FIELD_NUMBER: _ClassVar[int]
+    MORE_FIELD_NUMBER: _ClassVar[int]
+    changes: _containers.RepeatedCompositeFieldContainer[StateChange]
+    more: bool
+    def __init__(self, changes: _Optional[_Iterable[_Union[StateChange, _Mapping]]] = ..., more: bool = ...) -> None: ...
+
+class ControlRequest(_message.Message):
+    __slots__ = ["key", "id", "devices", "timeout", "watch"]
+    KEY_FIELD_NUMBER: _ClassVar[int]
+    ID_FIELD_NUMBER: _ClassVar[int]
+    DEVICES_FIELD_NUMBER: _ClassVar[int]
+    TIMEOUT_FIELD_NUMBER: _ClassVar[int]
+    WATCH_FIELD_NUMBER: _ClassVar[int]
+    key: str
+    id: str
+    devices: DeviceStates
+    timeout: float
+    watch: bool
+    def __init__(self, key: _Optional[str] = ..., id: _Optional[str] = ..., devices: _Optional[_Union[DeviceStates, _Mapping]] = ..., timeout: _Optional[float] = ..., watch: bool = ...) -> None: ...
+
+class CommandResult(_message.Message):
+    __slots__ = ["id", "results", "failed", "rejected", "error"]
+    ID_FIELD_NUMBER: _ClassVar[int]
+    RESULTS_FIELD_NUMBER: _ClassVar[int]
+    FAILED_FIELD_NUMBER: _ClassVar[int]
+    REJECTED_FIELD_NUMBER: _ClassVar[int]
+    ERROR_FIELD_NUMBER: _ClassVar[int]
+    id: str
+    results: DeviceStates
+    failed: _containers.RepeatedScalarFieldContainer[str]
+    rejected: _containers.RepeatedScalarFieldContainer[str]
+    error: str
+    def __init__(self, id: _Optional[str] = ..., results: _Optional[_Union[DeviceStates, _Mapping]] = ..., failed: _Optional[_Iterable[str]] = ..., rejected: _Optional[_Iterable[str]] = ..., error: _Optional[str] = ...) -> None: ...
+
+class ControlResponse(_message.Message):
+    __slots__ = ["result", "event"]
+    RESULT_FIELD_NUMBER: _ClassVar[int]
+    EVENT_FIELD_NUMBER: _ClassVar[int]
+    result: CommandResult
+    event: WatchStateResponse
+    def __init__(self, result: _Optional[_Union[CommandResult, _Mapping]] = ..., event: _Optional[_Union[WatchStateResponse, _Mapping]] = ...) -> None: ...
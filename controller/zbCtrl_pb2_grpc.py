@@ -24,6 +24,36 @@ class ZBCtrlStub(object):
                 request_serializer=zbCtrl__pb2.SetStateRequest.SerializeToString,
                 response_deserializer=zbCtrl__pb2.SetStateResponse.FromString,
                 )
+        self.WatchState = channel.unary_stream(
+                '/zbCtrl.ZBCtrl/WatchState',
+                request_serializer=zbCtrl__pb2.WatchStateRequest.SerializeToString,
+                response_deserializer=zbCtrl__pb2.WatchStateResponse.FromString,
+                )
+        self.ListDevices = channel.unary_unary(
+                '/zbCtrl.ZBCtrl/ListDevices',
+                request_serializer=zbCtrl__pb2.ListDevicesRequest.SerializeToString,
+                response_deserializer=zbCtrl__pb2.ListDevicesResponse.FromString,
+                )
+        self.GetDeviceInfo = channel.unary_unary(
+                '/zbCtrl.ZBCtrl/GetDeviceInfo',
+                request_serializer=zbCtrl__pb2.GetDeviceInfoRequest.SerializeToString,
+                response_deserializer=zbCtrl__pb2.GetDeviceInfoResponse.FromString,
+                )
+        self.GetHealth = channel.unary_unary(
+                '/zbCtrl.ZBCtrl/GetHealth',
+                request_serializer=zbCtrl__pb2.GetHealthRequest.SerializeToString,
+                response_deserializer=zbCtrl__pb2.GetHealthResponse.FromString,
+                )
+        self.GetHistory = channel.unary_unary(
+                '/zbCtrl.ZBCtrl/GetHistory',
+                request_serializer=zbCtrl__pb2.GetHistoryRequest.SerializeToString,
+                response_deserializer=zbCtrl__pb2.GetHistoryResponse.FromString,
+                )
+        self.Control = channel.stream_stream(
+                '/zbCtrl.ZBCtrl/Control',
+                request_serializer=zbCtrl__pb2.ControlRequest.SerializeToString,
+                response_deserializer=zbCtrl__pb2.ControlResponse.FromString,
+                )
 
 
 class ZBCtrlServicer(object):
@@ -41,6 +71,42 @@ class ZBCtrlServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def WatchState(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def ListDevices(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetDeviceInfo(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetHealth(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetHistory(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def Control(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_ZBCtrlServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -54,6 +120,36 @@ def add_ZBCtrlServicer_to_server(servicer, server):
                     request_deserializer=zbCtrl__pb2.SetStateRequest.FromString,
                     response_serializer=zbCtrl__pb2.SetStateResponse.SerializeToString,
             ),
+            'WatchState': grpc.unary_stream_rpc_method_handler(
+                    servicer.WatchState,
+                    request_deserializer=zbCtrl__pb2.WatchStateRequest.FromString,
+                    response_serializer=zbCtrl__pb2.WatchStateResponse.SerializeToString,
+            ),
+            'ListDevices': grpc.unary_unary_rpc_method_handler(
+                    servicer.ListDevices,
+                    request_deserializer=zbCtrl__pb2.ListDevicesRequest.FromString,
+                    response_serializer=zbCtrl__pb2.ListDevicesResponse.SerializeToString,
+            ),
+            'GetDeviceInfo': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetDeviceInfo,
+                    request_deserializer=zbCtrl__pb2.GetDeviceInfoRequest.FromString,
+                    response_serializer=zbCtrl__pb2.GetDeviceInfoResponse.SerializeToString,
+            ),
+            'GetHealth': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetHealth,
+                    request_deserializer=zbCtrl__pb2.GetHealthRequest.FromString,
+                    response_serializer=zbCtrl__pb2.GetHealthResponse.SerializeToString,
+            ),
+            'GetHistory': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetHistory,
+                    request_deserializer=zbCtrl__pb2.GetHistoryRequest.FromString,
+                    response_serializer=zbCtrl__pb2.GetHistoryResponse.SerializeToString,
+            ),
+            'Control': grpc.stream_stream_rpc_method_handler(
+                    servicer.Control,
+                    request_deserializer=zbCtrl__pb2.ControlRequest.FromString,
+                    response_serializer=zbCtrl__pb2.ControlResponse.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'zbCtrl.ZBCtrl', rpc_method_handlers)
@@ -97,3 +193,105 @@ class ZBCtrl(object):
             zbCtrl__pb2.SetStateResponse.FromString,
             options, channel_credentials,
             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def WatchState(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(request, target, '/zbCtrl.ZBCtrl/WatchState',
+            zbCtrl__pb2.WatchStateRequest.SerializeToString,
+            zbCtrl__pb2.WatchStateResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def ListDevices(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/zbCtrl.ZBCtrl/ListDevices',
+            zbCtrl__pb2.ListDevicesRequest.SerializeToString,
+            zbCtrl__pb2.ListDevicesResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def GetDeviceInfo(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/zbCtrl.ZBCtrl/GetDeviceInfo',
+            zbCtrl__pb2.GetDeviceInfoRequest.SerializeToString,
+            zbCtrl__pb2.GetDeviceInfoResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def GetHealth(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/zbCtrl.ZBCtrl/GetHealth',
+            zbCtrl__pb2.GetHealthRequest.SerializeToString,
+            zbCtrl__pb2.GetHealthResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def GetHistory(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/zbCtrl.ZBCtrl/GetHistory',
+            zbCtrl__pb2.GetHistoryRequest.SerializeToString,
+            zbCtrl__pb2.GetHistoryResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def Control(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_stream(request_iterator, target, '/zbCtrl.ZBCtrl/Control',
+            zbCtrl__pb2.ControlRequest.SerializeToString,
+            zbCtrl__pb2.ControlResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
@@ -10,6 +10,8 @@ Communicating withe the Zigbee network and managing its coordinator
 import asyncio
 from enum import IntEnum
 import logging
+import time
+import weakref
 
 #import zigpy
 import zigpy.device # Device
@@ -21,17 +23,51 @@ import zigpy.zcl.foundation # Status, GeneralCommand, TypeValue
 from zigpy_znp.zigbee.application import ControllerApplication
 
 from listener import ZBListenerBase
+import metrics
 
 
 class ZBListener(ZBListenerBase):
     '''Listener of the ControllerApplication to capture events'''
 
-    def __init__(self, callbalckOnOff):
+    def __init__(self, callbalckOnOff, callbackDevice=None):
         self.callbalckOnOff = callbalckOnOff
+        # Device events callback: callbackDevice(device, event) with event 'joined', 'initialized', 'announced', 'left' or 'removed'
+        self.callbackDevice = callbackDevice
+        # Dispatch table of the reports to handle: (profile, cluster, src_ep): handler
+        # Frames from any other source are dropped before being deserialized
+        self._reportHandlers = {
+            (zigpy.profiles.zha.PROFILE_ID, DEVICE_ONOFF_CLUSTER, DEVICE_ONOFF_ENDPOINT): self.handleAttrReport,
+        }
+
+    def device_joined(self, device):
+        super().device_joined(device)
+        if self.callbackDevice:
+            self.callbackDevice(device, 'joined')
+
+    def device_initialized(self, device):
+        super().device_initialized(device)
+        if self.callbackDevice:
+            self.callbackDevice(device, 'initialized')
+
+    def device_announce(self, device):
+        '''Device announcement (eg. powered on again), only sent to the listeners of the device ZDO'''
+        super().device_announce(device)
+        if self.callbackDevice:
+            self.callbackDevice(device, 'announced')
+
+    def device_left(self, device):
+        super().device_left(device)
+        if self.callbackDevice:
+            self.callbackDevice(device, 'left')
+
+    def device_removed(self, device):
+        super().device_removed(device)
+        if self.callbackDevice:
+            self.callbackDevice(device, 'removed')
 
     def handleAttrReport(self, device, cluster, attribute, value):
         '''Handle `Report_Attributes` (ie. state changes)'''
-        logging.info('>>> state change of %s: %s.%s = %s' % (device.ieee, cluster.name, attribute.name, value.name))
+        logging.info('>>> state change of %s: %s.%s = %s', device.ieee, cluster.name, attribute.name, value)
         if cluster.cluster_id == DEVICE_ONOFF_CLUSTER and attribute.name == DEVICE_ONOFF_ATTR:
             asyncio.create_task(self.callbalckOnOff(str(device.ieee), State.ON if value else State.OFF))
 
@@ -40,38 +76,43 @@ class ZBListener(ZBListenerBase):
         '''Generic message handling'''
         # Log
         super().handle_message(device, profile, cluster, src_ep, dst_ep, message)
+        LISTENER_FRAMES.labels(cluster).inc()
+        # Fast path: dropping frames from unhandled sources & other commands than Report_Attributes
+        handler = self._reportHandlers.get((profile, cluster, src_ep))
+        if handler is None or not isReportAttributes(message):
+            return
         try:
-            if not profile == zigpy.profiles.zha.PROFILE_ID:
-                #logging.warning('profile not OK')
-                return
-            if not src_ep in device.endpoints:
-                #logging.warning('src_ep not OK')
-                return
-            endpoint = device.endpoints[src_ep]
-            if not cluster in endpoint.in_clusters:
-                #logging.warning('cluster not OK')
+            endpoint = device.endpoints.get(src_ep)
+            if endpoint is None or cluster not in endpoint.in_clusters:
                 return
             cluster = endpoint.in_clusters[cluster]
-            msg = cluster.deserialize(message)
-            if not msg[0].frame_control.is_general:
-                #logging.warning('frame is not general')
-                return
-            if not msg[0].command_id == zigpy.zcl.foundation.GeneralCommand.Report_Attributes:
-                #logging.warning('command not Report_Attributes')
-                return
-            for attReport in msg[1].attribute_reports:
+            _, report = cluster.deserialize(message)
+            for attReport in report.attribute_reports:
                 if not attReport.attrid in cluster.attributes:
-                    #logging.warning('attribute not OK')
                     continue
                 attribute = cluster.attributes[attReport.attrid]
                 value = attReport.value
                 if type(value) == zigpy.zcl.foundation.TypeValue:
                     value = value.value
-                self.handleAttrReport(device, cluster, attribute, value)
+                handler(device, cluster, attribute, value)
         except Exception as e:
-            logging.warning(e)
+            logging.warning('Unable to handle report from %s: %r', device.ieee, e)
             return
-        
+
+
+# ZCL header (frame control, [manufacturer code,] sequence number, command id)
+ZCL_FRAME_TYPE_MASK = 0b11
+ZCL_FRAME_TYPE_GENERAL = 0b00 # zigpy.zcl.foundation.FrameType.GLOBAL_COMMAND
+ZCL_MANUFACTURER_SPECIFIC = 0b100
+ZCL_REPORT_ATTRIBUTES = int(zigpy.zcl.foundation.GeneralCommand.Report_Attributes)
+
+def isReportAttributes(message):
+    '''Check from the raw ZCL header bytes whether a frame is a general Report_Attributes command'''
+    if not message or message[0] & ZCL_FRAME_TYPE_MASK != ZCL_FRAME_TYPE_GENERAL:
+        return False
+    commandIdx = 4 if message[0] & ZCL_MANUFACTURER_SPECIFIC else 2
+    return len(message) > commandIdx and message[commandIdx] == ZCL_REPORT_ATTRIBUTES
+
 
 
 DEVICE_INFO_ENDPOINT = 1
@@ -113,6 +154,48 @@ DEVICE_ONOFF_ATTRIBUTES = [
 #   'reporting_status',     # zigpy.zcl.clusters.general.OnOff.attributes[65534]
 ]
 DEVICE_ONOFF_ATTR = 'on_off' # zigpy.zcl.clusters.general.OnOff.attributes[0].name
+# Device info: static attributes (cached per device for DEVICE_INFO_CACHE_TTL [seconds], until the device rejoins)
+DEVICE_INFO_STATIC_ATTRIBUTES = frozenset(DEVICE_INFO_ATTRIBUTES) - {'location_desc'}
+DEVICE_INFO_CACHE_TTL = 24*60*60
+# ZCL payload limit of a frame (APS payload without fragmentation, minus the ZCL header) [bytes],
+# assumed size of the strings (& octet strings) of unknown maximum length in read responses [bytes],
+# and of the values of unknown size (the largest ZCL scalar, eg. uint64, double) [bytes]
+ZCL_MAX_PAYLOAD = 82 - 3
+ZCL_STRING_SIZE = 32
+ZCL_VALUE_SIZE = 8
+# Attribute reporting of the on/off state: minimum & maximum interval between two reports [seconds]
+REPORT_MIN_INTERVAL = 1
+REPORT_MAX_INTERVAL = 5*60
+# Group-cast: range of the group IDs managed by the controller, one group per set of devices commanded together
+# (kept small as devices only have a few group table entries, least recently used groups being reassigned)
+GROUPCAST_GROUP_ID_BASE = 0x7A00
+GROUPCAST_MAX_GROUPS = 8
+# Reachability: retries of the requests not acknowledged by a device, and delay before the first retry
+# (doubling at each retry) [seconds]
+REQUEST_RETRIES = 2
+REQUEST_RETRY_DELAY = 0.5
+# Circuit breaker: number of consecutive unreachable requests after which a device is considered offline
+# (requests being then answered State.NA at once), and period of the probe requests to offline devices [seconds]
+OFFLINE_AFTER_FAILURES = 2
+OFFLINE_PROBE_PERIOD = 5*60
+# Device registry: capabilities of the devices
+#   CAPABILITY_ONOFF: devices the controller can command (info & on/off clusters on their endpoints above)
+#   DEVICE_CAPABILITY_CLUSTERS: capability: cluster providing it (on any endpoint)
+#   power source: 'mains' or 'battery', from the node descriptor
+CAPABILITY_ONOFF = 'onoff'
+DEVICE_CAPABILITY_CLUSTERS = {
+    'level': 0x0008,       # zigpy.zcl.clusters.general.LevelControl.cluster_id
+    'color': 0x0300,       # zigpy.zcl.clusters.lighting.Color.cluster_id
+    'temperature': 0x0402, # zigpy.zcl.clusters.measurement.TemperatureMeasurement.cluster_id
+    'occupancy': 0x0406,   # zigpy.zcl.clusters.measurement.OccupancySensing.cluster_id
+    'metering': 0x0702,    # zigpy.zcl.clusters.smartenergy.Metering.cluster_id
+    'electrical': 0x0B04,  # zigpy.zcl.clusters.homeautomation.ElectricalMeasurement.cluster_id
+}
+
+# Metrics
+LISTENER_FRAMES = metrics.Counter('zbctrl_listener_frames_total', 'Frames received by the listener, per cluster', ['cluster'])
+REQUEST_SECONDS = metrics.Histogram('zbctrl_zigbee_request_seconds', 'Latency of each zigpy request attempt to a device', ['op'])
+NA_RESULTS = metrics.Counter('zbctrl_zigbee_na_total', 'Device requests resulting in State.NA (unreachable, offline or error status)', ['op'])
 
 
 class State(IntEnum):
@@ -122,10 +205,161 @@ class State(IntEnum):
     NA = -1 # Device not powered on / accessible
 
 
+class Reachability():
+    '''Reachability tracker of the devices (circuit breaker):
+    devices unreachable several times in a row are considered offline, and only probed at a low rate
+    until they are reachable again (or show up by themselves, eg. announcement or report)'''
+
+    def __init__(self, offlineAfter=OFFLINE_AFTER_FAILURES, probePeriod=OFFLINE_PROBE_PERIOD):
+        self.offlineAfter = offlineAfter
+        self.probePeriod = probePeriod
+        # Consecutive unreachable requests of each device
+        self._failures = {}
+        # Next probe request allowed to each offline device [time.monotonic()]
+        self._nextProbe = {}
+
+    def isOffline(self, deviceId):
+        return deviceId in self._nextProbe
+
+    def offlineCount(self):
+        '''Number of devices currently offline'''
+        return len(self._nextProbe)
+
+    def allow(self, deviceId):
+        '''Whether a request may be sent to device: online, or offline but due for a probe'''
+        nextProbe = self._nextProbe.get(deviceId)
+        if nextProbe is None:
+            return True
+        now = time.monotonic()
+        if now < nextProbe:
+            return False
+        # Single probe per period
+        self._nextProbe[deviceId] = now + self.probePeriod
+        logging.debug('  Probing offline device %s', deviceId)
+        return True
+
+    def success(self, deviceId):
+        '''Device reached (or heard of): online again'''
+        self._failures.pop(deviceId, None)
+        if self._nextProbe.pop(deviceId, None) is not None:
+            logging.info('Device %s back online', deviceId)
+
+    def failure(self, deviceId):
+        '''Device unreachable (after retries)'''
+        self._failures[deviceId] = self._failures.get(deviceId, 0) + 1
+        if self._failures[deviceId] >= self.offlineAfter and deviceId not in self._nextProbe:
+            logging.info('Device %s offline, probing it every %fs', deviceId, self.probePeriod)
+            self._nextProbe[deviceId] = time.monotonic() + self.probePeriod
+
+
+class DeviceEntry():
+    '''Entry of a device in the registry'''
+    __slots__ = ('id', 'nwk', 'manufacturer', 'model', 'capabilities')
+
+    def __init__(self, device):
+        '''Constructor: device zigpy Device'''
+        self.id = str(device.ieee)
+        self.nwk = int(device.nwk)
+        self.manufacturer = device.manufacturer or ''
+        self.model = device.model or ''
+        self.capabilities = self._capabilities(device)
+
+    @staticmethod
+    def _capabilities(device):
+        '''Capabilities of a zigpy Device, as a frozenset'''
+        capabilities = set()
+        clusters = set()
+        for epId, endpoint in device.endpoints.items():
+            if epId == 0:
+                # ZDO
+                continue
+            clusters.update(getattr(endpoint, 'in_clusters', {}))
+        for capability, cluster in DEVICE_CAPABILITY_CLUSTERS.items():
+            if cluster in clusters:
+                capabilities.add(capability)
+        infoEndpoint = device.endpoints.get(DEVICE_INFO_ENDPOINT)
+        onoffEndpoint = device.endpoints.get(DEVICE_ONOFF_ENDPOINT)
+        if DEVICE_INFO_CLUSTER in getattr(infoEndpoint, 'in_clusters', {}) and DEVICE_ONOFF_CLUSTER in getattr(onoffEndpoint, 'in_clusters', {}):
+            capabilities.add(CAPABILITY_ONOFF)
+        if device.node_desc is not None:
+            capabilities.add('mains' if device.node_desc.is_mains_powered else 'battery')
+        return frozenset(capabilities)
+
+    def __eq__(self, other):
+        return isinstance(other, DeviceEntry) and all(getattr(self, attr) == getattr(other, attr) for attr in self.__slots__)
+
+
+class DeviceRegistry():
+    '''Registry of the devices of the network, indexed by capability,
+    kept current with the device events (joined, initialized & removed)'''
+
+    def __init__(self):
+        # Devices: deviceId: DeviceEntry
+        self.devices = {}
+        # Owners of the entries (network the device is paired with, the registry being shared by the shards): deviceId: owner
+        self._owners = {}
+        # Index: capability: set of deviceId
+        self._byCapability = {}
+        # Change callbacks: callback(deviceId, DeviceEntry or None if removed)
+        self._listeners = []
+
+    def addListener(self, callback):
+        '''Call callback(deviceId, DeviceEntry or None if removed) on each change'''
+        self._listeners.append(callback)
+
+    def withCapability(self, capability):
+        '''Devices having capability, as a set of deviceId (read-only)'''
+        return self._byCapability.get(capability, frozenset())
+
+    def update(self, device, owner=None):
+        '''Add or update a zigpy Device, of the network of owner (eg. its ZBInterface)'''
+        entry = DeviceEntry(device)
+        self._owners[entry.id] = owner
+        previous = self.devices.get(entry.id)
+        if entry == previous:
+            return
+        self._unindex(previous)
+        self.devices[entry.id] = entry
+        for capability in entry.capabilities:
+            self._byCapability.setdefault(capability, set()).add(entry.id)
+        logging.debug('Registry: device %s %s', entry.id, sorted(entry.capabilities))
+        for callback in self._listeners:
+            callback(entry.id, entry)
+
+    def remove(self, deviceId, owner=None):
+        '''Remove a device, unless its entry was updated by another owner since (eg. a late event of the network
+        it was paired with before)'''
+        if deviceId in self._owners and self._owners[deviceId] is not owner:
+            logging.debug('Registry: device %s not removed, owned by another network', deviceId)
+            return
+        self._owners.pop(deviceId, None)
+        entry = self.devices.pop(deviceId, None)
+        if entry is None:
+            return
+        self._unindex(entry)
+        logging.debug('Registry: device %s removed', deviceId)
+        for callback in self._listeners:
+            callback(deviceId, None)
+
+    def _unindex(self, entry):
+        if entry is None:
+            return
+        for capability in entry.capabilities:
+            self._byCapability[capability].discard(entry.id)
+
+
 class ZBInterface():
     '''Interface allowing to communicate with Zigbee network devices'''
 
-    def __init__(self, zpDbPath='zigpy.db', adapterPath='/dev/ttyUSB0', zbChannel=20):
+    def __init__(self, zpDbPath='zigpy.db', adapterPath='/dev/ttyUSB0', zbChannel=20, reportMinInterval=REPORT_MIN_INTERVAL, reportMaxInterval=REPORT_MAX_INTERVAL, appFactory=None, name=None):
+        '''Constructor: appFactory async function(zpConfig) returning the started zigpy ControllerApplication,
+        defaults to the zigpy-znp radio (eg. simulator.SimulatedApplication.factory() for a simulated network),
+        name of the interface (shard) in logs & health status, defaults to adapterPath'''
+        self.name = name or adapterPath or 'zigbee'
+        self.channel = zbChannel
+        # Status: 'stopped', 'starting', 'up' or 'down' (start failed, lastError), for health checks
+        self.status = 'stopped'
+        self.lastError = None
         self.zpConfig = {
             zigpy.config.CONF_DEVICE: {
                 zigpy.config.CONF_DEVICE_PATH: adapterPath,
@@ -133,31 +367,151 @@ class ZBInterface():
             zigpy.config.CONF_DATABASE: zpDbPath,
             zigpy.config.CONF_NWK_CHANNEL: zbChannel,
         }
+        self.appFactory = appFactory or self._newZnpApplication
         self.za = None
         self.listener = None
+        self.updateCallback = None
+        # Attribute reporting configuration, and last report time of each device [time.monotonic()]
+        self.reportMinInterval = reportMinInterval
+        self.reportMaxInterval = reportMaxInterval
+        self.lastReport = {}
+        self._reportingTasks = set()
+        # Resolved device handles: deviceId: (device, infoCluster, onoffCluster), invalidated on device events
+        self._handles = {}
+        # Managed groups: frozenset of members deviceId: group ID, in least recently used order,
+        # their (re)assignments being serialized (a group ID being picked before its members are updated)
+        self._groupIds = {}
+        self._groupLock = asyncio.Lock()
+        # Reachability of the devices, and device ZDOs listened to for announcements
+        self.reachability = Reachability()
+        self._announceListened = weakref.WeakSet()
+        # Devices of the network, by capability
+        self.registry = DeviceRegistry()
+        # Cached static info of the devices: deviceId: (expiry [time.monotonic()], dict of attribute: value, dict of unsupported attribute: status)
+        self._infoCache = {}
 
     async def start(self, updateCallback):
         '''Start zigpy'''
-        logging.info('Starting Zigpy...')
-        self.za = await ControllerApplication.new(
-            config=ControllerApplication.SCHEMA(self.zpConfig),
-            auto_form=True,
-            start_radio=True,
-        )
-        self.listener = ZBListener(updateCallback)
+        logging.info('Starting Zigpy (%s)...', self.name)
+        self.status = 'starting'
+        try:
+            self.za = await self.appFactory(self.zpConfig)
+        except Exception as e:
+            self.status, self.lastError = 'down', repr(e)
+            raise
+        self.status = 'up'
+        self.updateCallback = updateCallback
+        self.listener = ZBListener(self._reportCallback, self._deviceCallback)
         self.za.add_listener(self.listener)
         self.za.groups.add_listener(self.listener)
         logging.info('Zigpy started')
+        for device in list(self.za.devices.values()):
+            self.registry.update(device, self)
+        # Recovering the managed groups (persisted by zigpy)
+        for groupId in range(GROUPCAST_GROUP_ID_BASE, GROUPCAST_GROUP_ID_BASE + GROUPCAST_MAX_GROUPS):
+            if groupId in self.za.groups:
+                self._groupIds[self._groupMembers(groupId)] = groupId
+        # (Re)configuring reporting of the known devices, one at a time in the background
+        self._runReportingTask(self._setupAllReporting())
+
+    @staticmethod
+    async def _newZnpApplication(zpConfig):
+        return await ControllerApplication.new(
+            config=ControllerApplication.SCHEMA(zpConfig),
+            auto_form=True,
+            start_radio=True,
+        )
 
     async def stop(self):
         '''Stop zigpy'''
         logging.info('Shutting down Zigpy...')
+        for task in self._reportingTasks:
+            task.cancel()
         if self.za:
             await self.za.shutdown()
             logging.info('Zigpy stopped')
+        self.status = 'stopped'
+
+    def shardOf(self, deviceId):
+        '''Interface (shard) of a device, for per-shard scheduling: this one'''
+        return self
+
+    def health(self):
+        '''Health status of the interface, as a list (of one shard) of dicts:
+        name, channel, status, lastError, devices (in the zigpy network), offline (devices)'''
+        return [{
+            'name': self.name,
+            'channel': self.channel,
+            'status': self.status,
+            'lastError': self.lastError,
+            'devices': len(self.za.devices) if self.za else 0,
+            'offline': self.reachability.offlineCount(),
+        }]
+
+    async def _reportCallback(self, deviceId, state):
+        '''Handle on/off attribute report from the listener'''
+        self.lastReport[deviceId] = time.monotonic()
+        self.reachability.success(deviceId)
+        await self.updateCallback(deviceId, state)
+
+    def _deviceCallback(self, device, event):
+        '''Handle device events from the listener: invalidate its cached handle & info, configure reporting of new & rejoining devices'''
+        # Rejoined, maybe with a new firmware: its static info to be read again
+        self._infoCache.pop(str(device.ieee), None)
+        if event == 'announced':
+            # Device back: fast reset of its reachability
+            self.reachability.success(str(device.ieee))
+            return
+        for deviceId in [deviceId for deviceId, handle in self._handles.items() if handle[0].ieee == device.ieee]:
+            del self._handles[deviceId]
+        if event == 'removed':
+            self.registry.remove(str(device.ieee), self)
+        if event in ['left', 'removed']:
+            return
+        self.reachability.success(str(device.ieee))
+        self.registry.update(device, self)
+        if CAPABILITY_ONOFF not in self.registry.devices[str(device.ieee)].capabilities:
+            # Not (yet, eg. new device waiting for its initialization to know its endpoints) an on/off device
+            return
+        self._runReportingTask(self.setupReporting(str(device.ieee)))
+
+    def _runReportingTask(self, coro):
+        task = asyncio.create_task(coro)
+        self._reportingTasks.add(task)
+        task.add_done_callback(self._reportingTasks.discard)
+
+    async def _setupAllReporting(self):
+        '''Configure reporting of all the known on/off devices'''
+        for deviceId in list(self.registry.withCapability(CAPABILITY_ONOFF)):
+            await self.setupReporting(deviceId)
+
+    async def setupReporting(self, deviceId):
+        '''Bind the on/off cluster of a device to the coordinator and configure its attribute reporting,
+        so that the device reports its state by itself (on change and at least every reportMaxInterval)'''
+        try:
+            _, _, onoffCluster = self._getDevice(deviceId)
+            logging.debug('Configuring reporting of device %s', deviceId)
+            await onoffCluster.bind()
+            res = await onoffCluster.configure_reporting(DEVICE_ONOFF_ATTR, self.reportMinInterval, self.reportMaxInterval, 1)
+        except Exception as e:
+            logging.info('Unable to configure reporting of device %s: %r', deviceId, e)
+            return False
+        records = res[0]
+        if not all(record.status == zigpy.zcl.foundation.Status.SUCCESS for record in records):
+            logging.info('Reporting of device %s not configured: %r', deviceId, records)
+            return False
+        logging.info('Reporting of device %s configured', deviceId)
+        return True
 
     def _getDevice(self, deviceId):
         '''Check that device is of the right type, and return relevant zigpy objects: (device, infoCluster, onoffCluster)'''
+        handle = self._handles.get(deviceId)
+        if handle is None:
+            handle = self._handles[deviceId] = self._resolveDevice(deviceId)
+        return handle
+
+    def _resolveDevice(self, deviceId):
+        '''Resolve device ID into (device, infoCluster, onoffCluster), checking that device is of the right type'''
         dId = zigpy.types.named.EUI64.convert(deviceId)
         if dId not in self.za.devices:
             raise ValueError('Unknown device ID')
@@ -174,57 +528,219 @@ class ZBInterface():
         if DEVICE_ONOFF_CLUSTER not in device.endpoints[DEVICE_ONOFF_ENDPOINT].in_clusters:
             raise ValueError('Cluster #%d not available, make sure device is of the right type' % DEVICE_ONOFF_CLUSTER)
         onoffCluster = device.endpoints[DEVICE_ONOFF_ENDPOINT].in_clusters[DEVICE_ONOFF_CLUSTER]
+        # Announcements are only sent to the listeners of the device ZDO
+        if device.zdo not in self._announceListened:
+            device.zdo.add_listener(self.listener)
+            self._announceListened.add(device.zdo)
         return device, infoCluster, onoffCluster
+
+    async def _request(self, deviceId, op, request, timeout=None):
+        '''Send request() to device (zigpy request coroutine function, named op) and return its result, or None if the device is unreachable:
+        retrying with exponential backoff while the device does not acknowledge, answering at once if it is known offline.
+        Any retry is abandoned after timeout [seconds]'''
+        if not self.reachability.allow(deviceId):
+            logging.debug('  Device %s offline, not requesting', deviceId)
+            return None
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        delay = REQUEST_RETRY_DELAY
+        latency = REQUEST_SECONDS.labels(op)
+        for retry in range(REQUEST_RETRIES + 1):
+            if retry:
+                if deadline is not None and loop.time() + delay >= deadline:
+                    break
+                logging.debug('  Retrying request to %s in %fs', deviceId, delay)
+                await asyncio.sleep(delay)
+                delay *= 2
+            start = time.perf_counter()
+            try:
+                res = await asyncio.wait_for(request(), None if deadline is None else deadline - loop.time())
+            except zigpy.exceptions.DeliveryError as e:
+                if e.status != zigpy.types.MACStatus.MAC_NO_ACK:
+                    raise e
+                logging.debug('  Unable to reach device %s: %r', deviceId, e)
+                continue
+            except asyncio.TimeoutError:
+                if deadline is not None and loop.time() >= deadline:
+                    # Our own deadline, not the device
+                    raise
+                logging.debug('  No response from device %s', deviceId)
+                continue
+            finally:
+                latency.observe(time.perf_counter() - start)
+            self.reachability.success(deviceId)
+            return res
+        self.reachability.failure(deviceId)
+        return None
     
-    async def getAllDeviceInfo(self, deviceId):
-        '''Return all the info about the device and its state'''
+    @staticmethod
+    def _valueSize(attrType):
+        '''Maximum serialized size of a value of the zigpy type attrType [bytes]'''
+        if issubclass(attrType, (str, bytes)):
+            # Length prefix & characters (eg. CharacterString, LVBytes, their Long variants)
+            return getattr(attrType, '_prefix_length', 1) + (getattr(attrType, '_max_len', None) or ZCL_STRING_SIZE)
+        if getattr(attrType, '_length', None) is not None:
+            # Fixed list (eg. EUI64)
+            return attrType._length * ZBInterface._valueSize(attrType._item_type)
+        # Fixed size (integers, enums, bitmaps, floats)
+        return getattr(attrType, '_size', None) or ZCL_VALUE_SIZE
+
+    @staticmethod
+    def _chunkAttributes(cluster, attributes):
+        '''Split the attributes to read from cluster into lists whose read response fits in a ZCL frame'''
+        chunks, chunk, size = [], [], 0
+        for attribute in attributes:
+            # Read attribute status record: ID (2), status (1), type (1) & value
+            attrSize = 4 + ZBInterface._valueSize(cluster.attributes_by_name[attribute].type)
+            if chunk and size + attrSize > ZCL_MAX_PAYLOAD:
+                chunks.append(chunk)
+                chunk, size = [], 0
+            chunk.append(attribute)
+            size += attrSize
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    async def getAllDeviceInfo(self, deviceId, timeout=None):
+        '''Return all the info about the device and its state, as (ok, ko) dicts of attribute name: value or failure status.
+        Static attributes are cached, the others read concurrently in frames fitting the ZCL payload limit,
+        the requests being cancelled after timeout [seconds]'''
         device, infoCluster, onoffCluster = self._getDevice(deviceId)
-        attrInfoOk, attrInfoKo = await infoCluster.read_attributes(DEVICE_INFO_ATTRIBUTES)
-        attrOnoffOk, attrOnoffKo = await onoffCluster.read_attributes(DEVICE_ONOFF_ATTRIBUTES)
-        return (attrInfoOk | attrOnoffOk, attrInfoKo | attrOnoffKo)
+        now = time.monotonic()
+        expires, cachedOk, cachedKo = self._infoCache.get(deviceId, (None, {}, {}))
+        if expires is not None and now >= expires:
+            expires, cachedOk, cachedKo = None, {}, {}
+        reads = [(infoCluster, chunk) for chunk in self._chunkAttributes(infoCluster, [attr for attr in DEVICE_INFO_ATTRIBUTES if attr not in cachedOk and attr not in cachedKo])]
+        reads += [(onoffCluster, chunk) for chunk in self._chunkAttributes(onoffCluster, DEVICE_ONOFF_ATTRIBUTES)]
+        results = await asyncio.gather(*[self._request(deviceId, 'read_attributes', lambda cluster=cluster, chunk=chunk: cluster.read_attributes(chunk), timeout)
+                                         for cluster, chunk in reads])
+        ok, ko = dict(cachedOk), dict(cachedKo)
+        for (_, chunk), res in zip(reads, results):
+            if res is None:
+                ko.update((attr, zigpy.zcl.foundation.Status.TIMEOUT) for attr in chunk)
+            else:
+                ok.update(res[0])
+                ko.update(res[1])
+        # Caching the static values, and the static attributes not supported by the device
+        staticOk = {attr: value for attr, value in ok.items() if attr in DEVICE_INFO_STATIC_ATTRIBUTES}
+        staticKo = {attr: status for attr, status in ko.items() if attr in DEVICE_INFO_STATIC_ATTRIBUTES and status == zigpy.zcl.foundation.Status.UNSUPPORTED_ATTRIBUTE}
+        if len(staticOk) + len(staticKo) > len(cachedOk) + len(cachedKo):
+            self._infoCache[deviceId] = (expires or now + DEVICE_INFO_CACHE_TTL, staticOk, staticKo)
+        return (ok, ko)
 
-    async def getDeviceState(self, deviceId):
-        '''Querry device state (deviceId = EUI64 string)'''
-        logging.debug('Getting state of device %s' % deviceId)
+    async def getDeviceState(self, deviceId, timeout=None):
+        '''Querry device state (deviceId = EUI64 string), the request being cancelled after timeout [seconds]'''
+        logging.debug('Getting state of device %s', deviceId)
         _, _, onoffCluster = self._getDevice(deviceId)
-        logging.debug('  Requesting device state: %s' % deviceId)
-        try:
-            rOk, rKo = await onoffCluster.read_attributes([DEVICE_ONOFF_ATTR])
-        except zigpy.exceptions.DeliveryError as e:
-            if e.status == zigpy.types.MACStatus.MAC_NO_ACK:
-                logging.debug('  Unable to reach device: %r' % e)
-                return State.NA
-            else:
-                raise e
-        logging.debug('  Got state ok=%s, ko=%s' % (rOk, rKo))
+        logging.debug('  Requesting device state: %s', deviceId)
+        res = await self._request(deviceId, 'read_attributes', lambda: onoffCluster.read_attributes([DEVICE_ONOFF_ATTR]), timeout)
+        if res is None:
+            NA_RESULTS.labels('read_attributes').inc()
+            return State.NA
+        rOk, rKo = res
+        logging.debug('  Got state ok=%s, ko=%s', rOk, rKo)
         if DEVICE_ONOFF_ATTR not in rOk:
-            logging.debug('Unable to get on/off value: %r' % rKo)
+            logging.debug('Unable to get on/off value: %r', rKo)
+            NA_RESULTS.labels('read_attributes').inc()
             return State.NA
         return State.ON if rOk[DEVICE_ONOFF_ATTR] else State.OFF
 
-    async def setDeviceState(self, deviceId, newState):
-        '''Send command to set device state'''
-        logging.info('Setting state of %s to %s' % (deviceId, newState))
+    async def setDeviceState(self, deviceId, newState, timeout=None):
+        '''Send command to set device state, the request being cancelled after timeout [seconds]'''
+        logging.info('Setting state of %s to %s', deviceId, newState)
         _, _, onoffCluster = self._getDevice(deviceId)
         if newState not in [State.ON, State.OFF]:
-            logging.warning('  Invalid newState %r' % newState)
+            logging.warning('  Invalid newState %r', newState)
             raise ValueError('Invalid newState, should be State.ON or State.OFF')
         cmd = 1 if newState == State.ON else 0
         # cmd=2 would be to toggle state, not needed here
-        logging.debug('  Sending command: %s < %s' % (deviceId, cmd))
-        try:
-            res = await onoffCluster.command(cmd)
-        except zigpy.exceptions.DeliveryError as e:
-            if e.status == zigpy.types.MACStatus.MAC_NO_ACK:
-                logging.info('  Unable to reach device: %r' % e)
-                return State.NA
-            else:
-                raise e
+        logging.debug('  Sending command: %s < %s', deviceId, cmd)
+        res = await self._request(deviceId, 'command', lambda: onoffCluster.command(cmd), timeout)
+        if res is None:
+            logging.info('  Unable to reach device %s', deviceId)
+            NA_RESULTS.labels('command').inc()
+            return State.NA
         if res.status != zigpy.zcl.foundation.Status.SUCCESS:
             logging.warning('  Error setting state: %r', res)
+            NA_RESULTS.labels('command').inc()
             return State.NA
         return newState
 
+    def _groupMembers(self, groupId):
+        '''Current members of a group, as a frozenset of deviceId'''
+        if groupId not in self.za.groups:
+            return frozenset()
+        return frozenset(str(endpoint.device.ieee) for endpoint in self.za.groups[groupId].members.values())
+
+    def hasGroup(self, deviceIds):
+        '''Whether a managed group has exactly deviceIds as members'''
+        return frozenset(deviceIds) in self._groupIds
+
+    async def _ensureGroup(self, deviceIds):
+        '''Return the ID of a managed group having exactly deviceIds as members,
+        reusing the least recently used group (and updating its members) if needed.
+        Raises if the group members could not be updated'''
+        members = frozenset(deviceIds)
+        groupId = self._groupIds.pop(members, None)
+        if groupId is not None:
+            self._groupIds[members] = groupId
+            return groupId
+        async with self._groupLock:
+            groupId = self._groupIds.pop(members, None)
+            if groupId is not None:
+                self._groupIds[members] = groupId
+                return groupId
+            usedIds = set(self._groupIds.values())
+            freeIds = [i for i in range(GROUPCAST_GROUP_ID_BASE, GROUPCAST_GROUP_ID_BASE + GROUPCAST_MAX_GROUPS) if i not in usedIds]
+            if freeIds:
+                groupId = freeIds[0]
+            else:
+                groupId = self._groupIds.pop(next(iter(self._groupIds)))
+            oldMembers = self._groupMembers(groupId)
+            logging.info('Assigning group 0x%04X to %d devices', groupId, len(members))
+            async def removeMember(deviceId):
+                try:
+                    device, _, _ = self._getDevice(deviceId)
+                    status = await device.endpoints[DEVICE_ONOFF_ENDPOINT].remove_from_group(groupId)
+                except Exception as e:
+                    status = e
+                if status not in [zigpy.zcl.foundation.Status.SUCCESS, zigpy.zcl.foundation.Status.NOT_FOUND]:
+                    logging.warning('  Unable to remove device %s from group 0x%04X: %r', deviceId, groupId, status)
+                    return False
+                return True
+            async def addMember(deviceId):
+                device, _, _ = self._getDevice(deviceId)
+                status = await device.endpoints[DEVICE_ONOFF_ENDPOINT].add_to_group(groupId, 'zbCtrl 0x%04X' % groupId)
+                if status not in [zigpy.zcl.foundation.Status.SUCCESS, zigpy.zcl.foundation.Status.DUPLICATE_EXISTS]:
+                    raise RuntimeError('Unable to add device %s to group 0x%04X: %r' % (deviceId, groupId, status))
+            removed = await asyncio.gather(*[removeMember(deviceId) for deviceId in oldMembers - members])
+            if not all(removed):
+                # Stale members would also execute the commands sent to the group: not reassigned,
+                # it is kept as the group of its actual members (their removal being retried when next reused)
+                self._groupIds[self._groupMembers(groupId)] = groupId
+                raise RuntimeError('Unable to remove the previous members of group 0x%04X' % groupId)
+            # On failure the group is left unassigned, and its actual members fixed when next reused
+            await asyncio.gather(*[addMember(deviceId) for deviceId in members - oldMembers])
+            self._groupIds[members] = groupId
+            return groupId
+
+    async def setGroupState(self, deviceIds, newState, timeout=None):
+        '''Send a single group (multicast) command to set the state of several devices,
+        the requests (group setup & command) being cancelled after timeout [seconds].
+        No confirmation is returned: the devices report their new state themselves'''
+        logging.info('Setting state of %d devices to %s by group', len(deviceIds), newState)
+        if newState not in [State.ON, State.OFF]:
+            logging.warning('  Invalid newState %r', newState)
+            raise ValueError('Invalid newState, should be State.ON or State.OFF')
+        for deviceId in deviceIds:
+            self._getDevice(deviceId)
+        async def sendGroupCommand():
+            groupId = await self._ensureGroup(deviceIds)
+            cmd = 1 if newState == State.ON else 0
+            logging.debug('  Sending group command: 0x%04X < %s', groupId, cmd)
+            await self.za.groups[groupId].endpoint[DEVICE_ONOFF_CLUSTER].command(cmd)
+        await asyncio.wait_for(sendGroupCommand(), timeout)
+
     async def allowPair(self, duration=60):
         '''CLI: Sets the controller in state to allow devices pairing'''
         return await self.za.permit(duration)
@@ -267,14 +783,14 @@ class ZBInterface():
 
 
 if __name__ =="__main__":
-    import time
-    logging.basicConfig(format='%(asctime)s %(levelname)s %(module)s/%(funcName)s %(message)s', encoding='utf-8', level=logging.INFO)
+    import logsetup
+    logsetup.setup(logging.INFO)
     ZP_DB_PATH = 'zigpy.db'
     ADAPTER_PATH = '/dev/ttyUSB0'
     ZB_CHANNEL = 20
     async def main():
         zbi = ZBInterface(ZP_DB_PATH, ADAPTER_PATH, ZB_CHANNEL)
-        await zbi.start(lambda device, state: logging.info('State change: %s=%r' % (device, state)))
+        await zbi.start(lambda device, state: logging.info('State change: %s=%r', device, state))
         while True:
             print('''
 Commands: